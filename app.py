@@ -1,10 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, has_request_context, g
 from werkzeug.exceptions import HTTPException
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, inspect, text
+from sqlalchemy import event, func, inspect, text
 import requests, secrets
+import csv
+import json
 from datetime import datetime, timedelta, timezone, date
 from dateutil import tz
 import logging
@@ -15,7 +17,16 @@ import os
 import hashlib
 import msal
 import html
+import random
 import re
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+import abc
+import bisect
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +40,12 @@ CORS(app, origins=[
     "https://stock-simulator-frontend.vercel.app",
     "https://simulator.gostockpro.com",
     "http://localhost:3000"
+], expose_headers=[
+    # Response headers the frontend reads; browsers hide non-safelisted headers otherwise.
+    "ETag",
+    "X-Total-Count",
+    "X-Leaderboard-Finalized-At",
+    "X-Request-Degraded",
 ])
 
 
@@ -83,6 +100,7 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)  # Admin flag
     start_of_day_value = db.Column(db.Float, default=100000.0)  # Daily P&L anchor
     realized_pnl = db.Column(db.Float, default=0.0)
+    portfolio_version = db.Column(db.Integer, nullable=False, default=0)  # bumped when /user accounts change
 
    
 
@@ -125,6 +143,7 @@ class Competition(db.Model):
     featured = db.Column(db.Boolean, default=False)
     max_position_limit = db.Column(db.String(10), nullable=True)
     is_open = db.Column(db.Boolean, default=True)  # True for open; False for restricted
+    finalized_at = db.Column(db.DateTime, nullable=True)  # set once final standings are stored
 
 class Curriculum(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -305,6 +324,68 @@ class AccountPerformanceHistory(db.Model):
         db.Index('ix_account_performance_lookup', 'username', 'account_type', 'account_id', 'date'),
     )
 
+class PriceBar(db.Model):
+    __tablename__ = 'price_bar'
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(10), nullable=False)
+    interval = db.Column(db.String(8), nullable=False)  # 5min | daily | weekly
+    timestamp = db.Column(db.DateTime, nullable=False)  # America/New_York wall time, as the provider reports it
+    open = db.Column(db.Float, nullable=True)
+    high = db.Column(db.Float, nullable=True)
+    low = db.Column(db.Float, nullable=True)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=True)
+    # The unique index doubles as the (symbol, interval, timestamp) range-scan index for chart reads.
+    __table_args__ = (
+        db.UniqueConstraint('symbol', 'interval', 'timestamp', name='_price_bar_uc'),
+    )
+
+class LastKnownPrice(db.Model):
+    __tablename__ = 'last_known_price'
+    symbol = db.Column(db.String(10), primary_key=True)
+    price = db.Column(db.Float, nullable=False)
+    prev_close = db.Column(db.Float, nullable=True)
+    as_of = db.Column(db.DateTime, nullable=False)  # UTC time the provider last returned this quote
+
+class AccountState(db.Model):
+    """Materialized holdings of one global, competition or team-competition account."""
+    __tablename__ = 'account_state'
+    account_type = db.Column(db.String(20), primary_key=True)  # global | competition | team_competition
+    account_id = db.Column(db.Integer, primary_key=True)  # user, competition member or competition team id
+    positions = db.Column(db.JSON, nullable=False, default=list)  # [[symbol, quantity, buy_price], ...] in holding order
+
+    def holdings(self):
+        return [AccountPosition(symbol, quantity, buy_price) for symbol, quantity, buy_price in self.positions]
+
+class DailyPrevClose(db.Model):
+    """Previous close of a held symbol as captured at the open of ``trading_date`` (US/Eastern)."""
+    __tablename__ = 'daily_prev_close'
+    trading_date = db.Column(db.Date, primary_key=True)
+    symbol = db.Column(db.String(10), primary_key=True)
+    prev_close = db.Column(db.Float, nullable=False)
+
+class AccountDailyBaseline(db.Model):
+    """Start-of-day value (cash + quantity x previous close) of one account for ``trading_date``."""
+    __tablename__ = 'account_daily_baseline'
+    trading_date = db.Column(db.Date, primary_key=True)
+    account_type = db.Column(db.String(20), primary_key=True)
+    account_id = db.Column(db.Integer, primary_key=True)
+    start_of_day_value = db.Column(db.Float, nullable=False)
+
+class CompetitionResult(db.Model):
+    """Final standing of one account in an ended competition, written once at settlement."""
+    __tablename__ = 'competition_result'
+    competition_id = db.Column(db.Integer, db.ForeignKey('competition.id'), primary_key=True)
+    kind = db.Column(db.String(20), primary_key=True)  # competition | team_competition
+    account_id = db.Column(db.Integer, primary_key=True)
+    lookup_key = db.Column(db.String(80), nullable=False)
+    name = db.Column(db.String(80), nullable=True)
+    rank = db.Column(db.Integer, nullable=False)
+    total_value = db.Column(db.Float, nullable=False)
+    pnl = db.Column(db.Float, nullable=False)
+    return_pct = db.Column(db.Float, nullable=False)
+    prices_stale = db.Column(db.Boolean, nullable=False, default=False)
+
 with app.app_context():
     db.create_all()
 
@@ -329,6 +410,23 @@ def ensure_schema_compatibility():
         dialect = db.engine.dialect.name  # 'postgresql', 'sqlite', etc.
         bool_false = 'FALSE' if dialect == 'postgresql' else '0'
 
+        if 'user' in table_names:
+            existing_cols = {c['name'] for c in insp.get_columns('user')}
+            if 'portfolio_version' not in existing_cols:
+                _safe_exec('ALTER TABLE "user" ADD COLUMN portfolio_version INTEGER NOT NULL DEFAULT 0')
+
+        if 'account_state' in table_names:
+            # Earlier builds stored unread valuation and cash columns; cash NOT NULL would reject inserts.
+            existing_cols = {c['name'] for c in insp.get_columns('account_state')}
+            for col_name in ('cash', 'cost_basis', 'last_valuation', 'last_valued_at'):
+                if col_name in existing_cols:
+                    _safe_exec(f'ALTER TABLE account_state DROP COLUMN {col_name}')
+
+        if 'competition' in table_names:
+            existing_cols = {c['name'] for c in insp.get_columns('competition')}
+            if 'finalized_at' not in existing_cols:
+                _safe_exec('ALTER TABLE competition ADD COLUMN finalized_at TIMESTAMP')
+
         if 'competition_team' in table_names:
             existing_cols = {c['name'] for c in insp.get_columns('competition_team')}
             needed = {
@@ -3573,333 +3671,1982 @@ def is_rate_limited(email_hash, request_ip):
     return ip_count >= PASSWORD_RESET_RATE_LIMIT_IP or email_count >= PASSWORD_RESET_RATE_LIMIT_EMAIL
 
 # --------------------
-# Helper Function: Fetch current price from Alpha Vantage
+# Request Deadlines
 # --------------------
-def get_current_price(symbol):
-    url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&entitlement=realtime&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Alpha Vantage API error: {response.status_code}")
-    data = response.json()
-    if "Global Quote" not in data or not data["Global Quote"]:
-        raise Exception(f"No data found for symbol {symbol}")
-    global_quote = data["Global Quote"]
-    if "05. price" not in global_quote:
-        raise Exception(f"No price information available for symbol {symbol}")
-    return float(global_quote["05. price"])
+# Every request gets a latency budget. Provider calls check it first and shrink their
+# timeouts to what is left; database reads may run REQUEST_DEADLINE_DB_GRACE_SECONDS past it
+# so a response can still be assembled from what was fetched. 0 disables the budget.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "8"))
+REQUEST_DEADLINE_DB_GRACE_SECONDS = float(os.getenv("REQUEST_DEADLINE_DB_GRACE_SECONDS", "2"))
 
 
-def get_current_and_prev_close(symbol):
-    url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&entitlement=realtime&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Alpha Vantage API error: {response.status_code}")
-    data = response.json()
-    if "Global Quote" not in data or not data["Global Quote"]:
-        raise Exception(f"No data found for symbol {symbol}")
+class DeadlineExceededError(Exception):
+    pass
 
-    global_quote = data["Global Quote"]
-    current_price = float(global_quote.get("05. price") or 0.0)
-    # Prefer the quote-level change field when available. This can be more reliable than
-    # "08. previous close" around corporate actions and prevents large incorrect day P&L swings.
-    quote_change = global_quote.get("09. change")
-    if quote_change is not None and str(quote_change).strip() != "":
-        try:
-            prev_close = current_price - float(quote_change)
-        except (TypeError, ValueError):
-            prev_close = float(global_quote.get("08. previous close") or 0.0)
-    else:
-        prev_close = float(global_quote.get("08. previous close") or 0.0)
-    if prev_close <= 0:
-        prev_close = current_price
-    return current_price, prev_close
 
+@app.before_request
+def _start_request_deadline():
+    g.request_deadline = time.monotonic() + REQUEST_DEADLINE_SECONDS if REQUEST_DEADLINE_SECONDS > 0 else None
+    g.request_degraded = False
 
-VALID_RANGES = {"1D", "1W", "1M", "6M", "1Y"}
 
+@app.after_request
+def _flag_degraded_response(response):
+    if g.get("request_degraded"):
+        response.headers["X-Request-Degraded"] = "true"
+    return response
 
-def _round_metric(value, places=4):
-    if value is None:
+
+@app.errorhandler(DeadlineExceededError)
+def handle_deadline_exceeded(err):
+    return jsonify({**_error_payload(str(err), "deadline_exceeded"), "degraded": True}), 503
+
+
+def remaining_request_budget(grace=0.0):
+    """Seconds left in the current request's budget, or ``None`` outside a budgeted request."""
+    if not has_request_context():
         return None
-    return round(float(value), places)
+    deadline = g.get("request_deadline")
+    if deadline is None:
+        return None
+    return deadline + grace - time.monotonic()
 
 
-def _market_session(now_est):
-    if now_est.weekday() >= 5:
-        return "closed"
-    market_open = now_est.replace(hour=9, minute=30, second=0, microsecond=0)
-    regular_close = now_est.replace(hour=16, minute=0, second=0, microsecond=0)
-    post_close = now_est.replace(hour=20, minute=0, second=0, microsecond=0)
-    if now_est < market_open:
-        return "pre"
-    if now_est <= regular_close:
-        return "regular"
-    if now_est <= post_close:
-        return "post"
-    return "closed"
+def mark_request_degraded():
+    if has_request_context():
+        g.request_degraded = True
 
 
-def _fetch_alpha_vantage(params):
-    response = requests.get("https://www.alphavantage.co/query", params=params, timeout=15)
-    if response.status_code != 200:
-        raise Exception(f"Alpha Vantage API error: {response.status_code}")
-    data = response.json()
-    if isinstance(data, dict) and data.get("Note"):
-        raise Exception(data["Note"])
-    return data
+def is_request_degraded():
+    return has_request_context() and bool(g.get("request_degraded"))
 
 
-def _parse_chart_points(time_series):
-    points = []
-    for ts, point in time_series.items():
-        price_val = point.get("4. close") or point.get("5. adjusted close")
-        if not price_val:
-            continue
-        ts_normalized = ts.replace(" ", "T")
-        if len(ts_normalized) == 10:
-            ts_normalized = f"{ts_normalized}T00:00:00"
-        dt = datetime.fromisoformat(ts_normalized)
-        points.append({"timestamp": dt, "price": float(price_val)})
-    points.sort(key=lambda x: x["timestamp"])
-    return points
+def check_request_deadline(operation, grace=0.0):
+    """Raise ``DeadlineExceededError`` (and flag the response degraded) once the budget is spent."""
+    remaining = remaining_request_budget(grace)
+    if remaining is not None and remaining <= 0:
+        mark_request_degraded()
+        raise DeadlineExceededError(f"Request deadline exceeded before {operation}")
+    return remaining
 
 
-def _range_window(range_param, now_est):
-    if range_param == "1D":
-        return now_est.replace(hour=0, minute=0, second=0, microsecond=0)
-    if range_param == "1W":
-        return now_est - timedelta(days=7)
-    if range_param == "1M":
-        return now_est - timedelta(days=30)
-    if range_param == "6M":
-        return now_est - timedelta(days=182)
-    return now_est - timedelta(days=365)
+def _deadline_bounded_timeout(timeout, operation):
+    """Shrink a requests-style ``timeout`` to the remaining budget; returns ``(timeout, bounded)``."""
+    remaining = check_request_deadline(operation)
+    if remaining is None:
+        return timeout, False
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    bounded = remaining < read
+    return (min(connect, remaining), min(read, remaining)), bounded
 
 
-def build_stock_overview(symbol, range_param):
-    range_param = (range_param or "1M").upper()
-    if range_param not in VALID_RANGES:
-        raise ValueError("Invalid range")
+def _check_request_deadline_before_read(conn, cursor, statement, parameters, context, executemany):
+    # Writes are never cut off mid-transaction; only reads are refused once the budget is gone.
+    if statement.lstrip()[:6].upper() == "SELECT":
+        check_request_deadline("database read", grace=REQUEST_DEADLINE_DB_GRACE_SECONDS)
 
-    now_utc = datetime.now(timezone.utc)
-    now_est = now_utc.astimezone(pytz.timezone("America/New_York"))
-    window_start_est = _range_window(range_param, now_est)
 
-    quote_data = _fetch_alpha_vantage({
-        "function": "GLOBAL_QUOTE",
-        "symbol": symbol,
-        "entitlement": "realtime",
-        "apikey": ALPHA_VANTAGE_API_KEY,
-    })
-    global_quote = quote_data.get("Global Quote") or {}
-    current_price = float(global_quote.get("05. price") or 0)
-    prev_close_price = float(global_quote.get("08. previous close") or 0)
+def _bound_statement_timeout(session, transaction, connection):
+    # Only read-only requests get a statement timeout, so a trade is never aborted half-written.
+    if connection.dialect.name != "postgresql" or not has_request_context() or request.method not in ("GET", "HEAD"):
+        return
+    remaining = remaining_request_budget(grace=REQUEST_DEADLINE_DB_GRACE_SECONDS)
+    if remaining is not None:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(100, int(remaining * 1000))}")
 
-    quote_change_value = global_quote.get("09. change")
-    quote_change_percent = global_quote.get("10. change percent")
-    if quote_change_percent is not None:
-        quote_change_percent = quote_change_percent.replace("%", "")
 
-    if range_param == "1D":
-        series_params = {
-            "function": "TIME_SERIES_INTRADAY",
-            "symbol": symbol,
-            "interval": "5min",
-            "apikey": ALPHA_VANTAGE_API_KEY,
-        }
-        ts_key_resolver = lambda d: next((k for k in d if "Time Series" in k), None)
-    elif range_param in {"1W", "1M"}:
-        series_params = {"function": "TIME_SERIES_DAILY_ADJUSTED", "symbol": symbol, "apikey": ALPHA_VANTAGE_API_KEY}
-        ts_key_resolver = lambda _: "Time Series (Daily)"
-    else:
-        series_params = {"function": "TIME_SERIES_WEEKLY_ADJUSTED", "symbol": symbol, "apikey": ALPHA_VANTAGE_API_KEY}
-        ts_key_resolver = lambda _: "Weekly Adjusted Time Series"
-
-    series_data = _fetch_alpha_vantage(series_params)
-    ts_key = ts_key_resolver(series_data)
-    if not ts_key or ts_key not in series_data:
-        raise Exception(f"No valid chart data found for symbol {symbol}")
-
-    points = _parse_chart_points(series_data[ts_key])
-    filtered_points = []
-    est_tz = pytz.timezone("America/New_York")
-    for point in points:
-        if point["timestamp"].tzinfo is None:
-            point_est = est_tz.localize(point["timestamp"])
-        else:
-            point_est = point["timestamp"].astimezone(est_tz)
-        if point_est >= window_start_est:
-            filtered_points.append(point)
+# Registered on this app's engine and session factory rather than the global Engine/Session
+# classes, so re-importing the module does not stack another copy of each listener.
+with app.app_context():
+    event.listen(db.engine, "before_cursor_execute", _check_request_deadline_before_read)
+event.listen(db.session, "after_begin", _bound_statement_timeout)
 
-    if not filtered_points and points:
-        filtered_points = [points[-1]]
 
-    if prev_close_price <= 0:
-        daily_data = _fetch_alpha_vantage({"function": "TIME_SERIES_DAILY_ADJUSTED", "symbol": symbol, "apikey": ALPHA_VANTAGE_API_KEY})
-        daily_series = daily_data.get("Time Series (Daily)", {})
-        prev_close_candidates = sorted(daily_series.items(), key=lambda item: item[0], reverse=True)
-        if len(prev_close_candidates) > 1:
-            prev_close_price = float(prev_close_candidates[1][1].get("4. close") or prev_close_candidates[1][1].get("5. adjusted close") or 0)
+# --------------------
+# Market Data: Alpha Vantage Client
+# --------------------
+ALPHA_VANTAGE_BASE_URL = "https://www.alphavantage.co/query"
+MARKET_DATA_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MARKET_DATA_CONNECT_TIMEOUT_SECONDS", "3.05"))
+MARKET_DATA_READ_TIMEOUT_SECONDS = float(os.getenv("MARKET_DATA_READ_TIMEOUT_SECONDS", "10"))
+MARKET_DATA_MAX_RETRIES = int(os.getenv("MARKET_DATA_MAX_RETRIES", "2"))
+MARKET_DATA_BACKOFF_BASE_SECONDS = float(os.getenv("MARKET_DATA_BACKOFF_BASE_SECONDS", "0.5"))
+# Least request budget worth starting another attempt with after a retryable failure.
+MARKET_DATA_MIN_ATTEMPT_SECONDS = float(os.getenv("MARKET_DATA_MIN_ATTEMPT_SECONDS", "0.5"))
+MARKET_DATA_POOL_SIZE = int(os.getenv("MARKET_DATA_POOL_SIZE", "20"))
 
-    if quote_change_value is not None and quote_change_percent is not None:
-        today_change_value = float(quote_change_value)
-        today_change_percent = float(quote_change_percent)
-    else:
-        today_change_value = current_price - prev_close_price
-        today_change_percent = (today_change_value / prev_close_price * 100.0) if prev_close_price > 0 else None
 
-    if range_param == "1D" and prev_close_price > 0:
-        range_start_price = prev_close_price
-        range_change_value = today_change_value
-        range_change_percent = today_change_percent
-    else:
-        range_start_price = filtered_points[0]["price"] if filtered_points else current_price
-        range_change_value = current_price - range_start_price
-        range_change_percent = (range_change_value / range_start_price * 100.0) if range_start_price > 0 else None
+# Token bucket shared by every provider call. 0 disables limiting.
+MARKET_DATA_RATE_LIMIT_PER_MINUTE = float(os.getenv("MARKET_DATA_RATE_LIMIT_PER_MINUTE", "75"))
+MARKET_DATA_RATE_LIMIT_BURST = int(os.getenv("MARKET_DATA_RATE_LIMIT_BURST", "10"))
+# Tokens batch work must leave in the bucket so trades and UI reads never find it empty.
+MARKET_DATA_BATCH_RESERVE_TOKENS = int(os.getenv("MARKET_DATA_BATCH_RESERVE_TOKENS", "2"))
+MARKET_DATA_PRIORITY_MAX_WAIT_SECONDS = {"trade": 10.0, "display": 5.0, "batch": 60.0}
+TRADE_ENDPOINTS = {
+    "buy_stock", "sell_stock", "competition_buy", "competition_sell",
+    "team_buy", "team_sell", "competition_team_buy", "competition_team_sell",
+}
 
-    app.logger.info(
-        "stock_overview_metrics symbol=%s range=%s as_of=%s current=%s prev_close=%s range_start=%s",
-        symbol,
-        range_param,
-        now_utc.isoformat(),
-        current_price,
-        prev_close_price,
-        range_start_price,
-    )
-    if prev_close_price <= 0 or range_start_price <= 0:
-        app.logger.warning("metric_warning_missing_baseline symbol=%s range=%s", symbol, range_param)
 
-    chart_points = [
-        {
-            "timestamp": p["timestamp"].isoformat(),
-            "price": _round_metric(p["price"]),
-        }
-        for p in filtered_points
-    ]
+# Consecutive provider failures that open the circuit, and how long it stays open before one probe call.
+MARKET_DATA_BREAKER_FAILURE_THRESHOLD = int(os.getenv("MARKET_DATA_BREAKER_FAILURE_THRESHOLD", "5"))
+MARKET_DATA_BREAKER_RESET_SECONDS = float(os.getenv("MARKET_DATA_BREAKER_RESET_SECONDS", "30"))
 
-    latest_point_ts = chart_points[-1]["timestamp"] if chart_points else now_utc.isoformat()
-    is_stale = False
-    if chart_points:
-        latest_ts = datetime.fromisoformat(latest_point_ts)
-        if latest_ts.tzinfo is None:
-            latest_ts = latest_ts.replace(tzinfo=timezone.utc)
-        age_seconds = (now_utc - latest_ts.astimezone(timezone.utc)).total_seconds()
-        is_stale = age_seconds > 900
-        if is_stale:
-            app.logger.warning("provider_data_stale symbol=%s range=%s latest_point_ts=%s age_seconds=%s", symbol, range_param, latest_point_ts, age_seconds)
 
-    app.logger.info("provider_snapshot symbol=%s quote_timestamp=%s chart_latest=%s", symbol, now_utc.isoformat(), latest_point_ts)
+class _RetryableProviderError(Exception):
+    pass
 
-    return {
-        "symbol": symbol.upper(),
-        "as_of_timestamp": now_utc.isoformat(),
-        "current_price": _round_metric(current_price),
-        "prev_close_price": _round_metric(prev_close_price),
-        "today_change_value": _round_metric(today_change_value),
-        "today_change_percent": _round_metric(today_change_percent),
-        "range": range_param,
-        "range_start_price": _round_metric(range_start_price),
-        "range_change_value": _round_metric(range_change_value),
-        "range_change_percent": _round_metric(range_change_percent),
-        "chart_points": chart_points,
-        "metadata": {
-            "price_source": "alpha_vantage",
-            "timezone": "America/New_York",
-            "market_session": _market_session(now_est),
-            "is_stale": is_stale,
-        },
-    }
 
+class _ProviderTimeoutError(_RetryableProviderError):
+    pass
 
-def _account_display_name(account_type, competition_name=None, competition_code=None, team_name=None):
-    if account_type == "global":
-        return "Global Account"
-    if account_type == "competition":
-        return competition_name or competition_code
-    if account_type == "team_competition":
-        if team_name and (competition_name or competition_code):
-            return f"{team_name} • {competition_name or competition_code}"
-        return team_name or competition_name or competition_code
-    return "Account"
 
+class MarketDataRateLimitError(Exception):
+    pass
 
-VALID_ACCOUNT_TYPES = {"global", "competition", "team_competition"}
 
+class UnknownSymbolError(Exception):
+    pass
 
-def _normalize_account_type(raw_account_type):
-    if raw_account_type is None:
+
+class MarketDataUnavailableError(Exception):
+    pass
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
         return None
-    normalized = str(raw_account_type).strip().lower()
-    if normalized in {"competition individual", "competition_individual"}:
-        return "competition"
-    if normalized == "team":
-        return "team_competition"
-    return normalized
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
 
 
-def _parse_snapshot_date(raw_date):
-    if raw_date in (None, ""):
-        return datetime.now(timezone.utc).date()
-    if isinstance(raw_date, date):
-        return raw_date
-    try:
-        return datetime.strptime(str(raw_date), "%Y-%m-%d").date()
-    except ValueError:
-        raise ValueError("date must be in YYYY-MM-DD format")
+def _normalize_symbol(symbol):
+    return str(symbol or "").strip().upper()
 
 
-def _validate_performance_payload(data):
-    username = (data.get("username") or "").strip()
-    account_id = str(data.get("account_id") or "").strip()
-    account_type = _normalize_account_type(data.get("account_type"))
+def current_market_data_priority():
+    """Trade endpoints fetch as ``trade``, other requests as ``display``, jobs and background threads as ``batch``."""
+    if not has_request_context():
+        return "batch"
+    if request.endpoint in TRADE_ENDPOINTS:
+        return "trade"
+    return "display"
 
-    if not username:
-        return None, "username is required"
-    if not account_id:
-        return None, "account_id is required"
-    if not account_type:
-        return None, "account_type is required"
-    if account_type not in VALID_ACCOUNT_TYPES:
-        return None, "account_type is invalid"
 
-    try:
-        snapshot_date = _parse_snapshot_date(data.get("date"))
-    except ValueError as exc:
-        return None, str(exc)
+class ProviderRateLimiter:
+    """Token bucket with strict priority between ``trade``, ``display`` and ``batch`` callers.
 
-    try:
-        total_value = float(data.get("total_value"))
-    except (TypeError, ValueError):
-        return None, "total_value must be numeric"
+    A caller only takes a token when no higher-priority caller is waiting, and
+    ``batch`` callers additionally leave ``batch_reserve`` tokens in the bucket.
+    Callers that cannot get a token within their class's max wait raise.
+    """
 
-    try:
-        cash = float(data.get("cash"))
-    except (TypeError, ValueError):
-        return None, "cash must be numeric"
+    PRIORITIES = ("trade", "display", "batch")
+    POLL_SECONDS = 0.05
+    WAIT_WINDOW = 512
+
+    def __init__(self, rate_per_minute, burst, batch_reserve=0, max_wait=None, clock=time.monotonic):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self.batch_reserve = batch_reserve
+        self.max_wait = max_wait or MARKET_DATA_PRIORITY_MAX_WAIT_SECONDS
+        self._clock = clock
+        self._tokens = float(burst)
+        self._refilled_at = clock()
+        self._condition = threading.Condition()
+        self._waiting = {priority: 0 for priority in self.PRIORITIES}
+        self._acquired = {priority: 0 for priority in self.PRIORITIES}
+        self._delayed = {priority: 0 for priority in self.PRIORITIES}
+        self._timeouts = {priority: 0 for priority in self.PRIORITIES}
+        self._waits_ms = {priority: deque(maxlen=self.WAIT_WINDOW) for priority in self.PRIORITIES}
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._refilled_at)
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate_per_second)
+        self._refilled_at = now
+
+    def _can_take(self, priority):
+        for higher in self.PRIORITIES[:self.PRIORITIES.index(priority)]:
+            if self._waiting[higher]:
+                return False
+        reserve = self.batch_reserve if priority == "batch" else 0
+        return self._tokens >= 1 + reserve
+
+    def acquire(self, priority="display", max_wait=None):
+        if priority not in self._waiting:
+            raise ValueError(f"Unknown market data priority {priority}")
+        started = self._clock()
+        wait_limit = self.max_wait[priority] if max_wait is None else min(self.max_wait[priority], max_wait)
+        deadline = started + wait_limit
+        delayed = False
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = self._clock()
+                    self._refill(now)
+                    if self._can_take(priority):
+                        self._tokens -= 1
+                        break
+                    if now >= deadline:
+                        self._timeouts[priority] += 1
+                        raise MarketDataRateLimitError(f"Market data rate limit exceeded for {priority} request")
+                    delayed = True
+                    self._condition.wait(min(deadline - now, self.POLL_SECONDS))
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+            waited_ms = (self._clock() - started) * 1000.0
+            self._acquired[priority] += 1
+            if delayed:
+                self._delayed[priority] += 1
+            self._waits_ms[priority].append(waited_ms)
+        return waited_ms
+
+    def stats(self):
+        with self._condition:
+            self._refill(self._clock())
+            classes = {}
+            for priority in self.PRIORITIES:
+                waits = sorted(self._waits_ms[priority])
+                classes[priority] = {
+                    "queue_depth": self._waiting[priority],
+                    "acquired": self._acquired[priority],
+                    "delayed": self._delayed[priority],
+                    "timeouts": self._timeouts[priority],
+                    "wait_ms": {
+                        "avg": _round_metric(sum(waits) / len(waits), 2) if waits else None,
+                        "p95": _round_metric(_percentile(waits, 95), 2),
+                        "max": _round_metric(waits[-1], 2) if waits else None,
+                    },
+                }
+            return {
+                "rate_per_minute": _round_metric(self.rate_per_second * 60.0, 2),
+                "burst": self.burst,
+                "batch_reserve": self.batch_reserve,
+                "tokens_available": _round_metric(self._tokens, 2),
+                "classes": classes,
+            }
 
-    total_pnl_raw = data.get("total_pnl")
-    if total_pnl_raw in (None, ""):
-        total_pnl = None
-    else:
+
+class ProviderCircuitBreaker:
+    """Fails provider calls fast after ``failure_threshold`` consecutive failures.
+
+    While open every call raises ``MarketDataUnavailableError`` without touching
+    the provider. After ``reset_seconds`` a single probe call is let through
+    (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.short_circuited = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open" and self._clock() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "closed":
+                return
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.short_circuited += 1
+        raise MarketDataUnavailableError("Market data provider unavailable (circuit open)")
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.warning("market_data_circuit_opened failures=%s", self.consecutive_failures)
+                self.state = "open"
+                self._opened_at = self._clock()
+
+    def release(self):
+        """Free the half-open probe slot when a call ended without reaching the provider."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_seconds": self.reset_seconds,
+                "times_opened": self.times_opened,
+                "short_circuited": self.short_circuited,
+            }
+
+
+# Bar intervals kept in the price_bar store.
+PRICE_BAR_INTERVALS = ("5min", "daily", "weekly")
+
+
+class MarketDataProvider(abc.ABC):
+    """Interface every market data source implements.
+
+    Quotes come back shaped like Alpha Vantage GLOBAL_QUOTE payloads and bars
+    like its time-series points (``"1. open"`` ... ``"4. close"``) keyed by ISO
+    timestamp, since that is the shape the rest of the app consumes. The base
+    class keeps the request/error/latency metrics and applies the shared rate
+    limiter and circuit breaker; subclasses implement ``global_quote``,
+    ``bulk_quotes`` and ``time_series``.
+    """
+
+    name = "base"
+    supports_bulk_quotes = False
+    LATENCY_WINDOW = 512
+
+    def __init__(self, rate_limiter=None, circuit_breaker=None):
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self._lock = threading.Lock()
+        self._latencies_ms = deque(maxlen=self.LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+
+    @abc.abstractmethod
+    def global_quote(self, symbol):
+        """GLOBAL_QUOTE-shaped payload for one symbol."""
+
+    @abc.abstractmethod
+    def bulk_quotes(self, symbols):
+        """Quotes for one batch of symbols; symbols the source has no quote for are omitted."""
+
+    @abc.abstractmethod
+    def time_series(self, symbol, interval):
+        """Bars for ``symbol`` at ``interval`` keyed by ISO timestamp."""
+
+    def _acquire(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(current_market_data_priority(), max_wait=remaining_request_budget())
+
+    def _guarded_call(self, call):
+        """Run one logical provider call, retries included, through the circuit breaker."""
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return call()
+        breaker.before_call()
         try:
-            total_pnl = float(total_pnl_raw)
-        except (TypeError, ValueError):
-            return None, "total_pnl must be numeric when provided"
+            result = call()
+        except MarketDataRateLimitError:
+            breaker.release()
+            raise
+        except DeadlineExceededError as exc:
+            # Out of budget after a real provider failure still counts against the provider;
+            # running out of our own budget does not.
+            if isinstance(exc.__cause__, _RetryableProviderError):
+                breaker.record_failure()
+            else:
+                breaker.release()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return result
+
+    def _record(self, started, failed=False):
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+            self._latencies_ms.append(elapsed_ms)
+
+    def _extra_stats(self):
+        return {}
 
-    return {
-        "username": username,
-        "account_id": account_id,
-        "account_type": account_type,
-        "date": snapshot_date,
-        "total_value": total_value,
-        "cash": cash,
-        "total_pnl": total_pnl,
-    }, None
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies_ms)
+            requests_made = self.requests
+            errors = self.errors
+            extra = self._extra_stats()
 
+        return {
+            "provider": self.name,
+            "requests": requests_made,
+            "errors": errors,
+            **extra,
+            "latency_ms": {
+                "window": len(latencies),
+                "avg": _round_metric(sum(latencies) / len(latencies), 2) if latencies else None,
+                "p50": _round_metric(_percentile(latencies, 50), 2),
+                "p95": _round_metric(_percentile(latencies, 95), 2),
+                "max": _round_metric(latencies[-1], 2) if latencies else None,
+            },
+        }
 
-def _upsert_account_performance_snapshot_record(snapshot):
-    statement = None
-    if db.engine.dialect.name == 'postgresql':
+
+class AlphaVantageClient(MarketDataProvider):
+    """The single outbound path to Alpha Vantage.
+
+    Holds a pooled keep-alive ``requests.Session``, applies connect/read
+    timeouts to every call, retries 5xx responses, connection errors and
+    "Note"/"Information" throttle replies with jittered exponential backoff, and keeps
+    latency metrics for ``/admin/market_data_stats``. With a ``rate_limiter``
+    every attempt first takes a token at the caller's priority.
+    """
+
+    name = "alphavantage"
+    supports_bulk_quotes = True
+    # Provider series backing each stored bar interval: (request params, time-series key resolver).
+    TIME_SERIES = {
+        "5min": (
+            {"function": "TIME_SERIES_INTRADAY", "interval": "5min"},
+            lambda d: next((k for k in d if "Time Series" in k), None),
+        ),
+        "daily": ({"function": "TIME_SERIES_DAILY_ADJUSTED"}, lambda _: "Time Series (Daily)"),
+        "weekly": ({"function": "TIME_SERIES_WEEKLY_ADJUSTED"}, lambda _: "Weekly Adjusted Time Series"),
+    }
+
+    def __init__(self, api_key, base_url=ALPHA_VANTAGE_BASE_URL, pool_size=MARKET_DATA_POOL_SIZE,
+                 connect_timeout=MARKET_DATA_CONNECT_TIMEOUT_SECONDS, read_timeout=MARKET_DATA_READ_TIMEOUT_SECONDS,
+                 max_retries=MARKET_DATA_MAX_RETRIES, backoff_base=MARKET_DATA_BACKOFF_BASE_SECONDS, sleep=time.sleep,
+                 rate_limiter=None, circuit_breaker=None):
+        super().__init__(rate_limiter=rate_limiter, circuit_breaker=circuit_breaker)
+        self.api_key = api_key
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._sleep = sleep
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.retries = 0
+        self.throttled = 0
+
+    def global_quote(self, symbol):
+        data = self.query({"function": "GLOBAL_QUOTE", "symbol": symbol, "entitlement": "realtime"})
+        if not isinstance(data, dict) or "Global Quote" not in data:
+            raise Exception(f"Unexpected Alpha Vantage response for symbol {symbol}")
+        # Only an explicit empty quote means the provider does not know the symbol.
+        if not data["Global Quote"]:
+            raise UnknownSymbolError(f"No data found for symbol {symbol}")
+        return data["Global Quote"]
+
+    def bulk_quotes(self, symbols):
+        data = self.query({"function": "REALTIME_BULK_QUOTES", "symbol": ",".join(symbols), "entitlement": "realtime"})
+        quotes = {}
+        rows = data.get("data") if isinstance(data, dict) else None
+        for row in rows or []:
+            symbol = _normalize_symbol(row.get("symbol"))
+            if symbol not in symbols or row.get("close") in (None, ""):
+                continue
+            quotes[symbol] = {
+                "01. symbol": symbol,
+                "05. price": row.get("close"),
+                "08. previous close": row.get("previous_close"),
+                "09. change": row.get("change"),
+                "10. change percent": row.get("change_percent"),
+            }
+        return quotes
+
+    def time_series(self, symbol, interval):
+        series_params, ts_key_resolver = self.TIME_SERIES[interval]
+        series_data = self.query({**series_params, "symbol": symbol})
+        ts_key = ts_key_resolver(series_data)
+        if not ts_key or ts_key not in series_data:
+            raise Exception(f"No valid chart data found for symbol {symbol}")
+        return series_data[ts_key]
+
+    def query(self, params, timeout=None):
+        """GET ``params`` from the provider and return the decoded JSON payload."""
+        params = {**params, "apikey": self.api_key}
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        return self._guarded_call(lambda: self._query_with_retries(params, timeout))
+
+    def _query_with_retries(self, params, timeout):
+        attempt = 0
+        while True:
+            attempt_timeout, bounded = _deadline_bounded_timeout(timeout, "market data request")
+            self._acquire()
+            try:
+                return self._attempt(params, attempt_timeout)
+            except _RetryableProviderError as exc:
+                if bounded and isinstance(exc, _ProviderTimeoutError):
+                    # The attempt was cut to the request's remaining budget, not the provider's timeout.
+                    mark_request_degraded()
+                    raise DeadlineExceededError(f"Request deadline exceeded during market data request: {exc}") from None
+                if attempt >= self.max_retries:
+                    raise Exception(str(exc)) from exc
+                attempt += 1
+                delay = random.uniform(0, self.backoff_base * (2 ** (attempt - 1)))
+                remaining = remaining_request_budget()
+                if remaining is not None and remaining - delay < MARKET_DATA_MIN_ATTEMPT_SECONDS:
+                    mark_request_degraded()
+                    raise DeadlineExceededError(f"Request deadline exceeded before retrying: {exc}") from exc
+                with self._lock:
+                    self.retries += 1
+                app.logger.info(
+                    "provider_retry function=%s attempt=%s delay=%.3f reason=%s",
+                    params.get("function"), attempt, delay, exc,
+                )
+                self._sleep(delay)
+
+    def _attempt(self, params, timeout):
+        started = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=timeout)
+        except requests.Timeout as exc:
+            self._record(started, failed=True)
+            raise _ProviderTimeoutError(f"Alpha Vantage request timed out: {exc}")
+        except requests.RequestException as exc:
+            self._record(started, failed=True)
+            raise _RetryableProviderError(f"Alpha Vantage request failed: {exc}")
+        self._record(started, failed=response.status_code != 200)
+
+        if response.status_code >= 500:
+            raise _RetryableProviderError(f"Alpha Vantage API error: {response.status_code}")
+        if response.status_code != 200:
+            raise Exception(f"Alpha Vantage API error: {response.status_code}")
+        data = response.json()
+        if not isinstance(data, dict):
+            return data
+        # "Note" is the per-minute throttle; "Information" covers daily quota and premium replies.
+        throttle_message = data.get("Note") or data.get("Information")
+        if throttle_message:
+            with self._lock:
+                self.throttled += 1
+            raise _RetryableProviderError(throttle_message)
+        if data.get("Error Message"):
+            raise Exception(f"Alpha Vantage error: {data['Error Message']}")
+        return data
+
+    def _extra_stats(self):
+        return {"retries": self.retries, "throttled": self.throttled}
+
+
+class ReplayMarketDataProvider(MarketDataProvider):
+    """Serves quotes and bars from local fixtures for offline benchmark and soak runs.
+
+    ``path`` is a directory holding ``quotes.csv`` or ``quotes.json`` and
+    optionally ``bars.csv`` or ``bars.json``:
+
+    - quotes: rows of ``symbol, price, previous_close`` with optional
+      ``change`` and ``change_percent``.
+    - bars: rows of ``symbol, interval (5min|daily|weekly), timestamp, open,
+      high, low, close, volume``.
+
+    JSON fixtures hold a list of the same rows. Every call sleeps
+    ``latency_ms`` (+/- ``jitter_ms``) and fails with probability
+    ``error_rate``; a fixed ``seed`` makes the sequence reproducible. With
+    ``align_to_today`` each bar series is shifted by whole days so its newest
+    bar falls on the current market date.
+    """
+
+    name = "replay"
+    supports_bulk_quotes = True
+
+    def __init__(self, path, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None, align_to_today=True,
+                 sleep=time.sleep, rate_limiter=None, circuit_breaker=None):
+        super().__init__(rate_limiter=rate_limiter, circuit_breaker=circuit_breaker)
+        self.path = path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.align_to_today = align_to_today
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self.injected_errors = 0
+        self.quotes = {}
+        for row in self._load_rows("quotes"):
+            symbol = _normalize_symbol(row.get("symbol"))
+            if not symbol or row.get("price") in (None, ""):
+                continue
+            quote = {"01. symbol": symbol}
+            for column, field in (("price", "05. price"), ("previous_close", "08. previous close"),
+                                  ("change", "09. change"), ("change_percent", "10. change percent")):
+                if row.get(column) not in (None, ""):
+                    quote[field] = str(row[column])
+            self.quotes[symbol] = quote
+        self.bars = {}
+        for row in self._load_rows("bars"):
+            key = (_normalize_symbol(row.get("symbol")), row.get("interval"))
+            if key[1] not in PRICE_BAR_INTERVALS or row.get("close") in (None, ""):
+                continue
+            self.bars.setdefault(key, []).append(row)
+        app.logger.info(
+            "replay_provider_loaded path=%s quotes=%s series=%s", path, len(self.quotes), len(self.bars),
+        )
+
+    def _load_rows(self, name):
+        json_path = os.path.join(self.path, f"{name}.json")
+        csv_path = os.path.join(self.path, f"{name}.csv")
+        if os.path.exists(json_path):
+            with open(json_path) as handle:
+                return json.load(handle)
+        if os.path.exists(csv_path):
+            with open(csv_path, newline="") as handle:
+                return list(csv.DictReader(handle))
+        return []
+
+    def _simulate_call(self):
+        self._guarded_call(self._simulate_attempt)
+
+    def _simulate_attempt(self):
+        remaining = check_request_deadline("market data request")
+        self._acquire()
+        started = time.perf_counter()
+        with self._lock:
+            delay_ms = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.injected_errors += 1
+        if remaining is not None and delay_ms / 1000.0 > remaining:
+            self._sleep(max(0.0, remaining))
+            self._record(started, failed=True)
+            mark_request_degraded()
+            raise DeadlineExceededError("Request deadline exceeded during market data request")
+        if delay_ms:
+            self._sleep(delay_ms / 1000.0)
+        self._record(started, failed=fail)
+        if fail:
+            raise Exception("Replay provider injected error")
+
+    def global_quote(self, symbol):
+        self._simulate_call()
+        quote = self.quotes.get(_normalize_symbol(symbol))
+        if not quote:
+            raise UnknownSymbolError(f"No data found for symbol {symbol}")
+        return dict(quote)
+
+    def bulk_quotes(self, symbols):
+        self._simulate_call()
+        return {symbol: dict(self.quotes[symbol]) for symbol in symbols if symbol in self.quotes}
+
+    def time_series(self, symbol, interval):
+        self._simulate_call()
+        rows = self.bars.get((_normalize_symbol(symbol), interval))
+        if not rows:
+            raise Exception(f"No valid chart data found for symbol {symbol}")
+        timestamps = [_parse_bar_timestamp(str(row["timestamp"])) for row in rows]
+        shift = timedelta(0)
+        if self.align_to_today:
+            shift = timedelta(days=(_market_now().date() - max(timestamps).date()).days)
+        series = {}
+        for row, ts in zip(rows, timestamps):
+            ts = ts + shift
+            key = ts.isoformat(sep=" ") if interval == "5min" else ts.date().isoformat()
+            series[key] = {
+                "1. open": str(row.get("open") or ""),
+                "2. high": str(row.get("high") or ""),
+                "3. low": str(row.get("low") or ""),
+                "4. close": str(row["close"]),
+                "5. volume": str(row.get("volume") or ""),
+            }
+        return series
+
+    def _extra_stats(self):
+        return {"injected_errors": self.injected_errors}
+
+
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "alphavantage").strip().lower()
+MARKET_DATA_REPLAY_PATH = os.getenv("MARKET_DATA_REPLAY_PATH", "fixtures/market_data")
+MARKET_DATA_REPLAY_LATENCY_MS = float(os.getenv("MARKET_DATA_REPLAY_LATENCY_MS", "0"))
+MARKET_DATA_REPLAY_JITTER_MS = float(os.getenv("MARKET_DATA_REPLAY_JITTER_MS", "0"))
+MARKET_DATA_REPLAY_ERROR_RATE = float(os.getenv("MARKET_DATA_REPLAY_ERROR_RATE", "0"))
+MARKET_DATA_REPLAY_SEED = os.getenv("MARKET_DATA_REPLAY_SEED")
+MARKET_DATA_REPLAY_ALIGN_TO_TODAY = os.getenv("MARKET_DATA_REPLAY_ALIGN_TO_TODAY", "1") != "0"
+
+market_data_rate_limiter = (
+    ProviderRateLimiter(MARKET_DATA_RATE_LIMIT_PER_MINUTE, MARKET_DATA_RATE_LIMIT_BURST, MARKET_DATA_BATCH_RESERVE_TOKENS)
+    if MARKET_DATA_RATE_LIMIT_PER_MINUTE > 0
+    else None
+)
+market_data_circuit_breaker = ProviderCircuitBreaker(MARKET_DATA_BREAKER_FAILURE_THRESHOLD, MARKET_DATA_BREAKER_RESET_SECONDS)
+market_data_client = AlphaVantageClient(
+    ALPHA_VANTAGE_API_KEY, rate_limiter=market_data_rate_limiter, circuit_breaker=market_data_circuit_breaker,
+)
+
+
+def _build_market_data_provider():
+    if MARKET_DATA_PROVIDER == "alphavantage":
+        return market_data_client
+    if MARKET_DATA_PROVIDER == "replay":
+        return ReplayMarketDataProvider(
+            MARKET_DATA_REPLAY_PATH,
+            latency_ms=MARKET_DATA_REPLAY_LATENCY_MS,
+            jitter_ms=MARKET_DATA_REPLAY_JITTER_MS,
+            error_rate=MARKET_DATA_REPLAY_ERROR_RATE,
+            seed=MARKET_DATA_REPLAY_SEED,
+            align_to_today=MARKET_DATA_REPLAY_ALIGN_TO_TODAY,
+            rate_limiter=market_data_rate_limiter,
+            circuit_breaker=market_data_circuit_breaker,
+        )
+    raise ValueError(f"Unknown MARKET_DATA_PROVIDER {MARKET_DATA_PROVIDER}")
+
+
+# Everything that prices symbols or loads bars goes through this provider.
+market_data_provider = _build_market_data_provider()
+
+
+# --------------------
+# Market Data: Shared Quote Cache
+# --------------------
+# Regular-session TTL; pre/post-market quotes use the extended TTL and quotes taken while
+# the market is closed stay fresh until the next regular open.
+QUOTE_CACHE_TTL_SECONDS = float(os.getenv("QUOTE_CACHE_TTL_SECONDS", "15"))
+QUOTE_CACHE_EXTENDED_TTL_SECONDS = float(os.getenv("QUOTE_CACHE_EXTENDED_TTL_SECONDS", "120"))
+QUOTE_CACHE_MAX_SIZE = int(os.getenv("QUOTE_CACHE_MAX_SIZE", "2048"))
+
+
+def _market_now():
+    return datetime.now(timezone.utc).astimezone(pytz.timezone("America/New_York"))
+
+
+def _seconds_until_next_open(now_est):
+    next_open = now_est.replace(hour=9, minute=30, second=0, microsecond=0)
+    if now_est >= next_open:
+        next_open += timedelta(days=1)
+    while next_open.weekday() >= 5:
+        next_open += timedelta(days=1)
+    return (next_open - now_est).total_seconds()
+
+
+def _session_ttl(regular_seconds, extended_seconds):
+    """Build a TTL callable keyed off ``_market_session`` for cache entries stored now."""
+    def ttl():
+        now_est = _market_now()
+        session = _market_session(now_est)
+        if session == "regular":
+            return regular_seconds
+        if session in {"pre", "post"}:
+            return extended_seconds
+        return max(regular_seconds, _seconds_until_next_open(now_est))
+    return ttl
+
+
+class _InflightFetch:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Process-wide TTL cache with LRU eviction and single-flight fetches.
+
+    Concurrent misses for the same key share one fetch: the first caller runs
+    the fetcher while later callers wait on its result (counted as coalesced),
+    for no longer than their request's remaining budget. Failed fetches are not
+    cached.
+
+    With ``stale_ttl_seconds`` set, an entry past ``ttl_seconds`` but younger
+    than the stale TTL is still served while a single background refresh
+    replaces it (stale-while-revalidate). Older entries are refetched inline.
+
+    With ``cacheable`` set, fetched values it rejects are returned to their
+    callers but not stored, so the next read fetches again.
+    """
+
+    def __init__(self, ttl_seconds, max_size, stale_ttl_seconds=None, clock=time.monotonic, cacheable=None):
+        # Either TTL may be a number or a zero-argument callable evaluated when an entry is stored.
+        self.ttl_seconds = ttl_seconds
+        self.stale_ttl_seconds = stale_ttl_seconds
+        self.cacheable = cacheable
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+        self.uncacheable = 0
+        self.wait_timeouts = 0
+
+    def get_or_fetch(self, key, fetcher):
+        return self.get_with_age(key, fetcher)[0]
+
+    def get_with_age(self, key, fetcher):
+        """Return ``(value, age_seconds, is_stale)`` for ``key``, fetching it if needed."""
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, fresh_until, stale_until, value = entry
+                if now < fresh_until:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, now - stored_at, False
+                if now < stale_until:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        refresh = _InflightFetch()
+                        self._inflight[key] = refresh
+                        self.background_refreshes += 1
+                        self._refresh_in_background(key, refresh, fetcher)
+                    return value, now - stored_at, True
+                del self._entries[key]
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                inflight = _InflightFetch()
+                self._inflight[key] = inflight
+                self.misses += 1
+                is_leader = True
+
+        if not is_leader:
+            if not self._await(inflight):
+                raise DeadlineExceededError(f"Request deadline exceeded waiting for an in-flight fetch of {key}")
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.value, 0.0, False
+
+        return self._complete(key, inflight, fetcher), 0.0, False
+
+    def _complete(self, key, inflight, fetcher):
+        try:
+            value = fetcher()
+        except Exception as exc:
+            inflight.error = exc
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight.event.set()
+            raise
+
+        inflight.value = value
+        with self._lock:
+            if self.cacheable is None or self.cacheable(value):
+                self._store(key, value)
+            else:
+                self.uncacheable += 1
+            self._inflight.pop(key, None)
+        inflight.event.set()
+        return value
+
+    def _refresh_in_background(self, key, inflight, fetcher):
+        def run():
+            try:
+                self._complete(key, inflight, fetcher)
+            except Exception as exc:
+                with self._lock:
+                    self.refresh_failures += 1
+                logger.warning("cache_background_refresh_failed key=%s error=%s", key, exc)
+
+        threading.Thread(target=run, name=f"cache-refresh-{key}", daemon=True).start()
+
+    def get_many(self, keys, batch_fetcher):
+        """Resolve several keys at once, handing every uncached key to one batch fetch.
+
+        ``batch_fetcher`` receives the list of keys this caller is responsible for
+        and returns a mapping; keys it omits are left out of the result.
+        """
+        results = {}
+        owned = {}
+        waiting = {}
+        with self._lock:
+            now = self._clock()
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    results[key] = entry[3]
+                    continue
+                if entry is not None:
+                    del self._entries[key]
+                inflight = self._inflight.get(key)
+                if inflight is not None:
+                    self.coalesced += 1
+                    waiting[key] = inflight
+                else:
+                    inflight = _InflightFetch()
+                    self._inflight[key] = inflight
+                    self.misses += 1
+                    owned[key] = inflight
+
+        if owned:
+            results.update(self._complete_many(owned, batch_fetcher))
+
+        for key, inflight in waiting.items():
+            if self._await(inflight) and inflight.error is None:
+                results[key] = inflight.value
+        return results
+
+    def _await(self, inflight):
+        """Wait for another caller's fetch, at most for the current request's remaining budget.
+
+        Returns ``False`` (and flags the response degraded) when the budget runs
+        out first; outside a budgeted request the wait is unbounded.
+        """
+        remaining = remaining_request_budget()
+        if inflight.event.wait(None if remaining is None else max(0.0, remaining)):
+            return True
+        with self._lock:
+            self.wait_timeouts += 1
+        mark_request_degraded()
+        return False
+
+    def _complete_many(self, owned, batch_fetcher):
+        batch_error = None
+        try:
+            fetched = batch_fetcher(list(owned)) or {}
+        except Exception as exc:
+            fetched = {}
+            batch_error = exc
+        stored = {}
+        with self._lock:
+            for key, inflight in owned.items():
+                self._inflight.pop(key, None)
+                if key in fetched:
+                    inflight.value = fetched[key]
+                    self._store(key, inflight.value)
+                    stored[key] = inflight.value
+                else:
+                    inflight.error = batch_error or LookupError(f"No quote returned for {key}")
+        for inflight in owned.values():
+            inflight.event.set()
+        return stored
+
+    def keys_expiring_within(self, keys, seconds):
+        """Return the keys that are missing or stop being fresh within ``seconds``, soonest first.
+
+        Keys with a fetch already in flight are skipped.
+        """
+        with self._lock:
+            deadline = self._clock() + seconds
+            due = []
+            for key in dict.fromkeys(keys):
+                if key in self._inflight:
+                    continue
+                entry = self._entries.get(key)
+                fresh_until = entry[1] if entry is not None else float("-inf")
+                if fresh_until < deadline:
+                    due.append((fresh_until, key))
+        due.sort()
+        return [key for _, key in due]
+
+    def refresh_many(self, keys, batch_fetcher):
+        """Refetch ``keys`` through ``batch_fetcher`` even if still fresh and store the results.
+
+        Readers that miss on a key while it is being refreshed wait for this fetch,
+        within their request's remaining budget.
+        Returns the mapping of keys that were refreshed.
+        """
+        owned = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key not in self._inflight:
+                    owned[key] = self._inflight[key] = _InflightFetch()
+        if not owned:
+            return {}
+        return self._complete_many(owned, batch_fetcher)
+
+    def _store(self, key, value):
+        now = self._clock()
+        fresh_until = now + self._resolve_ttl(self.ttl_seconds)
+        stale_until = max(fresh_until, now + self._resolve_ttl(self.stale_ttl_seconds))
+        self._entries[key] = (now, fresh_until, stale_until, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        """Return the fresh value for ``key`` without fetching; ``None`` when absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self._clock():
+                return None
+            return entry[3]
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    @staticmethod
+    def _resolve_ttl(ttl):
+        if ttl is None:
+            return 0.0
+        return float(ttl() if callable(ttl) else ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": _round_metric(self._resolve_ttl(self.ttl_seconds), 1),
+                "stale_ttl_seconds": _round_metric(self._resolve_ttl(self.stale_ttl_seconds), 1) if self.stale_ttl_seconds else None,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "background_refreshes": self.background_refreshes,
+                "refresh_failures": self.refresh_failures,
+                "uncacheable": self.uncacheable,
+                "wait_timeouts": self.wait_timeouts,
+                "in_flight": len(self._inflight),
+                "hit_rate": _round_metric((self.hits + self.stale_hits + self.coalesced) / lookups) if lookups else None,
+            }
+
+
+quote_cache = TTLCache(_session_ttl(QUOTE_CACHE_TTL_SECONDS, QUOTE_CACHE_EXTENDED_TTL_SECONDS), QUOTE_CACHE_MAX_SIZE)
+
+
+def _fetch_global_quote(symbol):
+    try:
+        global_quote = market_data_provider.global_quote(symbol)
+    except UnknownSymbolError:
+        unknown_symbol_cache.put(symbol, True)
+        raise
+    _remember_quotes({symbol: global_quote})
+    return global_quote
+
+
+def get_global_quote(symbol):
+    """Return the raw GLOBAL_QUOTE payload for a symbol through the shared quote cache."""
+    symbol = _normalize_symbol(symbol)
+    validate_symbol(symbol)
+    _note_symbol_requests([symbol])
+    return quote_cache.get_or_fetch(symbol, lambda: _fetch_global_quote(symbol))
+
+
+ALPHA_VANTAGE_BULK_QUOTES_ENABLED = os.getenv("ALPHA_VANTAGE_BULK_QUOTES", "1") != "0"
+BULK_QUOTE_BATCH_SIZE = 100
+# Cap on provider fetches run concurrently for quote misses. Requests and batch jobs get separate
+# pools so trade and display fetches never queue behind batch work waiting on the rate limiter.
+QUOTE_FETCH_CONCURRENCY = int(os.getenv("QUOTE_FETCH_CONCURRENCY", "8"))
+QUOTE_FETCH_BATCH_CONCURRENCY = int(os.getenv("QUOTE_FETCH_BATCH_CONCURRENCY", "4"))
+quote_fetch_executor = ThreadPoolExecutor(max_workers=max(1, QUOTE_FETCH_CONCURRENCY), thread_name_prefix="quote-fetch")
+batch_quote_fetch_executor = ThreadPoolExecutor(
+    max_workers=max(1, QUOTE_FETCH_BATCH_CONCURRENCY), thread_name_prefix="quote-fetch-batch"
+)
+
+
+def _fan_out(fn, items):
+    """Run ``fn`` over ``items`` on a quote pool and return ``[(item, result, error)]`` in order.
+
+    Each task runs in a copy of the caller's context, so the request's provider
+    priority and deadline carry over into the worker thread. Inside a request the
+    wait is bounded by the remaining budget; unfinished tasks come back as
+    ``DeadlineExceededError``.
+    """
+    batch = current_market_data_priority() == "batch"
+    concurrency = QUOTE_FETCH_BATCH_CONCURRENCY if batch else QUOTE_FETCH_CONCURRENCY
+    if len(items) <= 1 or concurrency <= 1:
+        futures = None
+    else:
+        executor = batch_quote_fetch_executor if batch else quote_fetch_executor
+        futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+    outcomes = []
+    for index, item in enumerate(items):
+        try:
+            if futures:
+                remaining = remaining_request_budget()
+                result = futures[index].result(timeout=None if remaining is None else max(0.0, remaining))
+            else:
+                result = fn(item)
+        except FutureTimeoutError:
+            futures[index].cancel()
+            mark_request_degraded()
+            outcomes.append((item, None, DeadlineExceededError("Request deadline exceeded waiting for quote fetch")))
+        except Exception as exc:
+            outcomes.append((item, None, exc))
+        else:
+            outcomes.append((item, result, None))
+    return outcomes
+
+
+def _bulk_quotes_enabled():
+    return ALPHA_VANTAGE_BULK_QUOTES_ENABLED and market_data_provider.supports_bulk_quotes
+
+
+def _fetch_bulk_global_quotes(symbols):
+    """Fetch many symbols in provider bulk calls of ``BULK_QUOTE_BATCH_SIZE``, shaped like GLOBAL_QUOTE payloads.
+
+    Symbols missing from the provider reply are simply absent from the result so
+    callers can fall back to single-symbol quotes for them.
+    """
+    quotes = {}
+    chunks = [symbols[start:start + BULK_QUOTE_BATCH_SIZE] for start in range(0, len(symbols), BULK_QUOTE_BATCH_SIZE)]
+    for chunk, chunk_quotes, error in _fan_out(market_data_provider.bulk_quotes, chunks):
+        if error is not None:
+            app.logger.warning("bulk_quote_fetch_failed symbols=%s error=%s", ",".join(chunk), error)
+            continue
+        quotes.update(chunk_quotes)
+    _remember_quotes(quotes)
+    return quotes
+
+
+# --------------------
+# Helper Function: Fetch current price from Alpha Vantage
+# --------------------
+def get_current_price(symbol):
+    global_quote = get_global_quote(symbol)
+    if "05. price" not in global_quote:
+        raise Exception(f"No price information available for symbol {symbol}")
+    return float(global_quote["05. price"])
+
+
+def get_current_and_prev_close(symbol):
+    return _price_and_prev_close_from_quote(get_global_quote(symbol))
+
+
+def _price_and_prev_close_from_quote(global_quote):
+    current_price = float(global_quote.get("05. price") or 0.0)
+    # Prefer the quote-level change field when available. This can be more reliable than
+    # "08. previous close" around corporate actions and prevents large incorrect day P&L swings.
+    quote_change = global_quote.get("09. change")
+    if quote_change is not None and str(quote_change).strip() != "":
+        try:
+            prev_close = current_price - float(quote_change)
+        except (TypeError, ValueError):
+            prev_close = float(global_quote.get("08. previous close") or 0.0)
+    else:
+        prev_close = float(global_quote.get("08. previous close") or 0.0)
+    if prev_close <= 0:
+        prev_close = current_price
+    return current_price, prev_close
+
+
+class QuoteBatch(dict):
+    """``get_quotes`` result; ``stale`` maps symbols served from last-known prices to their as-of time."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stale = {}
+
+
+def stale_quote_symbols(quotes):
+    return getattr(quotes, "stale", {})
+
+
+def get_quotes(symbols):
+    """Resolve many symbols to ``(price, prev_close)`` with as few provider calls as possible.
+
+    Cached symbols are served locally, the remaining misses go out in one bulk
+    request, and anything the bulk reply did not cover falls back to single
+    quotes fetched concurrently on the shared quote pool. Symbols the provider cannot price right now are valued at their
+    last-known price and listed in the result's ``stale`` mapping; symbols with
+    no known price at all are omitted. The result is keyed by the symbols
+    exactly as passed in.
+    """
+    symbols = [symbol for symbol in symbols if _normalize_symbol(symbol)]
+    keys = [key for key in dict.fromkeys(_normalize_symbol(symbol) for symbol in symbols) if is_known_symbol(key)]
+    _note_symbol_requests(keys)
+    resolved = {}
+    if len(keys) > 1 and _bulk_quotes_enabled():
+        for key, global_quote in quote_cache.get_many(keys, _fetch_bulk_global_quotes).items():
+            resolved[key] = _price_and_prev_close_from_quote(global_quote)
+    for key, price_pair, error in _fan_out(get_current_and_prev_close, [key for key in keys if key not in resolved]):
+        if error is not None:
+            app.logger.warning("quote_fetch_failed symbol=%s error=%s", key, error)
+            continue
+        resolved[key] = price_pair
+    stale = {}
+    missing = [key for key in dict.fromkeys(_normalize_symbol(symbol) for symbol in symbols) if key not in resolved]
+    if missing:
+        for key, (price, prev_close, as_of) in load_last_known_prices(missing).items():
+            resolved[key] = (price, prev_close)
+            stale[key] = as_of
+        if stale:
+            app.logger.warning("quote_served_stale symbols=%s", ",".join(sorted(stale)))
+
+    result = QuoteBatch()
+    for symbol in symbols:
+        key = _normalize_symbol(symbol)
+        if key in resolved:
+            result[symbol] = resolved[key]
+            if key in stale:
+                result.stale[symbol] = stale[key]
+    return result
+
+
+# --------------------
+# Market Data: Last-Known Prices
+# --------------------
+# Every successful provider quote is remembered in memory and flushed to last_known_price
+# periodically, so valuations can fall back to it while the provider is failing.
+LAST_KNOWN_PRICE_FLUSH_SECONDS = int(os.getenv("LAST_KNOWN_PRICE_FLUSH_SECONDS", "60"))
+
+_last_known_prices = {}
+_last_known_dirty = set()
+_last_known_lock = threading.Lock()
+
+
+def _remember_quotes(global_quotes):
+    now = datetime.utcnow()
+    with _last_known_lock:
+        for symbol, global_quote in global_quotes.items():
+            try:
+                price, prev_close = _price_and_prev_close_from_quote(global_quote)
+            except (TypeError, ValueError):
+                continue
+            if price <= 0:
+                continue
+            key = _normalize_symbol(symbol)
+            _last_known_prices[key] = (price, prev_close, now)
+            _last_known_dirty.add(key)
+
+
+def load_last_known_prices(symbols):
+    """Return ``{symbol: (price, prev_close, as_of)}`` from memory, falling back to the table."""
+    found = {}
+    with _last_known_lock:
+        for symbol in symbols:
+            if symbol in _last_known_prices:
+                found[symbol] = _last_known_prices[symbol]
+    missing = [symbol for symbol in symbols if symbol not in found]
+    if missing:
+        try:
+            with app.app_context():
+                rows = LastKnownPrice.query.filter(LastKnownPrice.symbol.in_(missing)).all()
+        except Exception as exc:
+            app.logger.warning("last_known_price_load_failed error=%s", exc)
+            rows = []
+        with _last_known_lock:
+            for row in rows:
+                entry = (row.price, row.prev_close if row.prev_close is not None else row.price, row.as_of)
+                _last_known_prices.setdefault(row.symbol, entry)
+                found[row.symbol] = _last_known_prices[row.symbol]
+    return found
+
+
+def persist_last_known_prices():
+    """Flush prices remembered since the last run to the last_known_price table."""
+    with _last_known_lock:
+        rows = [
+            {"symbol": symbol, "price": _last_known_prices[symbol][0],
+             "prev_close": _last_known_prices[symbol][1], "as_of": _last_known_prices[symbol][2]}
+            for symbol in _last_known_dirty
+        ]
+        _last_known_dirty.clear()
+    if not rows:
+        return 0
+    with app.app_context():
+        try:
+            statement = _dialect_insert()(LastKnownPrice.__table__).values(rows)
+            statement = statement.on_conflict_do_update(
+                index_elements=['symbol'],
+                set_={col: statement.excluded[col] for col in ('price', 'prev_close', 'as_of')},
+            )
+            db.session.execute(statement)
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            with _last_known_lock:
+                _last_known_dirty.update(row["symbol"] for row in rows)
+            app.logger.warning("last_known_price_persist_failed count=%s error=%s", len(rows), exc)
+            return 0
+    return len(rows)
+
+
+# --------------------
+# Market Data: Symbol Index and Negative Cache
+# --------------------
+# Optional local listing (Alpha Vantage LISTING_STATUS CSV: symbol,name,exchange,assetType,...,status).
+# When it is missing, symbol validation relies on the negative cache alone.
+# Fetch or refresh it with scripts/refresh_symbol_listing.py.
+SYMBOL_LISTING_PATH = os.getenv("SYMBOL_LISTING_PATH", "data/listing_status.csv")
+UNKNOWN_SYMBOL_CACHE_TTL_SECONDS = float(os.getenv("UNKNOWN_SYMBOL_CACHE_TTL_SECONDS", "3600"))
+UNKNOWN_SYMBOL_CACHE_MAX_SIZE = int(os.getenv("UNKNOWN_SYMBOL_CACHE_MAX_SIZE", "4096"))
+SYMBOL_SEARCH_MAX_LIMIT = 50
+# The full listing is a few MB, so its download gets a longer read timeout than quotes.
+SYMBOL_LISTING_READ_TIMEOUT_SECONDS = float(os.getenv("SYMBOL_LISTING_READ_TIMEOUT_SECONDS", "60"))
+
+
+class SymbolIndex:
+    """In-memory reference of listed symbols backing validation and prefix search."""
+
+    def __init__(self, rows=()):
+        self.listings = {}
+        for row in rows:
+            symbol = _normalize_symbol(row.get("symbol"))
+            status = (row.get("status") or "Active").strip().lower()
+            if not symbol or status != "active":
+                continue
+            self.listings[symbol] = {
+                "symbol": symbol,
+                "name": (row.get("name") or "").strip(),
+                "exchange": (row.get("exchange") or "").strip() or None,
+                "asset_type": (row.get("assetType") or row.get("asset_type") or "").strip() or None,
+            }
+        self._symbols = sorted(self.listings)
+        self._names = sorted((listing["name"].lower(), symbol) for symbol, listing in self.listings.items() if listing["name"])
+
+    @classmethod
+    def load(cls, path):
+        if not path or not os.path.exists(path):
+            app.logger.info("symbol_index_disabled path=%s", path)
+            return cls()
+        with open(path, newline="") as handle:
+            index = cls(csv.DictReader(handle))
+        app.logger.info("symbol_index_loaded path=%s symbols=%s", path, len(index.listings))
+        return index
+
+    @property
+    def enabled(self):
+        return bool(self.listings)
+
+    def __contains__(self, symbol):
+        return symbol in self.listings
+
+    def search(self, query, limit=10):
+        """Symbols starting with ``query`` first (exact match leading), then names starting with it."""
+        symbol_prefix = _normalize_symbol(query)
+        name_prefix = str(query or "").strip().lower()
+        if not symbol_prefix:
+            return []
+        matches = []
+        start = bisect.bisect_left(self._symbols, symbol_prefix)
+        for symbol in self._symbols[start:]:
+            if not symbol.startswith(symbol_prefix) or len(matches) >= limit:
+                break
+            matches.append(symbol)
+        start = bisect.bisect_left(self._names, (name_prefix,))
+        for name, symbol in self._names[start:]:
+            if not name.startswith(name_prefix) or len(matches) >= limit:
+                break
+            if symbol not in matches:
+                matches.append(symbol)
+        return [self.listings[symbol] for symbol in matches]
+
+
+symbol_index = SymbolIndex.load(SYMBOL_LISTING_PATH)
+unknown_symbol_cache = TTLCache(UNKNOWN_SYMBOL_CACHE_TTL_SECONDS, UNKNOWN_SYMBOL_CACHE_MAX_SIZE)
+
+
+def refresh_symbol_listing(path=SYMBOL_LISTING_PATH):
+    """Download the Alpha Vantage LISTING_STATUS CSV to ``path`` and load it into ``symbol_index``.
+
+    The file is only replaced when the reply parses into a non-empty listing, so
+    a quota or error reply never clobbers the last good file. Returns the number
+    of active symbols loaded.
+    """
+    global symbol_index
+    response = market_data_client.session.get(
+        ALPHA_VANTAGE_BASE_URL,
+        params={"function": "LISTING_STATUS", "apikey": ALPHA_VANTAGE_API_KEY},
+        timeout=(MARKET_DATA_CONNECT_TIMEOUT_SECONDS, SYMBOL_LISTING_READ_TIMEOUT_SECONDS),
+    )
+    if response.status_code != 200:
+        raise Exception(f"Alpha Vantage API error: {response.status_code}")
+    lines = response.text.splitlines()
+    index = SymbolIndex(csv.DictReader(lines))
+    if not index.enabled:
+        raise Exception(f"Alpha Vantage listing reply had no active symbols: {response.text[:200]}")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial_path = f"{path}.partial"
+    with open(partial_path, "w", newline="") as handle:
+        handle.write("\n".join(lines) + "\n")
+    os.replace(partial_path, path)
+    symbol_index = index
+    app.logger.info("symbol_listing_refreshed path=%s symbols=%s", path, len(index.listings))
+    return len(index.listings)
+
+
+def is_known_symbol(symbol):
+    """False for symbols missing from a loaded listing or recently rejected by the provider."""
+    symbol = _normalize_symbol(symbol)
+    if not symbol:
+        return False
+    if symbol_index.enabled and symbol not in symbol_index:
+        return False
+    return unknown_symbol_cache.peek(symbol) is None
+
+
+def validate_symbol(symbol):
+    if not is_known_symbol(symbol):
+        raise UnknownSymbolError(f"Unknown symbol {symbol}")
+
+
+# --------------------
+# Market Data: Hot Symbol Refresher
+# --------------------
+# Keeps held, open-order and recently requested symbols warm in quote_cache during the
+# regular session so portfolio reads do not pay provider latency after an entry expires.
+HOT_SYMBOL_REFRESH_ENABLED = os.getenv("HOT_SYMBOL_REFRESH_ENABLED", "1") != "0"
+HOT_SYMBOL_REFRESH_INTERVAL_SECONDS = int(os.getenv("HOT_SYMBOL_REFRESH_INTERVAL_SECONDS", "10"))
+# Provider calls one cycle may spend; the soonest-expiring symbols are refreshed first.
+HOT_SYMBOL_REFRESH_MAX_CALLS = int(os.getenv("HOT_SYMBOL_REFRESH_MAX_CALLS", "5"))
+HOT_SYMBOL_RECENT_WINDOW_SECONDS = float(os.getenv("HOT_SYMBOL_RECENT_WINDOW_SECONDS", "900"))
+
+_recent_symbol_requests = OrderedDict()
+_recent_symbol_lock = threading.Lock()
+_hot_symbol_refresh_lock = threading.Lock()
+hot_symbol_refresh_stats = {
+    "cycles": 0,
+    "skipped_cycles": 0,
+    "symbols_refreshed": 0,
+    "last_cycle": None,
+}
+
+
+def _note_symbol_requests(keys):
+    now = time.monotonic()
+    with _recent_symbol_lock:
+        for key in keys:
+            if not key:
+                continue
+            _recent_symbol_requests[key] = now
+            _recent_symbol_requests.move_to_end(key)
+        while len(_recent_symbol_requests) > QUOTE_CACHE_MAX_SIZE:
+            _recent_symbol_requests.popitem(last=False)
+
+
+def _recently_requested_symbols():
+    cutoff = time.monotonic() - HOT_SYMBOL_RECENT_WINDOW_SECONDS
+    with _recent_symbol_lock:
+        while _recent_symbol_requests and next(iter(_recent_symbol_requests.values())) < cutoff:
+            _recent_symbol_requests.popitem(last=False)
+        return list(_recent_symbol_requests)
+
+
+def collect_hot_symbols():
+    """Held symbols across all account types, open limit order symbols and recent requests."""
+    with app.app_context():
+        queries = [
+            db.session.query(Holding.symbol).distinct(),
+            db.session.query(CompetitionHolding.symbol).distinct(),
+            db.session.query(CompetitionTeamHolding.symbol).distinct(),
+            db.session.query(LimitOrder.symbol).filter(LimitOrder.status.in_(["open", "partially_filled"])).distinct(),
+        ]
+        symbols = {_normalize_symbol(row[0]) for query in queries for row in query.all()}
+    symbols.update(_recently_requested_symbols())
+    return sorted(symbol for symbol in symbols if is_known_symbol(symbol))
+
+
+def _fetch_global_quotes_individually(symbols):
+    quotes = {}
+    for symbol, global_quote, error in _fan_out(_fetch_global_quote, list(symbols)):
+        if error is not None:
+            app.logger.warning("quote_fetch_failed symbol=%s error=%s", symbol, error)
+            continue
+        quotes[symbol] = global_quote
+    return quotes
+
+
+def refresh_hot_symbols(force=False):
+    """Refresh hot symbols whose cached quote would expire before the next cycle.
+
+    Runs only during the regular session unless ``force`` is set, and spends at most
+    ``HOT_SYMBOL_REFRESH_MAX_CALLS`` provider calls per cycle.
+    """
+    if not _hot_symbol_refresh_lock.acquire(blocking=False):
+        return None
+    try:
+        session = _market_session(_market_now())
+        if not force and session != "regular":
+            hot_symbol_refresh_stats["skipped_cycles"] += 1
+            return None
+
+        started = time.monotonic()
+        hot_symbols = collect_hot_symbols()
+        due = quote_cache.keys_expiring_within(hot_symbols, HOT_SYMBOL_REFRESH_INTERVAL_SECONDS)
+        if _bulk_quotes_enabled():
+            budget = HOT_SYMBOL_REFRESH_MAX_CALLS * BULK_QUOTE_BATCH_SIZE
+            fetcher = _fetch_bulk_global_quotes
+        else:
+            budget = HOT_SYMBOL_REFRESH_MAX_CALLS
+            fetcher = _fetch_global_quotes_individually
+        batch = due[:budget]
+        refreshed = quote_cache.refresh_many(batch, fetcher) if batch else {}
+
+        cycle = {
+            "started_at": datetime.utcnow().isoformat(),
+            "market_session": session,
+            "hot_symbols": len(hot_symbols),
+            "due": len(due),
+            "refreshed": len(refreshed),
+            "failed": len(batch) - len(refreshed),
+            "deferred": len(due) - len(batch),
+            "duration_ms": _round_metric((time.monotonic() - started) * 1000, 1),
+        }
+        hot_symbol_refresh_stats["cycles"] += 1
+        hot_symbol_refresh_stats["symbols_refreshed"] += len(refreshed)
+        hot_symbol_refresh_stats["last_cycle"] = cycle
+        app.logger.info(
+            "hot_symbol_refresh hot=%s due=%s refreshed=%s failed=%s deferred=%s duration_ms=%s",
+            cycle["hot_symbols"], cycle["due"], cycle["refreshed"], cycle["failed"], cycle["deferred"], cycle["duration_ms"],
+        )
+        return cycle
+    finally:
+        _hot_symbol_refresh_lock.release()
+
+
+VALID_RANGES = {"1D", "1W", "1M", "6M", "1Y"}
+
+
+def _round_metric(value, places=4):
+    if value is None:
+        return None
+    return round(float(value), places)
+
+
+def _market_session(now_est):
+    if now_est.weekday() >= 5:
+        return "closed"
+    market_open = now_est.replace(hour=9, minute=30, second=0, microsecond=0)
+    regular_close = now_est.replace(hour=16, minute=0, second=0, microsecond=0)
+    post_close = now_est.replace(hour=20, minute=0, second=0, microsecond=0)
+    if now_est < market_open:
+        return "pre"
+    if now_est <= regular_close:
+        return "regular"
+    if now_est <= post_close:
+        return "post"
+    return "closed"
+
+
+RANGE_BAR_INTERVAL = {"1D": "5min", "1W": "daily", "1M": "daily", "6M": "weekly", "1Y": "weekly"}
+# Minimum age of the last provider top-up before a stored series is topped up again.
+PRICE_BAR_RESYNC_SECONDS = {"5min": 60, "daily": 300, "weekly": 3600}
+# Intraday bars only back the 1D chart; older ones are pruned after each top-up.
+PRICE_BAR_INTRADAY_RETENTION_DAYS = int(os.getenv("PRICE_BAR_INTRADAY_RETENTION_DAYS", "5"))
+
+_price_bar_synced_at = {}
+_price_bar_sync_lock = threading.Lock()
+
+
+def _parse_bar_timestamp(raw_ts):
+    ts_normalized = raw_ts.replace(" ", "T")
+    if len(ts_normalized) == 10:
+        ts_normalized = f"{ts_normalized}T00:00:00"
+    return datetime.fromisoformat(ts_normalized)
+
+
+def _optional_float(value):
+    if value in (None, ""):
+        return None
+    return float(value)
+
+
+def _parse_price_bars(time_series, since_key=None):
+    """Parse provider bars into rows, skipping anything older than ``since_key``.
+
+    Provider keys are ISO dates/datetimes, so a plain string comparison against
+    the newest stored key keeps already-stored history from being re-parsed.
+    """
+    bars = []
+    for ts, point in time_series.items():
+        if since_key is not None and ts < since_key:
+            continue
+        price_val = point.get("4. close") or point.get("5. adjusted close")
+        if not price_val:
+            continue
+        bars.append({
+            "timestamp": _parse_bar_timestamp(ts),
+            "open": _optional_float(point.get("1. open")),
+            "high": _optional_float(point.get("2. high")),
+            "low": _optional_float(point.get("3. low")),
+            "close": float(price_val),
+            "volume": _optional_float(point.get("6. volume") or point.get("5. volume")),
+        })
+    return bars
+
+
+def _dialect_insert():
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise RuntimeError('Unsupported database dialect for upsert')
+    return dialect_insert
+
+
+def _upsert_price_bars(symbol, interval, bars):
+    if not bars:
+        return
+    rows = [{"symbol": symbol, "interval": interval, **bar} for bar in bars]
+    statement = _dialect_insert()(PriceBar.__table__).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=['symbol', 'interval', 'timestamp'],
+        set_={col: statement.excluded[col] for col in ('open', 'high', 'low', 'close', 'volume')},
+    )
+    db.session.execute(statement)
+
+
+def _latest_price_bar_timestamp(symbol, interval):
+    return (
+        db.session.query(func.max(PriceBar.timestamp))
+        .filter(PriceBar.symbol == symbol, PriceBar.interval == interval)
+        .scalar()
+    )
+
+
+def _prune_intraday_bars(symbol):
+    """Delete 5min bars more than ``PRICE_BAR_INTRADAY_RETENTION_DAYS`` older than the newest one."""
+    newest = _latest_price_bar_timestamp(symbol, "5min")
+    if newest is None:
+        return 0
+    cutoff = newest - timedelta(days=PRICE_BAR_INTRADAY_RETENTION_DAYS)
+    return (
+        PriceBar.query
+        .filter(PriceBar.symbol == symbol, PriceBar.interval == "5min", PriceBar.timestamp < cutoff)
+        .delete(synchronize_session=False)
+    )
+
+
+def sync_price_bars(symbol, interval, force=False):
+    """Top up the stored series for ``symbol`` with bars the provider has beyond our newest one.
+
+    The newest stored bar is re-written as well because the provider keeps
+    updating the in-progress bar until its period closes. Intraday series are
+    pruned to the last few days, since only the 1D chart reads them. Returns
+    ``False`` when the series was fresh enough that no provider call was made.
+    """
+    symbol = _normalize_symbol(symbol)
+    sync_key = (symbol, interval)
+    now = time.monotonic()
+    with _price_bar_sync_lock:
+        synced_at = _price_bar_synced_at.get(sync_key)
+        if not force and synced_at is not None and now - synced_at < PRICE_BAR_RESYNC_SECONDS[interval]:
+            return False
+
+    time_series = market_data_provider.time_series(symbol, interval)
+
+    with app.app_context():
+        latest = _latest_price_bar_timestamp(symbol, interval)
+        since_key = None
+        if latest is not None:
+            since_key = latest.date().isoformat() if interval != "5min" else latest.isoformat(sep=" ")
+        bars = _parse_price_bars(time_series, since_key=since_key)
+        try:
+            _upsert_price_bars(symbol, interval, bars)
+            if interval == "5min":
+                _prune_intraday_bars(symbol)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    with _price_bar_sync_lock:
+        _price_bar_synced_at[sync_key] = time.monotonic()
+    return True
+
+
+def load_price_bars(symbol, interval, since=None, limit=None, newest_first=False):
+    """Read stored bars with one indexed range scan on (symbol, interval, timestamp)."""
+    with app.app_context():
+        query = PriceBar.query.filter(PriceBar.symbol == _normalize_symbol(symbol), PriceBar.interval == interval)
+        if since is not None:
+            query = query.filter(PriceBar.timestamp >= since)
+        order = PriceBar.timestamp.desc() if newest_first else PriceBar.timestamp.asc()
+        query = query.order_by(order)
+        if limit is not None:
+            query = query.limit(limit)
+        return [{"timestamp": bar.timestamp, "price": bar.close} for bar in query.all()]
+
+
+def _ensure_price_bars(symbol, interval):
+    """Top up a stored series, tolerating provider failures when local bars already exist."""
+    try:
+        sync_price_bars(symbol, interval)
+    except Exception as exc:
+        if not load_price_bars(symbol, interval, limit=1, newest_first=True):
+            raise
+        app.logger.warning("price_bar_sync_failed symbol=%s interval=%s error=%s; serving stored bars", symbol, interval, exc)
+
+
+def _range_window(range_param, now_est):
+    if range_param == "1D":
+        return now_est.replace(hour=0, minute=0, second=0, microsecond=0)
+    if range_param == "1W":
+        return now_est - timedelta(days=7)
+    if range_param == "1M":
+        return now_est - timedelta(days=30)
+    if range_param == "6M":
+        return now_est - timedelta(days=182)
+    return now_est - timedelta(days=365)
+
+
+# Overviews younger than the soft TTL are served as-is; between the soft and hard TTL the
+# last good overview is served while it is rebuilt in the background; past the hard TTL
+# the rebuild happens inline.
+# Soft TTLs follow the market session like the quote cache.
+STOCK_RANGE_CACHE_TTL_SECONDS = float(os.getenv("STOCK_RANGE_CACHE_TTL_SECONDS", "15"))
+STOCK_RANGE_CACHE_EXTENDED_TTL_SECONDS = float(os.getenv("STOCK_RANGE_CACHE_EXTENDED_TTL_SECONDS", "300"))
+STOCK_RANGE_CACHE_STALE_TTL_SECONDS = float(os.getenv("STOCK_RANGE_CACHE_STALE_TTL_SECONDS", "300"))
+STOCK_RANGE_CACHE_MAX_SIZE = int(os.getenv("STOCK_RANGE_CACHE_MAX_SIZE", "512"))
+stock_range_cache = TTLCache(
+    _session_ttl(STOCK_RANGE_CACHE_TTL_SECONDS, STOCK_RANGE_CACHE_EXTENDED_TTL_SECONDS),
+    STOCK_RANGE_CACHE_MAX_SIZE,
+    stale_ttl_seconds=STOCK_RANGE_CACHE_STALE_TTL_SECONDS,
+    # Ranges with a failed series are not cached, so the next read retries that series.
+    cacheable=lambda stock_ranges: not any("error" in overview for overview in stock_ranges["ranges"].values()),
+)
+
+
+def _overview_for_range(symbol, range_param, quote, points, prev_close_price, now_utc, now_est):
+    current_price = quote["current_price"]
+    quote_change_value = quote["change_value"]
+    quote_change_percent = quote["change_percent"]
+
+    if quote_change_value is not None and quote_change_percent is not None:
+        today_change_value = float(quote_change_value)
+        today_change_percent = float(quote_change_percent)
+    else:
+        today_change_value = current_price - prev_close_price
+        today_change_percent = (today_change_value / prev_close_price * 100.0) if prev_close_price > 0 else None
+
+    window_start = _range_window(range_param, now_est).replace(tzinfo=None)
+    filtered_points = [p for p in points if p["timestamp"] >= window_start]
+    if not filtered_points and points:
+        filtered_points = [points[-1]]
+
+    if range_param == "1D" and prev_close_price > 0:
+        range_start_price = prev_close_price
+        range_change_value = today_change_value
+        range_change_percent = today_change_percent
+    else:
+        range_start_price = filtered_points[0]["price"] if filtered_points else current_price
+        range_change_value = current_price - range_start_price
+        range_change_percent = (range_change_value / range_start_price * 100.0) if range_start_price > 0 else None
+
+    app.logger.info(
+        "stock_overview_metrics symbol=%s range=%s as_of=%s current=%s prev_close=%s range_start=%s",
+        symbol,
+        range_param,
+        now_utc.isoformat(),
+        current_price,
+        prev_close_price,
+        range_start_price,
+    )
+    if prev_close_price <= 0 or range_start_price <= 0:
+        app.logger.warning("metric_warning_missing_baseline symbol=%s range=%s", symbol, range_param)
+
+    chart_points = [
+        {
+            "timestamp": p["timestamp"].isoformat(),
+            "price": _round_metric(p["price"]),
+        }
+        for p in filtered_points
+    ]
+
+    latest_point_ts = chart_points[-1]["timestamp"] if chart_points else now_utc.isoformat()
+    is_stale = False
+    if chart_points:
+        latest_ts = datetime.fromisoformat(latest_point_ts)
+        if latest_ts.tzinfo is None:
+            latest_ts = latest_ts.replace(tzinfo=timezone.utc)
+        age_seconds = (now_utc - latest_ts.astimezone(timezone.utc)).total_seconds()
+        is_stale = age_seconds > 900
+        if is_stale:
+            app.logger.warning("provider_data_stale symbol=%s range=%s latest_point_ts=%s age_seconds=%s", symbol, range_param, latest_point_ts, age_seconds)
+
+    app.logger.info("provider_snapshot symbol=%s quote_timestamp=%s chart_latest=%s", symbol, now_utc.isoformat(), latest_point_ts)
+
+    return {
+        "symbol": symbol.upper(),
+        "as_of_timestamp": now_utc.isoformat(),
+        "current_price": _round_metric(current_price),
+        "prev_close_price": _round_metric(prev_close_price),
+        "today_change_value": _round_metric(today_change_value),
+        "today_change_percent": _round_metric(today_change_percent),
+        "range": range_param,
+        "range_start_price": _round_metric(range_start_price),
+        "range_change_value": _round_metric(range_change_value),
+        "range_change_percent": _round_metric(range_change_percent),
+        "chart_points": chart_points,
+        "metadata": {
+            "price_source": "alpha_vantage",
+            "timezone": "America/New_York",
+            "market_session": _market_session(now_est),
+            "is_stale": is_stale,
+        },
+    }
+
+
+def build_stock_ranges(symbol):
+    """Compute every chart range for ``symbol`` from one quote and one top-up per backing series.
+
+    Each stored series (intraday, daily, weekly) is topped up at most once and
+    read with a single range scan wide enough for all ranges that use it; the
+    prev-close fallback is taken from the same daily bars. Ranges whose series
+    could not be loaded carry an ``error`` entry instead of an overview.
+    """
+    symbol = _normalize_symbol(symbol)
+    now_utc = datetime.now(timezone.utc)
+    now_est = now_utc.astimezone(pytz.timezone("America/New_York"))
+
+    global_quote = get_global_quote(symbol)
+    quote_change_percent = global_quote.get("10. change percent")
+    if quote_change_percent is not None:
+        quote_change_percent = quote_change_percent.replace("%", "")
+    quote = {
+        "current_price": float(global_quote.get("05. price") or 0),
+        "change_value": global_quote.get("09. change"),
+        "change_percent": quote_change_percent,
+    }
+    prev_close_price = float(global_quote.get("08. previous close") or 0)
+
+    points_by_interval = {}
+    errors_by_interval = {}
+    for interval in PRICE_BAR_INTERVALS:
+        ranges = [r for r, i in RANGE_BAR_INTERVAL.items() if i == interval]
+        widest_start = min(_range_window(r, now_est) for r in ranges).replace(tzinfo=None)
+        try:
+            _ensure_price_bars(symbol, interval)
+            points = load_price_bars(symbol, interval, since=widest_start)
+            if not points:
+                points = load_price_bars(symbol, interval, limit=1, newest_first=True)
+            points_by_interval[interval] = points
+        except Exception as exc:
+            errors_by_interval[interval] = str(exc)
+
+    if prev_close_price <= 0 and "daily" in points_by_interval:
+        prev_close_candidates = load_price_bars(symbol, "daily", limit=2, newest_first=True)
+        if len(prev_close_candidates) > 1:
+            prev_close_price = prev_close_candidates[1]["price"]
+
+    ranges = {}
+    for range_param, interval in RANGE_BAR_INTERVAL.items():
+        if interval in errors_by_interval:
+            ranges[range_param] = {"error": errors_by_interval[interval]}
+            continue
+        ranges[range_param] = _overview_for_range(
+            symbol, range_param, quote, points_by_interval[interval], prev_close_price, now_utc, now_est,
+        )
+    return {"symbol": symbol, "as_of_timestamp": now_utc.isoformat(), "ranges": ranges}
+
+
+def build_stock_overview(symbol, range_param):
+    range_param = (range_param or "1M").upper()
+    if range_param not in VALID_RANGES:
+        raise ValueError("Invalid range")
+
+    symbol = _normalize_symbol(symbol)
+    stock_ranges, cache_age, cache_is_stale = stock_range_cache.get_with_age(symbol, lambda: build_stock_ranges(symbol))
+    overview = stock_ranges["ranges"][range_param]
+    if "error" in overview:
+        raise Exception(overview["error"])
+    return {
+        **overview,
+        "metadata": {
+            **overview["metadata"],
+            "is_stale": overview["metadata"]["is_stale"] or cache_is_stale,
+            "cache_age_seconds": _round_metric(cache_age, 3),
+        },
+    }
+
+
+def _account_display_name(account_type, competition_name=None, competition_code=None, team_name=None):
+    if account_type == "global":
+        return "Global Account"
+    if account_type == "competition":
+        return competition_name or competition_code
+    if account_type == "team_competition":
+        if team_name and (competition_name or competition_code):
+            return f"{team_name} • {competition_name or competition_code}"
+        return team_name or competition_name or competition_code
+    return "Account"
+
+
+VALID_ACCOUNT_TYPES = {"global", "competition", "team_competition"}
+
+
+def _normalize_account_type(raw_account_type):
+    if raw_account_type is None:
+        return None
+    normalized = str(raw_account_type).strip().lower()
+    if normalized in {"competition individual", "competition_individual"}:
+        return "competition"
+    if normalized == "team":
+        return "team_competition"
+    return normalized
+
+
+def _parse_snapshot_date(raw_date):
+    if raw_date in (None, ""):
+        return datetime.now(timezone.utc).date()
+    if isinstance(raw_date, date):
+        return raw_date
+    try:
+        return datetime.strptime(str(raw_date), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("date must be in YYYY-MM-DD format")
+
+
+def _validate_performance_payload(data):
+    username = (data.get("username") or "").strip()
+    account_id = str(data.get("account_id") or "").strip()
+    account_type = _normalize_account_type(data.get("account_type"))
+
+    if not username:
+        return None, "username is required"
+    if not account_id:
+        return None, "account_id is required"
+    if not account_type:
+        return None, "account_type is required"
+    if account_type not in VALID_ACCOUNT_TYPES:
+        return None, "account_type is invalid"
+
+    try:
+        snapshot_date = _parse_snapshot_date(data.get("date"))
+    except ValueError as exc:
+        return None, str(exc)
+
+    try:
+        total_value = float(data.get("total_value"))
+    except (TypeError, ValueError):
+        return None, "total_value must be numeric"
+
+    try:
+        cash = float(data.get("cash"))
+    except (TypeError, ValueError):
+        return None, "cash must be numeric"
+
+    total_pnl_raw = data.get("total_pnl")
+    if total_pnl_raw in (None, ""):
+        total_pnl = None
+    else:
+        try:
+            total_pnl = float(total_pnl_raw)
+        except (TypeError, ValueError):
+            return None, "total_pnl must be numeric when provided"
+
+    return {
+        "username": username,
+        "account_id": account_id,
+        "account_type": account_type,
+        "date": snapshot_date,
+        "total_value": total_value,
+        "cash": cash,
+        "total_pnl": total_pnl,
+    }, None
+
+
+def _upsert_account_performance_snapshot_record(snapshot):
+    statement = None
+    if db.engine.dialect.name == 'postgresql':
         statement = text(
             """
             INSERT INTO account_performance_history
@@ -3935,109 +5682,595 @@ def _upsert_account_performance_snapshot_record(snapshot):
     db.session.execute(statement, snapshot)
 
 
-def _calculate_holdings_value_and_unrealized(holdings, price_getter):
-    total_holdings_value = 0.0
-    unrealized_pnl = 0.0
-    for holding in holdings:
+def _generate_daily_account_snapshots(snapshot_date):
+    frame = HoldingsFrame()
+    cash = {}
+    accounts = []
+
+    for user in User.query.all():
+        key = ("global", user.id)
+        frame.add(key, Holding.query.filter_by(user_id=user.id).all())
+        cash[key] = user.cash_balance
+        accounts.append((key, user, [user]))
+
+    for member in CompetitionMember.query.all():
+        user = db.session.get(User, member.user_id)
+        if not user:
+            continue
+        key = ("competition", member.id)
+        frame.add(key, CompetitionHolding.query.filter_by(competition_member_id=member.id).all())
+        cash[key] = member.cash_balance
+        accounts.append((key, member, [user]))
+
+    for ct in CompetitionTeam.query.all():
+        team_members = TeamMember.query.filter_by(team_id=ct.team_id).all()
+        users = [user for user in (db.session.get(User, tm.user_id) for tm in team_members) if user]
+        if not users:
+            continue
+        key = ("team_competition", ct.id)
+        frame.add(key, CompetitionTeamHolding.query.filter_by(competition_team_id=ct.id).all())
+        cash[key] = ct.cash_balance
+        accounts.append((key, ct, users))
+
+    valuation = value_portfolios(frame, get_quotes(list(frame.symbols)), cash=cash)
+
+    snapshots = []
+    for key, account, users in accounts:
+        account_type, account_pk = key
+        values = valuation.account(key)
+        for user in users:
+            snapshots.append({
+                "username": user.username,
+                "account_id": f"global:{account_pk}" if account_type == "global" else str(account_pk),
+                "account_type": account_type,
+                "date": snapshot_date,
+                "total_value": values["total_value"],
+                "cash": account.cash_balance,
+                "total_pnl": (account.realized_pnl or 0.0) + values["unrealized_pnl"],
+            })
+
+    return snapshots
+
+
+def run_daily_account_performance_snapshot_job():
+    with app.app_context():
+        eastern_tz = pytz.timezone('America/New_York')
+        snapshot_date = datetime.now(eastern_tz).date()
+        snapshots = _generate_daily_account_snapshots(snapshot_date)
+        upsert_count = 0
         try:
-            price = price_getter(holding.symbol)
+            for snapshot in snapshots:
+                _upsert_account_performance_snapshot_record(snapshot)
+                upsert_count += 1
+            db.session.commit()
         except Exception:
-            price = 0.0
-        total_holdings_value += price * holding.quantity
-        unrealized_pnl += (price - holding.buy_price) * holding.quantity
-    return total_holdings_value, unrealized_pnl
+            db.session.rollback()
+            app.logger.exception('Automatic daily account performance snapshot job failed')
+            return
+        app.logger.info(
+            "Automatic daily account performance snapshot job completed for %s with %s upserts",
+            snapshot_date.isoformat(),
+            upsert_count
+        )
 
+# --------------------
+# Portfolio Valuation Engine
+# --------------------
+class HoldingsFrame:
+    """Holdings of any account type as parallel columns: account row, symbol row, quantity, cost.
 
-def _generate_daily_account_snapshots(snapshot_date):
-    snapshots = []
-    cached_prices = {}
+    Accounts are identified by any hashable key (e.g. ``("competition", member_id)``).
+    Positions added for one account are contiguous; ``slices[key]`` locates them.
+    """
 
-    def price_getter(symbol):
-        key = symbol.upper()
-        if key not in cached_prices:
-            cached_prices[key] = get_current_price(key)
-        return cached_prices[key]
+    def __init__(self):
+        self.accounts = {}
+        self.symbols = {}
+        self.slices = {}
+        self.account_index = []
+        self.symbol_index = []
+        self.quantity = []
+        self.cost = []
+
+    def add_account(self, key):
+        return self.accounts.setdefault(key, len(self.accounts))
+
+    def add(self, key, holdings):
+        """Append rows with ``symbol``, ``quantity`` and ``buy_price`` attributes under account ``key``."""
+        return self.add_columns(key, [(h.symbol, h.quantity, h.buy_price) for h in holdings])
+
+    def add_columns(self, key, rows):
+        """Append ``(symbol, quantity, buy_price)`` tuples under account ``key``; repeat keys are ignored."""
+        if key in self.slices:
+            return self.slices[key]
+        account = self.add_account(key)
+        start = len(self.quantity)
+        for symbol, quantity, buy_price in rows:
+            self.account_index.append(account)
+            self.symbol_index.append(self.symbols.setdefault(symbol, len(self.symbols)))
+            self.quantity.append(quantity)
+            self.cost.append(buy_price)
+        self.slices[key] = slice(start, len(self.quantity))
+        return self.slices[key]
+
+
+class PortfolioValuation:
+    """Per-position and per-account results of ``value_portfolios``; accessors return plain floats."""
+
+    def __init__(self, frame, position_price, position_value, position_unrealized, position_weight,
+                 market_value, unrealized_pnl, prev_close_value, cash):
+        self.frame = frame
+        self.position_price = position_price
+        self.position_value = position_value
+        self.position_unrealized = position_unrealized
+        self.position_weight = position_weight
+        self.market_value = market_value
+        self.unrealized_pnl = unrealized_pnl
+        self.prev_close_value = prev_close_value
+        self.cash = cash
+
+    def account(self, key):
+        row = self.frame.accounts[key]
+        return {
+            "market_value": float(self.market_value[row]),
+            "unrealized_pnl": float(self.unrealized_pnl[row]),
+            "prev_close_value": float(self.prev_close_value[row]),
+            "cash": float(self.cash[row]),
+            "total_value": float(self.cash[row] + self.market_value[row]),
+        }
 
-    users = User.query.all()
-    for user in users:
-        holdings = Holding.query.filter_by(user_id=user.id).all()
-        holdings_value, unrealized_pnl = _calculate_holdings_value_and_unrealized(holdings, price_getter)
-        total_value = user.cash_balance + holdings_value
-        snapshots.append({
-            "username": user.username,
-            "account_id": f"global:{user.id}",
-            "account_type": "global",
-            "date": snapshot_date,
-            "total_value": total_value,
-            "cash": user.cash_balance,
-            "total_pnl": (user.realized_pnl or 0.0) + unrealized_pnl,
-        })
+    def positions(self, key):
+        """``(price, value, unrealized_pnl, weight)`` per position of ``key`` in insertion order."""
+        window = self.frame.slices.get(key, slice(0, 0))
+        return list(zip(
+            self.position_price[window].tolist(),
+            self.position_value[window].tolist(),
+            self.position_unrealized[window].tolist(),
+            self.position_weight[window].tolist(),
+        ))
 
-    members = CompetitionMember.query.all()
-    for member in members:
-        user = db.session.get(User, member.user_id)
-        if not user:
+
+def value_portfolios(frame, quotes, cash=None, missing_price_uses_cost=False, prev_closes=None):
+    """Value every position and account in ``frame`` against ``quotes`` in one vectorized pass.
+
+    ``quotes`` maps symbol to ``(price, prev_close)`` as returned by ``get_quotes``.
+    Symbols without a quote are valued at 0, or at cost with ``missing_price_uses_cost``.
+    ``cash`` maps account key to cash balance; position weights are shares of the
+    account's total value (cash plus holdings). ``prev_closes`` maps symbols to a
+    previous close that takes precedence over the quote's.
+    """
+    account_rows = np.asarray(frame.account_index, dtype=np.intp)
+    symbol_rows = np.asarray(frame.symbol_index, dtype=np.intp)
+    quantity = np.asarray(frame.quantity, dtype=float)
+    cost = np.asarray(frame.cost, dtype=float)
+    account_count = len(frame.accounts)
+
+    price_vector = np.full(len(frame.symbols), np.nan)
+    prev_close_vector = np.full(len(frame.symbols), np.nan)
+    for symbol, row in frame.symbols.items():
+        quote = quotes.get(symbol)
+        if quote is not None:
+            price_vector[row], prev_close_vector[row] = quote
+            if prev_closes and symbol in prev_closes:
+                prev_close_vector[row] = prev_closes[symbol]
+
+    fallback = cost if missing_price_uses_cost else 0.0
+    price = price_vector[symbol_rows]
+    missing = np.isnan(price)
+    price = np.where(missing, fallback, price)
+    prev_close = np.where(missing, fallback, prev_close_vector[symbol_rows])
+
+    position_value = price * quantity
+    position_unrealized = (price - cost) * quantity
+    market_value = np.bincount(account_rows, weights=position_value, minlength=account_count)
+    unrealized_pnl = np.bincount(account_rows, weights=position_unrealized, minlength=account_count)
+    prev_close_value = np.bincount(account_rows, weights=prev_close * quantity, minlength=account_count)
+
+    cash_vector = np.zeros(account_count)
+    for key, balance in (cash or {}).items():
+        if key in frame.accounts:
+            cash_vector[frame.accounts[key]] = balance or 0.0
+    account_total = (cash_vector + market_value)[account_rows]
+    position_weight = np.divide(position_value, account_total, out=np.zeros_like(position_value), where=account_total > 0)
+
+    return PortfolioValuation(
+        frame, price, position_value, position_unrealized, position_weight,
+        market_value, unrealized_pnl, prev_close_value, cash_vector,
+    )
+
+
+def _portfolio_rows(holdings, valuation, key, stale_quotes):
+    return [
+        {
+            'symbol': h.symbol,
+            'quantity': h.quantity,
+            'current_price': price,
+            'total_value': value,
+            'buy_price': h.buy_price,
+            'weight': weight,
+            'price_is_stale': h.symbol in stale_quotes,
+        }
+        for h, (price, value, _, weight) in zip(holdings, valuation.positions(key))
+    ]
+
+
+def _group_by_attribute(rows, attribute):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(getattr(row, attribute), []).append(row)
+    return grouped
+
+
+def _load_user_competition_accounts(user, include_holdings=True):
+    """Load a user's competition and team-competition accounts with a fixed number of queries.
+
+    Returns ``(competition_rows, team_rows)`` shaped as ``(member, competition, holdings)`` and
+    ``(competition_team, competition, team, holdings)``. Memberships whose competition or team
+    no longer exists are skipped so legacy data cannot break account loading. Holdings come from
+    ``account_state``; with ``include_holdings=False`` it is not read and every list is empty.
+    """
+    competition_pairs = (
+        db.session.query(CompetitionMember, Competition)
+        .join(Competition, Competition.id == CompetitionMember.competition_id)
+        .filter(CompetitionMember.user_id == user.id)
+        .order_by(CompetitionMember.id)
+        .all()
+    )
+    team_triples = (
+        db.session.query(CompetitionTeam, Competition, Team)
+        .join(TeamMember, TeamMember.team_id == CompetitionTeam.team_id)
+        .join(Competition, Competition.id == CompetitionTeam.competition_id)
+        .join(Team, Team.id == CompetitionTeam.team_id)
+        .filter(TeamMember.user_id == user.id)
+        .order_by(TeamMember.id, CompetitionTeam.id)
+        .all()
+    )
+
+    states = load_account_states({
+        "competition": [m for m, _ in competition_pairs],
+        "team_competition": [ct for ct, _, _ in team_triples],
+    }) if include_holdings else {}
+
+    def holdings(key):
+        return states[key].holdings() if key in states else []
+
+    competition_rows = [(m, comp, holdings(("competition", m.id))) for m, comp in competition_pairs]
+    team_rows = [(ct, comp, team, holdings(("team_competition", ct.id))) for ct, comp, team in team_triples]
+    return competition_rows, team_rows
+
+
+# --------------------
+# Account State
+# --------------------
+# account_state mirrors each account's holdings so reads and position-limit checks need one row
+# per account instead of the holding tables. Trades update it in their own transaction; bulk
+# deletes drop the affected rows. Reads rebuild missing rows from holdings without writing them,
+# and backfill_account_states stores them in its own transaction.
+ACCOUNT_STATE_BACKFILL_INTERVAL_SECONDS = int(os.getenv("ACCOUNT_STATE_BACKFILL_INTERVAL_SECONDS", "60"))
+ACCOUNT_STATE_BACKFILL_BATCH_SIZE = int(os.getenv("ACCOUNT_STATE_BACKFILL_BATCH_SIZE", "500"))
+
+AccountPosition = namedtuple("AccountPosition", "symbol quantity buy_price")
+
+# Price-independent /user payloads keyed by (user id, User.portfolio_version). Account changes bump
+# the version; prices are re-marked on every hit, so the TTL only bounds metadata edits (names, roles).
+USER_PAYLOAD_CACHE_TTL_SECONDS = float(os.getenv("USER_PAYLOAD_CACHE_TTL_SECONDS", "300"))
+USER_PAYLOAD_CACHE_MAX_SIZE = int(os.getenv("USER_PAYLOAD_CACHE_MAX_SIZE", "2048"))
+user_payload_cache = TTLCache(USER_PAYLOAD_CACHE_TTL_SECONDS, USER_PAYLOAD_CACHE_MAX_SIZE)
+_user_payload_rebuild_ms = deque(maxlen=512)
+# Valued accounts last served per (user id, version token), the base for `/user?since=` deltas.
+USER_PAYLOAD_SNAPSHOT_TTL_SECONDS = float(os.getenv("USER_PAYLOAD_SNAPSHOT_TTL_SECONDS", "600"))
+user_payload_snapshots = TTLCache(USER_PAYLOAD_SNAPSHOT_TTL_SECONDS, USER_PAYLOAD_CACHE_MAX_SIZE * 4)
+_user_payload_rebuild_lock = threading.Lock()
+
+# account_type -> (account model, holding model, holding column referencing the account)
+ACCOUNT_STATE_SOURCES = {
+    "global": (User, Holding, "user_id"),
+    "competition": (CompetitionMember, CompetitionHolding, "competition_member_id"),
+    "team_competition": (CompetitionTeam, CompetitionTeamHolding, "competition_team_id"),
+}
+
+
+def _positions_from_holdings(holdings):
+    merged = OrderedDict()
+    for h in holdings:
+        if h.symbol in merged:
+            quantity, buy_price = merged[h.symbol]
+            total = quantity + h.quantity
+            # Legacy duplicate rows collapse into one position at their weighted cost.
+            merged[h.symbol] = (total, (quantity * buy_price + h.quantity * h.buy_price) / total if total else buy_price)
+        else:
+            merged[h.symbol] = (h.quantity, h.buy_price)
+    return [[symbol, quantity, buy_price] for symbol, (quantity, buy_price) in merged.items()]
+
+
+def _build_account_states(account_type, accounts):
+    """Return fresh ``AccountState`` objects for ``accounts`` built from one holdings query."""
+    _, holding_model, account_column = ACCOUNT_STATE_SOURCES[account_type]
+    holdings = _group_by_attribute(
+        holding_model.query.filter(getattr(holding_model, account_column).in_([a.id for a in accounts]))
+        .order_by(holding_model.id).all(),
+        account_column,
+    )
+    states = []
+    for account in accounts:
+        states.append(AccountState(
+            account_type=account_type,
+            account_id=account.id,
+            positions=_positions_from_holdings(holdings.get(account.id, [])),
+        ))
+    return states
+
+
+def _upsert_account_states(states, overwrite=False):
+    """Write ``states`` in the current session with one dialect upsert; the caller's commit persists them.
+
+    Concurrent builders of the same row never fail on the primary key: by default the first
+    row wins, with ``overwrite`` the caller's rebuild does.
+    """
+    insert = _dialect_insert()(AccountState.__table__).values([
+        {"account_type": state.account_type, "account_id": state.account_id, "positions": state.positions}
+        for state in states
+    ])
+    if overwrite:
+        insert = insert.on_conflict_do_update(
+            index_elements=["account_type", "account_id"],
+            set_={"positions": insert.excluded.positions},
+        )
+    else:
+        insert = insert.on_conflict_do_nothing()
+    db.session.execute(insert)
+
+
+def load_account_states(accounts_by_type):
+    """Return ``{(account_type, account_id): AccountState}`` for ``{account_type: [account rows]}``.
+
+    Reads at most two queries per account type. Missing states are rebuilt from holdings in
+    memory only, so reads never write; ``backfill_account_states`` stores them.
+    """
+    states = {}
+    for account_type, accounts in accounts_by_type.items():
+        accounts = list({a.id: a for a in accounts}.values())
+        if not accounts:
             continue
-        holdings = CompetitionHolding.query.filter_by(competition_member_id=member.id).all()
-        holdings_value, unrealized_pnl = _calculate_holdings_value_and_unrealized(holdings, price_getter)
-        total_value = member.cash_balance + holdings_value
-        snapshots.append({
-            "username": user.username,
-            "account_id": str(member.id),
-            "account_type": "competition",
-            "date": snapshot_date,
-            "total_value": total_value,
-            "cash": member.cash_balance,
-            "total_pnl": (member.realized_pnl or 0.0) + unrealized_pnl,
-        })
+        for state in AccountState.query.filter(
+            AccountState.account_type == account_type,
+            AccountState.account_id.in_([a.id for a in accounts]),
+        ).all():
+            states[(account_type, state.account_id)] = state
+        missing = [a for a in accounts if (account_type, a.id) not in states]
+        if not missing:
+            continue
+        built = _build_account_states(account_type, missing)
+        states.update(((account_type, state.account_id), state) for state in built)
+    return states
+
+
+def sync_account_state(account_type, account, symbol):
+    """Bring ``symbol`` in ``account``'s state in line with its pending holdings change.
+
+    Call after a trade has modified the holding and cash balance and before the commit, so the
+    state changes in the same transaction. A missing state is built in full. Also bumps the
+    ``/user`` payload version of every user who sees the account.
+    """
+    _, holding_model, account_column = ACCOUNT_STATE_SOURCES[account_type]
+    state = (
+        AccountState.query.filter_by(account_type=account_type, account_id=account.id)
+        .with_for_update()
+        .first()
+    )
+    bump_portfolio_versions(_account_user_ids(account_type, account))
+    if state is None:
+        # Another request may be building the same row; the upsert keeps this trade's rebuild.
+        state = _build_account_states(account_type, [account])[0]
+        _upsert_account_states([state], overwrite=True)
+        return state
+    holdings = (
+        holding_model.query.filter(getattr(holding_model, account_column) == account.id, holding_model.symbol == symbol)
+        .order_by(holding_model.id).all()
+    )
+    replacement = _positions_from_holdings(holdings)
+    positions = []
+    replaced = False
+    for position in state.positions:
+        if position[0] != symbol:
+            positions.append(position)
+        elif not replaced:
+            positions.extend(replacement)
+            replaced = True
+    if not replaced:
+        positions.extend(replacement)
+    state.positions = positions
+    return state
+
+
+def backfill_account_states(batch_size=ACCOUNT_STATE_BACKFILL_BATCH_SIZE):
+    """Store up to ``batch_size`` missing states per account type in one transaction.
+
+    The accounts are locked before their holdings are read, so a trade or reset changing them
+    commits first and is reflected; accounts deleted meanwhile are skipped. Rows a trade stored
+    in the meantime are kept. Returns the number of rows stored.
+    """
+    try:
+        built = []
+        for account_type, (account_model, _, _) in ACCOUNT_STATE_SOURCES.items():
+            has_state = db.session.query(AccountState.account_id).filter(
+                AccountState.account_type == account_type,
+                AccountState.account_id == account_model.id,
+            ).exists()
+            missing = (
+                account_model.query.filter(~has_state)
+                .order_by(account_model.id)
+                .limit(batch_size)
+                .with_for_update()
+                .all()
+            )
+            if missing:
+                built.extend(_build_account_states(account_type, missing))
+        if built:
+            _upsert_account_states(built)
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        app.logger.warning("account_state_backfill_failed error=%s", exc)
+        return 0
+    if built:
+        app.logger.info("account_state_backfill stored=%s", len(built))
+    return len(built)
+
+
+def run_account_state_backfill_job():
+    with app.app_context():
+        return backfill_account_states()
+
+
+def account_total_value(account_type, account):
+    """Cash plus holdings of ``account`` from its state; unquoted positions count at cost."""
+    key = (account_type, account.id)
+    frame = HoldingsFrame()
+    frame.add(key, load_account_states({account_type: [account]})[key].holdings())
+    valuation = value_portfolios(
+        frame, get_quotes(list(frame.symbols)), cash={key: account.cash_balance}, missing_price_uses_cost=True
+    )
+    return valuation.account(key)["total_value"]
+
+
+def bump_portfolio_versions(user_ids):
+    """Invalidate cached ``/user`` payloads of ``user_ids`` (a list or subquery) in the caller's transaction."""
+    User.query.filter(User.id.in_(user_ids)).update(
+        {User.portfolio_version: func.coalesce(User.portfolio_version, 0) + 1},
+        synchronize_session=False,
+    )
+
+
+def _account_user_ids(account_type, account):
+    if account_type == "global":
+        return [account.id]
+    if account_type == "competition":
+        return [account.user_id]
+    return db.session.query(TeamMember.user_id).filter(TeamMember.team_id == account.team_id)
+
+
+def invalidate_account_states(account_type, account_ids):
+    """Drop state rows for ``account_ids`` (a list or subquery) after bulk holding changes."""
+    AccountState.query.filter(
+        AccountState.account_type == account_type,
+        AccountState.account_id.in_(account_ids),
+    ).delete(synchronize_session=False)
+
+
+# --------------------
+# Daily Baselines
+# --------------------
+# Previous closes and start-of-day account values are fixed for a trading day, so they are
+# captured once at the open and read from daily_prev_close / account_daily_baseline afterwards.
+# Only today's rows are read; older ones are kept this many days for inspection, then deleted.
+DAILY_BASELINE_RETENTION_DAYS = int(os.getenv("DAILY_BASELINE_RETENTION_DAYS", "7"))
 
-    team_comp_entries = CompetitionTeam.query.all()
-    for ct in team_comp_entries:
-        team_members = TeamMember.query.filter_by(team_id=ct.team_id).all()
-        if not team_members:
-            continue
-        holdings = CompetitionTeamHolding.query.filter_by(competition_team_id=ct.id).all()
-        holdings_value, unrealized_pnl = _calculate_holdings_value_and_unrealized(holdings, price_getter)
-        total_value = ct.cash_balance + holdings_value
-        total_pnl = (ct.realized_pnl or 0.0) + unrealized_pnl
-
-        for tm in team_members:
-            user = db.session.get(User, tm.user_id)
-            if not user:
+
+def _trading_date():
+    return _market_now().date()
+
+
+def capture_daily_baselines(trading_date=None):
+    """Store today's previous close per held symbol and start-of-day value per account.
+
+    Accounts holding a symbol without a fresh quote get no baseline and fall back to the live
+    formula in ``/user``. Also refreshes the legacy ``start_of_day_value`` columns and prunes
+    rows older than ``DAILY_BASELINE_RETENTION_DAYS``. Returns the number of baselines stored.
+    """
+    trading_date = trading_date or _trading_date()
+    accounts = {
+        "global": User.query.all(),
+        "competition": CompetitionMember.query.all(),
+        "team_competition": CompetitionTeam.query.all(),
+    }
+    states = load_account_states(accounts)
+    frame = HoldingsFrame()
+    cash = {}
+    for account_type, rows in accounts.items():
+        for account in rows:
+            key = (account_type, account.id)
+            frame.add(key, states[key].holdings())
+            cash[key] = account.cash_balance or 0.0
+
+    quotes = get_quotes(list(frame.symbols))
+    # A last-known fallback may carry an older day's close, so only fresh quotes are stored.
+    stale = set(stale_quote_symbols(quotes))
+    unpriced = {symbol for symbol in frame.symbols if symbol not in quotes or symbol in stale}
+    valuation = value_portfolios(frame, quotes, cash=cash)
+
+    insert = _dialect_insert()
+    prev_close_rows = [
+        {"trading_date": trading_date, "symbol": symbol, "prev_close": prev_close}
+        for symbol, (_, prev_close) in quotes.items()
+        if symbol not in unpriced
+    ]
+    if prev_close_rows:
+        statement = insert(DailyPrevClose.__table__).values(prev_close_rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['trading_date', 'symbol'],
+            set_={'prev_close': statement.excluded.prev_close},
+        ))
+    baseline_rows = []
+    skipped = 0
+    for account_type, rows in accounts.items():
+        for account in rows:
+            key = (account_type, account.id)
+            if any(h.symbol in unpriced for h in states[key].holdings()):
+                skipped += 1
                 continue
-            snapshots.append({
-                "username": user.username,
-                "account_id": str(ct.id),
-                "account_type": "team_competition",
-                "date": snapshot_date,
-                "total_value": total_value,
-                "cash": ct.cash_balance,
-                "total_pnl": total_pnl,
+            values = valuation.account(key)
+            start_of_day_value = values["cash"] + values["prev_close_value"]
+            account.start_of_day_value = start_of_day_value
+            baseline_rows.append({
+                "trading_date": trading_date, "account_type": account_type,
+                "account_id": account.id, "start_of_day_value": start_of_day_value,
             })
+    if baseline_rows:
+        statement = insert(AccountDailyBaseline.__table__).values(baseline_rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['trading_date', 'account_type', 'account_id'],
+            set_={'start_of_day_value': statement.excluded.start_of_day_value},
+        ))
+    cutoff = trading_date - timedelta(days=DAILY_BASELINE_RETENTION_DAYS)
+    DailyPrevClose.query.filter(DailyPrevClose.trading_date < cutoff).delete(synchronize_session=False)
+    AccountDailyBaseline.query.filter(AccountDailyBaseline.trading_date < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    app.logger.info(
+        "daily_baselines_captured date=%s accounts=%s skipped=%s symbols=%s unpriced=%s",
+        trading_date.isoformat(), len(baseline_rows), skipped, len(prev_close_rows), len(unpriced),
+    )
+    return len(baseline_rows)
+
+
+def load_daily_baselines(keys, symbols, trading_date):
+    """Return ``({account key: start_of_day_value}, {symbol: prev_close})`` stored for ``trading_date``."""
+    baselines = {}
+    for account_type in {account_type for account_type, _ in keys}:
+        ids = [account_id for key_type, account_id in keys if key_type == account_type]
+        for row in AccountDailyBaseline.query.filter(
+            AccountDailyBaseline.trading_date == trading_date,
+            AccountDailyBaseline.account_type == account_type,
+            AccountDailyBaseline.account_id.in_(ids),
+        ).all():
+            baselines[(account_type, row.account_id)] = row.start_of_day_value
+    prev_closes = {
+        row.symbol: row.prev_close
+        for row in DailyPrevClose.query.filter(
+            DailyPrevClose.trading_date == trading_date,
+            DailyPrevClose.symbol.in_(list(symbols)),
+        ).all()
+    } if symbols else {}
+    return baselines, prev_closes
 
-    return snapshots
 
+def clear_daily_baselines(account_type, account_ids):
+    """Drop stored baselines after a reset so today's P&L restarts from the new balance."""
+    AccountDailyBaseline.query.filter(
+        AccountDailyBaseline.account_type == account_type,
+        AccountDailyBaseline.account_id.in_(account_ids),
+    ).delete(synchronize_session=False)
 
-def run_daily_account_performance_snapshot_job():
-    with app.app_context():
-        eastern_tz = pytz.timezone('America/New_York')
-        snapshot_date = datetime.now(eastern_tz).date()
-        snapshots = _generate_daily_account_snapshots(snapshot_date)
-        upsert_count = 0
-        try:
-            for snapshot in snapshots:
-                _upsert_account_performance_snapshot_record(snapshot)
-                upsert_count += 1
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-            app.logger.exception('Automatic daily account performance snapshot job failed')
-            return
-        app.logger.info(
-            "Automatic daily account performance snapshot job completed for %s with %s upserts",
-            snapshot_date.isoformat(),
-            upsert_count
-        )
 
 # --------------------
 # Endpoints for Registration and Login
@@ -4058,6 +6291,57 @@ def register():
     db.session.commit()
     return jsonify({'message': 'User created successfully'})
 
+def _competition_account_stub(user, m, comp):
+    return {
+        "account_id": m.id,
+        "competition_member_id": m.id,
+        "competitionMemberId": m.id,
+        "user_id": user.id,
+        "userId": user.id,
+        "competition_id": comp.id,
+        "code": comp.code,
+        "competition_code": comp.code,
+        "name": comp.name,
+        "competition_name": comp.name,
+        "account_type": "competition",
+        "team_name": None,
+        "account_display_name": _account_display_name("competition", competition_name=comp.name, competition_code=comp.code),
+        "cash_balance": m.cash_balance,
+        "realized_pnl": m.realized_pnl or 0.0,
+        "is_instructor_for_competition": _is_competition_instructor(user, comp),
+    }
+
+
+def _team_competition_account_stub(user, ct, comp, team):
+    return {
+        "account_id": ct.id,
+        "competition_id": comp.id,
+        "code": comp.code,
+        "competition_code": comp.code,
+        "name": comp.name,
+        "competition_name": comp.name,
+        "account_type": "team_competition",
+        "account_display_name": _account_display_name("team_competition", competition_name=comp.name, competition_code=comp.code, team_name=team.name),
+        "cash_balance": ct.cash_balance,
+        "realized_pnl": ct.realized_pnl or 0.0,
+        "team_id": ct.team_id,
+        "team_name": team.name,
+        "is_instructor_for_competition": _is_competition_instructor(user, comp),
+        # Unified payload for rendering team+competition in one UI container.
+        "team_competition": {
+            "team": {"id": ct.team_id, "name": team.name},
+            "competition": {"code": comp.code, "name": comp.name}
+        }
+    }
+
+
+def _login_valuation_requested(data):
+    flag = data.get('include_valuation', request.args.get('include_valuation'))
+    if isinstance(flag, str):
+        return flag.strip().lower() in ('1', 'true', 'yes')
+    return bool(flag)
+
+
 @app.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -4066,132 +6350,51 @@ def login():
     user = User.query.filter_by(username=username).first()
 
     if user and user.check_password(password):
-        # --- Competition Accounts ---
-        competition_accounts = []
-        memberships = CompetitionMember.query.filter_by(user_id=user.id).all()
-        for m in memberships:
-            comp = db.session.get(Competition, m.competition_id)
-            if comp:
-                comp_holdings = CompetitionHolding.query.filter_by(competition_member_id=m.id).all()
-                comp_portfolio = []
-                total_holdings_value = 0
-                comp_pnl = 0
-
-                for ch in comp_holdings:
-                    try:
-                        price = get_current_price(ch.symbol)
-                    except Exception:
-                        price = 0
-                    value = price * ch.quantity
-                    pnl = (price - ch.buy_price) * ch.quantity
-                    comp_pnl += pnl
-                    total_holdings_value += value
-                    comp_portfolio.append({
-                        "symbol": ch.symbol,
-                        "quantity": ch.quantity,
-                        "current_price": price,
-                        "total_value": value,
-                        "buy_price": ch.buy_price
-                    })
-
-                total_value = m.cash_balance + total_holdings_value
+        include_valuation = _login_valuation_requested(data)
+        competition_rows, team_rows = _load_user_competition_accounts(user, include_holdings=include_valuation)
+        competition_accounts = [_competition_account_stub(user, m, comp) for m, comp, _ in competition_rows]
+        team_competitions = [_team_competition_account_stub(user, ct, comp, team) for ct, comp, team, _ in team_rows]
+
+        # Without include_valuation, login answers with identity and account stubs only;
+        # clients load prices and values from /user once the session is established.
+        if include_valuation:
+            frame = HoldingsFrame()
+            cash = {}
+            for m, _, comp_holdings in competition_rows:
+                frame.add(("competition", m.id), comp_holdings)
+                cash[("competition", m.id)] = m.cash_balance
+            for ct, _, _, ct_holdings in team_rows:
+                frame.add(("team_competition", ct.id), ct_holdings)
+                cash[("team_competition", ct.id)] = ct.cash_balance
+            quotes = get_quotes(list(frame.symbols))
+            stale_quotes = stale_quote_symbols(quotes)
+            valuation = value_portfolios(frame, quotes, cash=cash)
+
+            valued_rows = (
+                [(account, ("competition", m.id), holdings) for account, (m, _, holdings) in zip(competition_accounts, competition_rows)]
+                + [(account, ("team_competition", ct.id), holdings) for account, (ct, _, _, holdings) in zip(team_competitions, team_rows)]
+            )
+            for account, key, holdings in valued_rows:
+                portfolio = _portfolio_rows(holdings, valuation, key, stale_quotes)
+                total_value = valuation.account(key)["total_value"]
                 total_pnl = total_value - 100000
-                return_pct = (total_pnl / 100000) * 100
-
-                competition_accounts.append({
-                    "account_id": m.id,
-                    "competition_member_id": m.id,
-                    "competitionMemberId": m.id,
-                    "user_id": user.id,
-                    "userId": user.id,
-                    "competition_id": comp.id,
-                    "code": comp.code,
-                    "competition_code": comp.code,
-                    "name": comp.name,
-                    "competition_name": comp.name,
-                    "account_type": "competition",
-                    "team_name": None,
-                    "account_display_name": _account_display_name("competition", competition_name=comp.name, competition_code=comp.code),
-                    "cash_balance": m.cash_balance,
-                    "portfolio": comp_portfolio,
+                account.update({
+                    "portfolio": portfolio,
                     "total_value": total_value,
                     "pnl": total_pnl,
-                    "return_pct": return_pct,
-                    "realized_pnl": m.realized_pnl or 0.0,
-                    "is_instructor_for_competition": _is_competition_instructor(user, comp),
+                    "return_pct": (total_pnl / 100000) * 100,
+                    "prices_stale": any(row["price_is_stale"] for row in portfolio),
                 })
 
-        # --- Team Competitions ---
-        team_memberships = TeamMember.query.filter_by(user_id=user.id).all()
-        team_competitions = []
-        for tm in team_memberships:
-            ct_entries = CompetitionTeam.query.filter_by(team_id=tm.team_id).all()
-            for ct in ct_entries:
-                comp = db.session.get(Competition, ct.competition_id)
-                if comp:
-                    team = db.session.get(Team, ct.team_id)
-                    if not team:
-                        # Skip orphaned records so legacy data cannot break account loading.
-                        continue
-                    team_name = team.name
-                    ct_holdings = CompetitionTeamHolding.query.filter_by(competition_team_id=ct.id).all()
-                    team_portfolio = []
-                    total_holdings_value = 0
-                    team_pnl = 0
-
-                    for cht in ct_holdings:
-                        try:
-                            price = get_current_price(cht.symbol)
-                        except Exception:
-                            price = 0
-                        value = price * cht.quantity
-                        pnl = (price - cht.buy_price) * cht.quantity
-                        team_pnl += pnl
-                        total_holdings_value += value
-                        team_portfolio.append({
-                            "symbol": cht.symbol,
-                            "quantity": cht.quantity,
-                            "current_price": price,
-                            "total_value": value,
-                            "buy_price": cht.buy_price
-                        })
-
-                    total_value = ct.cash_balance + total_holdings_value
-                    total_pnl = total_value - 100000
-                    return_pct = (total_pnl / 100000) * 100
-
-                    team_competitions.append({
-                        "account_id": ct.id,
-                        "competition_id": comp.id,
-                        "code": comp.code,
-                        "competition_code": comp.code,
-                        "name": comp.name,
-                        "competition_name": comp.name,
-                        "account_type": "team_competition",
-                        "account_display_name": _account_display_name("team_competition", competition_name=comp.name, competition_code=comp.code, team_name=team_name),
-                        "cash_balance": ct.cash_balance,
-                        "portfolio": team_portfolio,
-                        "total_value": total_value,
-                        "pnl": total_pnl,
-                        "return_pct": return_pct,
-                        'realized_pnl': ct.realized_pnl or 0.0,
-                        "team_id": ct.team_id,
-                        "team_name": team_name,
-                        "is_instructor_for_competition": _is_competition_instructor(user, comp),
-                        # Unified payload for rendering team+competition in one UI container.
-                        "team_competition": {
-                            "team": {"id": ct.team_id, "name": team_name},
-                            "competition": {"code": comp.code, "name": comp.name}
-                        }
-                    })
-
         return jsonify({
             'message': 'Login successful',
             'username': user.username,
             'cash_balance': user.cash_balance,
             'is_admin': user.is_admin,
             'competition_accounts': competition_accounts,
-            'team_competitions': team_competitions
+            'team_competitions': team_competitions,
+            'accounts_valued': include_valuation,
+            'degraded': is_request_degraded(),
         }), 200
 
     # --- Invalid credentials ---
@@ -4307,220 +6510,184 @@ def reset_password():
 # --------------------
 # Endpoint for Global User Data (including team competition accounts)
 # --------------------
-@app.route('/user', methods=['GET'])
-def get_user():
-    username = request.args.get('username')
-    if not username:
-        return jsonify({'message': 'Username is required'}), 400
+def _build_user_payload_structure(user, trading_date):
+    """Everything ``/user`` returns that does not depend on prices, as plain data safe to cache.
 
-    user = User.query.filter_by(username=username).first()
-    if not user:
-        return jsonify({'message': 'User not found'}), 404
+    Includes the day's stored baselines, so the cache key must include ``trading_date``.
+    """
+    global_stub = {
+        'account_id': f'global:{user.id}',
+        'account_type': 'global',
+        'competition_code': None,
+        'competition_name': None,
+        'team_name': None,
+        'account_display_name': _account_display_name('global'),
+        'cash_balance': user.cash_balance,
+        'realized_pnl': user.realized_pnl,
+    }
+    holdings = load_account_states({"global": [user]})[("global", user.id)].holdings()
+    competition_rows, team_rows = _load_user_competition_accounts(user)
+    accounts = [(('global', user.id), global_stub, holdings)]
+    accounts.extend(
+        (('competition', m.id), _competition_account_stub(user, m, comp), comp_holdings)
+        for m, comp, comp_holdings in competition_rows
+    )
+    accounts.extend(
+        (('team_competition', ct.id), _team_competition_account_stub(user, ct, comp, team), ct_holdings)
+        for ct, comp, team, ct_holdings in team_rows
+    )
+    baselines, prev_closes = load_daily_baselines(
+        [key for key, _, _ in accounts],
+        {h.symbol for _, _, holdings in accounts for h in holdings},
+        trading_date,
+    )
+    return {
+        'username': user.username,
+        'is_admin': user.is_admin,
+        'accounts': accounts,
+        'baselines': baselines,
+        'prev_closes': prev_closes,
+    }
 
-    # --- Global Account ---
-    holdings = Holding.query.filter_by(user_id=user.id).all()
-    global_portfolio = []
-    global_total_holdings_value = 0
-    global_unrealized_pnl = 0
-    global_holdings_prev_close_value = 0
 
-    for h in holdings:
-        try:
-            price, prev_close = get_current_and_prev_close(h.symbol)
-        except Exception:
-            price, prev_close = 0, 0
-        value = price * h.quantity
-        pnl = (price - h.buy_price) * h.quantity
-        global_unrealized_pnl += pnl
-        global_total_holdings_value += value
-        global_holdings_prev_close_value += prev_close * h.quantity
-        global_portfolio.append({
-            'symbol': h.symbol,
-            'quantity': h.quantity,
-            'current_price': price,
-            'total_value': value,
-            'buy_price': h.buy_price
+def _timed_user_payload_build(user, trading_date):
+    started = time.monotonic()
+    structure = _build_user_payload_structure(user, trading_date)
+    with _user_payload_rebuild_lock:
+        _user_payload_rebuild_ms.append((time.monotonic() - started) * 1000.0)
+    return structure
+
+
+def _value_user_payload(structure):
+    """Mark a cached ``/user`` structure to current prices; values every account in one pass."""
+    frame = HoldingsFrame()
+    cash = {}
+    for key, stub, holdings in structure['accounts']:
+        frame.add(key, holdings)
+        cash[key] = stub['cash_balance']
+    quotes = get_quotes(list(frame.symbols))
+    stale_quotes = stale_quote_symbols(quotes)
+    valuation = value_portfolios(frame, quotes, cash=cash, prev_closes=structure['prev_closes'])
+
+    accounts = []
+    for key, stub, holdings in structure['accounts']:
+        portfolio = _portfolio_rows(holdings, valuation, key, stale_quotes)
+        values = valuation.account(key)
+        total_value = values['total_value']
+        # Accounts opened or reset since the open have no baseline; price them from previous closes.
+        start_of_day_value = structure['baselines'].get(key, stub['cash_balance'] + values['prev_close_value'])
+        pnl_today = total_value - start_of_day_value
+        accounts.append({
+            **stub,
+            'portfolio': portfolio,
+            'total_value': total_value,
+            'pnl': (stub['realized_pnl'] or 0.0) + values['unrealized_pnl'],
+            'return_pct': ((total_value - 100000.0) / 100000.0) * 100.0,
+            'start_of_day_value': start_of_day_value,
+            'pnl_today': pnl_today,
+            'pnl_pct_today': (pnl_today / start_of_day_value * 100.0) if start_of_day_value > 0 else 0.0,
+            'prices_stale': any(row['price_is_stale'] for row in portfolio),
         })
 
-    global_total_pnl = (user.realized_pnl or 0.0) + global_unrealized_pnl
-    global_total_value = user.cash_balance + global_total_holdings_value
-    global_return_pct = ((global_total_value - 100000.0) / 100000.0) * 100.0
-    global_start_of_day_value = user.cash_balance + global_holdings_prev_close_value
-    global_pnl_today = global_total_value - global_start_of_day_value
-    global_pnl_pct_today = (global_pnl_today / global_start_of_day_value * 100.0) if global_start_of_day_value > 0 else 0.0
-
-    # --- Individual Competition Accounts ---
-    competition_accounts = []
-    memberships = CompetitionMember.query.filter_by(user_id=user.id).all()
-    for m in memberships:
-        comp = db.session.get(Competition, m.competition_id)
-        if not comp:
-            continue
-
-        comp_holdings = CompetitionHolding.query.filter_by(competition_member_id=m.id).all()
-        comp_portfolio = []
-        comp_total_holdings_value = 0
-        comp_unrealized_pnl = 0
-        comp_holdings_prev_close_value = 0
+    return {
+        'username': structure['username'],
+        'is_admin': structure['is_admin'],
+        'global_account': accounts[0],
+        'accounts': accounts,
+        'competition_accounts': [a for a in accounts if a['account_type'] == 'competition'],
+        'team_competitions': [a for a in accounts if a['account_type'] == 'team_competition'],
+        'degraded': is_request_degraded(),
+    }
 
-        for ch in comp_holdings:
-            try:
-                price, prev_close = get_current_and_prev_close(ch.symbol)
-            except Exception:
-                price, prev_close = 0, 0
-            value = price * ch.quantity
-            pnl = (price - ch.buy_price) * ch.quantity
-            comp_unrealized_pnl += pnl
-            comp_total_holdings_value += value
-            comp_holdings_prev_close_value += prev_close * ch.quantity
-            comp_portfolio.append({
-                'symbol': ch.symbol,
-                'quantity': ch.quantity,
-                'current_price': price,
-                'total_value': value,
-                'buy_price': ch.buy_price
-            })
 
-        comp_total_pnl = (m.realized_pnl or 0.0) + comp_unrealized_pnl
-        comp_total_value = m.cash_balance + comp_total_holdings_value
-        comp_return_pct = ((comp_total_value - 100000.0) / 100000.0) * 100.0
-        comp_start_of_day_value = m.cash_balance + comp_holdings_prev_close_value
-        comp_pnl_today = comp_total_value - comp_start_of_day_value
-        comp_pnl_pct_today = (comp_pnl_today / comp_start_of_day_value * 100.0) if comp_start_of_day_value > 0 else 0.0
-
-        competition_accounts.append({
-            'account_id': m.id,
-            'competition_member_id': m.id,
-            'competitionMemberId': m.id,
-            'user_id': user.id,
-            'userId': user.id,
-            'competition_id': comp.id,
-            'code': comp.code,
-            'competition_code': comp.code,
-            'name': comp.name,
-            'competition_name': comp.name,
-            'account_type': 'competition',
-            'team_name': None,
-            'account_display_name': _account_display_name('competition', competition_name=comp.name, competition_code=comp.code),
-            'cash_balance': m.cash_balance,
-            'portfolio': comp_portfolio,
-            'total_value': comp_total_value,
-            'pnl': comp_total_pnl,
-            'return_pct': comp_return_pct,
-            'realized_pnl': m.realized_pnl or 0.0,
-            'start_of_day_value': comp_start_of_day_value,
-            'pnl_today': comp_pnl_today,
-            'pnl_pct_today': comp_pnl_pct_today
-            ,
-            'is_instructor_for_competition': _is_competition_instructor(user, comp)
-        })
+def _user_payload_version(portfolio_version, payload):
+    """Token for a valued payload: ``<portfolio_version>-<digest of its account values>``."""
+    digest = hashlib.sha1(
+        json.dumps(payload['accounts'], sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"{portfolio_version}-{digest}"
 
-    # --- Team Competitions ---
-    team_competitions = []
-    team_memberships = TeamMember.query.filter_by(user_id=user.id).all()
-    for tm in team_memberships:
-        ct_entries = CompetitionTeam.query.filter_by(team_id=tm.team_id).all()
-        for ct in ct_entries:
-            comp = db.session.get(Competition, ct.competition_id)
-            if not comp:
-                continue
 
-            ct_holdings = CompetitionTeamHolding.query.filter_by(competition_team_id=ct.id).all()
-            team_portfolio = []
-            team_total_holdings_value = 0
-            team_unrealized_pnl = 0
-            team_holdings_prev_close_value = 0
+def _changed_fields(before, after, skip=()):
+    return {field: value for field, value in after.items() if field not in skip and before.get(field) != value}
 
-            for cht in ct_holdings:
-                try:
-                    price, prev_close = get_current_and_prev_close(cht.symbol)
-                except Exception:
-                    price, prev_close = 0, 0
-                value = price * cht.quantity
-                pnl = (price - cht.buy_price) * cht.quantity
-                team_unrealized_pnl += pnl
-                team_total_holdings_value += value
-                team_holdings_prev_close_value += prev_close * cht.quantity
-                team_portfolio.append({
-                    'symbol': cht.symbol,
-                    'quantity': cht.quantity,
-                    'current_price': price,
-                    'total_value': value,
-                    'buy_price': cht.buy_price
-                })
 
-            team_total_pnl = (ct.realized_pnl or 0.0) + team_unrealized_pnl
-            team_total_value = ct.cash_balance + team_total_holdings_value
-            team_return_pct = ((team_total_value - 100000.0) / 100000.0) * 100.0
-            team_start_of_day_value = ct.cash_balance + team_holdings_prev_close_value
-            team_pnl_today = team_total_value - team_start_of_day_value
-            team_pnl_pct_today = (team_pnl_today / team_start_of_day_value * 100.0) if team_start_of_day_value > 0 else 0.0
+def _user_accounts_delta(previous, current):
+    """Changed fields per account and portfolio row, keyed by account id/type and symbol."""
+    previous_by_key = {(a['account_type'], a['account_id']): a for a in previous}
+    changes = []
+    for account in current:
+        before = previous_by_key.get((account['account_type'], account['account_id']))
+        if before is None:
+            changes.append(account)
+            continue
+        change = _changed_fields(before, account, skip=('portfolio',))
+        rows_before = {row['symbol']: row for row in before['portfolio']}
+        rows = []
+        for row in account['portfolio']:
+            row_before = rows_before.get(row['symbol'])
+            if row_before is None:
+                rows.append(row)
+            elif row_before != row:
+                rows.append({'symbol': row['symbol'], **_changed_fields(row_before, row)})
+        removed = sorted(set(rows_before) - {row['symbol'] for row in account['portfolio']})
+        if rows:
+            change['portfolio'] = rows
+        if removed:
+            change['removed_symbols'] = removed
+        if change:
+            changes.append({'account_type': account['account_type'], 'account_id': account['account_id'], **change})
+    return changes
+
+
+def user_payload_cache_stats():
+    with _user_payload_rebuild_lock:
+        rebuilds = sorted(_user_payload_rebuild_ms)
+    return {
+        **user_payload_cache.stats(),
+        "rebuild_ms": {
+            "window": len(rebuilds),
+            "avg": _round_metric(sum(rebuilds) / len(rebuilds), 2) if rebuilds else None,
+            "p95": _round_metric(_percentile(rebuilds, 95), 2),
+            "max": _round_metric(rebuilds[-1], 2) if rebuilds else None,
+        },
+    }
 
-            team = db.session.get(Team, ct.team_id)
-            if not team:
-                # Skip orphaned records so legacy data cannot break account loading.
-                continue
-            team_name = team.name
-
-            team_competitions.append({
-                'account_id': ct.id,
-                'competition_id': comp.id,
-                'code': comp.code,
-                'competition_code': comp.code,
-                'name': comp.name,
-                'competition_name': comp.name,
-                'account_type': 'team_competition',
-                'account_display_name': _account_display_name('team_competition', competition_name=comp.name, competition_code=comp.code, team_name=team_name),
-                'cash_balance': ct.cash_balance,
-                'portfolio': team_portfolio,
-                'total_value': team_total_value,
-                'team_id': ct.team_id,
-                'team_name': team_name,
-                'pnl': team_total_pnl,
-                'return_pct': team_return_pct,
-                'realized_pnl': ct.realized_pnl or 0.0,
-                'start_of_day_value': team_start_of_day_value,
-                'pnl_today': team_pnl_today,
-                'pnl_pct_today': team_pnl_pct_today,
-                'is_instructor_for_competition': _is_competition_instructor(user, comp),
-                # Unified payload for rendering team+competition in one UI container.
-                'team_competition': {
-                    'team': {'id': ct.team_id, 'name': team_name},
-                    'competition': {'code': comp.code, 'name': comp.name}
-                }
-            })
 
-    # --- Final Response ---
-    global_account = {
-        'account_id': f'global:{user.id}',
-        'account_type': 'global',
-        'competition_code': None,
-        'competition_name': None,
-        'team_name': None,
-        'account_display_name': _account_display_name('global'),
-        'cash_balance': user.cash_balance,
-        'portfolio': global_portfolio,
-        'total_value': global_total_value,
-        'pnl': global_total_pnl,
-        'realized_pnl': user.realized_pnl,
-        'return_pct': global_return_pct,
-        'start_of_day_value': global_start_of_day_value,
-        'pnl_today': global_pnl_today,
-        'pnl_pct_today': global_pnl_pct_today
-    }
+@app.route('/user', methods=['GET'])
+def get_user():
+    username = request.args.get('username')
+    if not username:
+        return jsonify({'message': 'Username is required'}), 400
 
-    all_accounts = [global_account, *competition_accounts, *team_competitions]
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
 
-    response_data = {
-        'username': user.username,
-        'is_admin': user.is_admin,
-        'global_account': global_account,
-        'accounts': all_accounts,
-        'competition_accounts': competition_accounts,
-        'team_competitions': team_competitions
-    }
+    portfolio_version = user.portfolio_version or 0
+    trading_date = _trading_date()
+    structure = user_payload_cache.get_or_fetch(
+        (user.id, portfolio_version, trading_date),
+        lambda: _timed_user_payload_build(user, trading_date),
+    )
+    response_data = _value_user_payload(structure)
+
+    version = _user_payload_version(portfolio_version, response_data)
+    since = request.args.get('since')
+    if since == version:
+        return '', 304, {'ETag': f'"{version}"'}
+    user_payload_snapshots.put((user.id, version), response_data['accounts'])
+    previous = user_payload_snapshots.peek((user.id, since)) if since else None
+    if previous is not None and since.split('-', 1)[0] == str(portfolio_version):
+        return jsonify({
+            'version': version,
+            'since': since,
+            'delta': True,
+            'accounts': _user_accounts_delta(previous, response_data['accounts']),
+            'degraded': response_data['degraded'],
+        }), 200, {'ETag': f'"{version}"'}
 
-    return jsonify(response_data)
+    return jsonify({**response_data, 'version': version, 'delta': False}), 200, {'ETag': f'"{version}"'}
 
 
 # --------------------
@@ -4602,22 +6769,25 @@ def get_account_performance_history():
 def get_stock(symbol):
     try:
         app.logger.info(f"Fetching current price for {symbol}")
-        url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&entitlement=realtime&apikey={ALPHA_VANTAGE_API_KEY}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise Exception(f"Alpha Vantage API error: {response.status_code}")
-        data = response.json()
-        if "Global Quote" not in data or not data["Global Quote"]:
-            raise Exception(f"No data found for symbol {symbol}")
-        global_quote = data["Global Quote"]
-        if "05. price" not in global_quote:
-            raise Exception(f"No price information available for symbol {symbol}")
-        price = float(global_quote["05. price"])
+        price = get_current_price(symbol)
         return jsonify({'symbol': symbol, 'price': price})
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         app.logger.error(f"Error fetching data for {symbol}: {e}")
         return jsonify({'error': f'Failed to fetch data for symbol {symbol}: {str(e)}'}), 400
 
+@app.route('/symbols/search', methods=['GET'])
+def search_symbols():
+    query = (request.args.get('q') or '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), SYMBOL_SEARCH_MAX_LIMIT))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'limit must be numeric'}), 400
+    if not symbol_index.enabled:
+        return jsonify({'message': 'Symbol index is not loaded'}), 503
+    return jsonify(symbol_index.search(query, limit=limit))
+
 @app.route('/stock_chart/<symbol>', methods=['GET'])
 def stock_chart(symbol):
     """
@@ -4630,6 +6800,8 @@ def stock_chart(symbol):
         overview = build_stock_overview(symbol, range_param)
         chart_data = [{"date": p["timestamp"], "close": p["price"]} for p in overview["chart_points"]]
         return jsonify(chart_data)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         app.logger.error(f"Error fetching chart data for {symbol}: {e}")
         return jsonify({"error": f"Failed to fetch chart data for {symbol}: {str(e)}"}), 400
@@ -4643,6 +6815,8 @@ def stock_overview(symbol):
         return jsonify(overview)
     except ValueError:
         return jsonify({"error": "range must be one of 1D,1W,1M,6M,1Y"}), 400
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         app.logger.error("Error generating stock overview for %s: %s", symbol, e)
         return jsonify({"error": f"Failed to fetch overview for symbol {symbol}: {str(e)}"}), 400
@@ -4659,6 +6833,8 @@ def buy_stock():
     quantity = int(data.get('quantity'))
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
     
@@ -4677,6 +6853,7 @@ def buy_stock():
         new_hold = Holding(user_id=user.id, symbol=symbol, quantity=quantity, buy_price=price)
         db.session.add(new_hold)
     _record_trade_blotter_entry(user.id, symbol, 'buy', quantity, price, order_type='market', account_context='global')
+    sync_account_state("global", user, symbol)
     db.session.commit()
     return jsonify({'message': 'Buy successful', 'cash_balance': user.cash_balance})
 
@@ -4688,6 +6865,8 @@ def sell_stock():
     quantity = int(data.get('quantity'))
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
     proceeds = quantity * price
@@ -4708,6 +6887,7 @@ def sell_stock():
         db.session.delete(holding)
     user.cash_balance += proceeds
     _record_trade_blotter_entry(user.id, symbol, 'sell', quantity, price, order_type='market', account_context='global')
+    sync_account_state("global", user, symbol)
     db.session.commit()
     return jsonify({'message': 'Sell successful', 'cash_balance': user.cash_balance})
 
@@ -4723,6 +6903,9 @@ def reset_global():
 
     # Delete all holdings
     Holding.query.filter_by(user_id=user.id).delete()
+    invalidate_account_states("global", [user.id])
+    clear_daily_baselines("global", [user.id])
+    bump_portfolio_versions([user.id])
 
     # Reset balance
     user.cash_balance = 100000
@@ -4813,7 +6996,9 @@ def join_competition():
     # Create new competition member
     new_member = CompetitionMember(user_id=user.id, competition_id=comp.id, cash_balance=100000)
     db.session.add(new_member)
+    bump_portfolio_versions([user.id])
     db.session.commit()
+    drop_competition_leaderboards(comp.id)
 
     return jsonify({"message": f"Successfully joined {comp.name}!"}), 200
 
@@ -6160,6 +8345,8 @@ def competition_buy():
     # ---------- Get current price ----------
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
     # --- Record realized profit or loss ---
@@ -6176,8 +8363,7 @@ def competition_buy():
     except Exception:
         limit_pct = 1.0  # default to 100% if malformed
 
-    holdings = CompetitionHolding.query.filter_by(competition_member_id=member.id).all()
-    total_value = sum((get_current_price(h.symbol) * h.quantity) for h in holdings) + member.cash_balance
+    total_value = account_total_value("competition", member)
 
     existing = CompetitionHolding.query.filter_by(
         competition_member_id=member.id, symbol=symbol
@@ -6218,7 +8404,9 @@ def competition_buy():
         order_type='market',
         account_context=f'competition:{comp.code}',
     )
+    sync_account_state("competition", member, symbol)
     db.session.commit()
+    refresh_leaderboard_entry("competition", comp.id, member)
     grade_summary = _compute_grade_summary(comp.id, user.id)
     return jsonify({
         'message': 'Competition buy successful',
@@ -6275,6 +8463,8 @@ def competition_sell():
     # 6. Fetch current price
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
 
@@ -6298,7 +8488,9 @@ def competition_sell():
         order_type='market',
         account_context=f'competition:{comp.code}',
     )
+    sync_account_state("competition", member, symbol)
     db.session.commit()
+    refresh_leaderboard_entry("competition", comp.id, member)
     grade_summary = _compute_grade_summary(comp.id, user.id)
 
     return jsonify({
@@ -6350,6 +8542,7 @@ def join_team():
     
     team_member = TeamMember(team_id=team.id, user_id=user.id)
     db.session.add(team_member)
+    bump_portfolio_versions([user.id])
     db.session.commit()
     return jsonify({'message': 'Joined team successfully'})
 
@@ -6374,6 +8567,8 @@ def team_buy():
     
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
     
@@ -6413,6 +8608,8 @@ def team_sell():
     
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
     
@@ -6474,7 +8671,9 @@ def competition_team_join():
         return jsonify({'message': 'Team already joined this competition'}), 200
     comp_team = CompetitionTeam(competition_id=comp.id, team_id=team.id, cash_balance=100000)
     db.session.add(comp_team)
+    bump_portfolio_versions(db.session.query(TeamMember.user_id).filter(TeamMember.team_id == team.id))
     db.session.commit()
+    drop_competition_leaderboards(comp.id)
     return jsonify({'message': 'Team successfully joined competition'})
 
 @app.route('/competition/team/buy', methods=['POST'])
@@ -6523,6 +8722,8 @@ def competition_team_buy():
     # 6. Fetch current price
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
 
@@ -6539,8 +8740,7 @@ def competition_team_buy():
         limit_pct = 1.0  # default to 100%
 
     # Calculate total team portfolio value
-    holdings = CompetitionTeamHolding.query.filter_by(competition_team_id=comp_team.id).all()
-    total_value = sum((get_current_price(h.symbol) * h.quantity) for h in holdings) + comp_team.cash_balance
+    total_value = account_total_value("team_competition", comp_team)
 
     # Determine current position size for this stock
     existing = CompetitionTeamHolding.query.filter_by(
@@ -6587,7 +8787,9 @@ def competition_team_buy():
         order_type='market',
         account_context=f'competition_team:{competition_code}:{team_id}',
     )
+    sync_account_state("team_competition", comp_team, symbol)
     db.session.commit()
+    refresh_leaderboard_entry("team_competition", comp.id, comp_team)
     return jsonify({
         'message': 'Competition team buy successful',
         'competition_team_cash': comp_team.cash_balance
@@ -6650,6 +8852,8 @@ def competition_team_sell():
     # 7. Fetch current price
     try:
         price = get_current_price(symbol)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error fetching price for symbol {symbol}: {str(e)}'}), 400
 
@@ -6673,7 +8877,9 @@ def competition_team_sell():
         order_type='market',
         account_context=f'competition_team:{competition_code}:{team_id}',
     )
+    sync_account_state("team_competition", comp_team, symbol)
     db.session.commit()
+    refresh_leaderboard_entry("team_competition", comp.id, comp_team)
     return jsonify({
         'message': 'Competition team sell successful',
         'competition_team_cash': comp_team.cash_balance
@@ -6701,6 +8907,21 @@ def admin_stats():
     total_competitions = Competition.query.count()
     return jsonify({'total_users': total_users, 'total_competitions': total_competitions})
 
+
+@app.route('/admin/market_data_stats', methods=['GET'])
+def admin_market_data_stats():
+    return jsonify({
+        'quote_cache': quote_cache.stats(),
+        'stock_range_cache': stock_range_cache.stats(),
+        'provider_client': market_data_provider.stats(),
+        'circuit_breaker': market_data_circuit_breaker.stats(),
+        'symbol_index': {'enabled': symbol_index.enabled, 'symbols': len(symbol_index.listings)},
+        'unknown_symbol_cache': unknown_symbol_cache.stats(),
+        'provider_rate_limiter': market_data_rate_limiter.stats() if market_data_rate_limiter else None,
+        'hot_symbol_refresher': dict(hot_symbol_refresh_stats),
+        'user_payload_cache': user_payload_cache_stats(),
+    })
+
 @app.route('/admin/delete_competition', methods=['POST'])
 def admin_delete_competition():
     data = request.get_json()
@@ -6719,6 +8940,19 @@ def admin_delete_competition():
         _delete_curriculum_for_competition(comp.id)
 
         # --- Remove all related members & holdings ---
+        bump_portfolio_versions(db.session.query(CompetitionMember.user_id).filter_by(competition_id=comp.id))
+        bump_portfolio_versions(
+            db.session.query(TeamMember.user_id)
+            .join(CompetitionTeam, CompetitionTeam.team_id == TeamMember.team_id)
+            .filter(CompetitionTeam.competition_id == comp.id)
+        )
+        invalidate_account_states(
+            "competition", db.session.query(CompetitionMember.id).filter_by(competition_id=comp.id)
+        )
+        invalidate_account_states(
+            "team_competition", db.session.query(CompetitionTeam.id).filter_by(competition_id=comp.id)
+        )
+        CompetitionResult.query.filter_by(competition_id=comp.id).delete(synchronize_session=False)
         CompetitionHolding.query.filter(
             CompetitionHolding.competition_member_id.in_(
                 db.session.query(CompetitionMember.id).filter_by(competition_id=comp.id)
@@ -6745,6 +8979,7 @@ def admin_delete_competition():
         # --- Delete the competition itself ---
         db.session.delete(comp)
         db.session.commit()
+        drop_competition_leaderboards(comp.id)
 
         return jsonify({'message': f'Competition {code} deleted successfully.'}), 200
 
@@ -6772,11 +9007,37 @@ def admin_delete_user():
     try:
         # --- Delete all holdings ---
         Holding.query.filter_by(user_id=target_user.id).delete(synchronize_session=False)
+        invalidate_account_states("global", [target_user.id])
+        invalidate_account_states(
+            "competition", db.session.query(CompetitionMember.id).filter_by(user_id=target_user.id)
+        )
+        remove_final_standings(
+            "competition", db.session.query(CompetitionMember.id).filter_by(user_id=target_user.id)
+        )
 
         # --- Delete competitions created by this user ---
         comps = Competition.query.filter_by(created_by=target_user.id).all()
+        affected_competition_ids = {comp.id for comp in comps} | {
+            competition_id
+            for (competition_id,) in db.session.query(CompetitionMember.competition_id)
+            .filter_by(user_id=target_user.id)
+            .all()
+        }
         for comp in comps:
             # delete related competition members and holdings
+            bump_portfolio_versions(db.session.query(CompetitionMember.user_id).filter_by(competition_id=comp.id))
+            bump_portfolio_versions(
+                db.session.query(TeamMember.user_id)
+                .join(CompetitionTeam, CompetitionTeam.team_id == TeamMember.team_id)
+                .filter(CompetitionTeam.competition_id == comp.id)
+            )
+            invalidate_account_states(
+                "competition", db.session.query(CompetitionMember.id).filter_by(competition_id=comp.id)
+            )
+            invalidate_account_states(
+                "team_competition", db.session.query(CompetitionTeam.id).filter_by(competition_id=comp.id)
+            )
+            CompetitionResult.query.filter_by(competition_id=comp.id).delete(synchronize_session=False)
             CompetitionHolding.query.filter(
                 CompetitionHolding.competition_member_id.in_(
                     db.session.query(CompetitionMember.id).filter_by(competition_id=comp.id)
@@ -6795,12 +9056,19 @@ def admin_delete_user():
         CompetitionMember.query.filter_by(user_id=target_user.id).delete(synchronize_session=False)
 
         # --- Delete team memberships and teams created by user ---
+        bump_portfolio_versions(
+            db.session.query(TeamMember.user_id).filter(
+                TeamMember.team_id.in_(db.session.query(Team.id).filter_by(created_by=target_user.id))
+            )
+        )
         TeamMember.query.filter_by(user_id=target_user.id).delete(synchronize_session=False)
         Team.query.filter_by(created_by=target_user.id).delete(synchronize_session=False)
 
         # --- Finally delete the user ---
         db.session.delete(target_user)
         db.session.commit()
+        for competition_id in affected_competition_ids:
+            drop_competition_leaderboards(competition_id)
 
         return jsonify({'message': f'User {target_username} deleted successfully.'}), 200
 
@@ -6883,7 +9151,12 @@ def update_competition_dates():
 
     comp.start_date = new_start
     comp.end_date = new_end
+    if comp.finalized_at is not None and not _competition_ended(comp):
+        # Reopened: the stored standings no longer describe the close.
+        CompetitionResult.query.filter_by(competition_id=comp.id).delete(synchronize_session=False)
+        comp.finalized_at = None
     db.session.commit()
+    drop_competition_leaderboards(comp.id)
 
     return jsonify({
         'message': f'Competition {comp.code} dates updated successfully.',
@@ -6932,10 +9205,14 @@ def admin_remove_user_from_competition():
 
     # ✅ Delete related holdings FIRST (avoid FK constraint violation)
     CompetitionHolding.query.filter_by(competition_member_id=membership.id).delete()
+    invalidate_account_states("competition", [membership.id])
+    remove_final_standings("competition", [membership.id])
+    bump_portfolio_versions([target_user.id])
 
     # ✅ Then delete the membership itself
     db.session.delete(membership)
     db.session.commit()
+    drop_competition_leaderboards(comp.id)
 
     return jsonify({'message': f'{target_username} has been removed from competition {competition_code}.'}), 200
 
@@ -6960,6 +9237,7 @@ def remove_user_from_team():
         return jsonify({'message': 'User is not a member of this team'}), 404
 
     db.session.delete(membership)
+    bump_portfolio_versions([target_user.id])
     db.session.commit()
     return jsonify({'message': f'{target_username} has been removed from team {team_id}.'})
 
@@ -7076,7 +9354,7 @@ def schedule_quick_pics_for_today():
             db.session.commit()
             app.logger.info(f"Created Quick Pics competition {code} from {start_pst} - {end_pst}")
 def reset_daily_pnl_at_open():
-    """Run once per day at 6:35 AM PST – captures portfolio value at market open."""
+    """Run once per day at 6:35 AM PST – captures previous closes and start-of-day baselines."""
     with app.app_context():
         pst = pytz.timezone('America/Los_Angeles')
         now_pst = datetime.now(pst)
@@ -7085,43 +9363,7 @@ def reset_daily_pnl_at_open():
         if now_pst.weekday() >= 5 or now_pst.hour != 6 or now_pst.minute < 35:
             return
 
-        # ----- GLOBAL ACCOUNTS -----
-        for user in User.query.all():
-            value = user.cash_balance
-            for h in Holding.query.filter_by(user_id=user.id).all():
-                try:
-                    price = get_current_price(h.symbol)
-                except Exception:
-                    price = h.buy_price
-                value += price * h.quantity
-            user.start_of_day_value = value
-            db.session.add(user)
-
-        # ----- COMPETITION INDIVIDUAL -----
-        for member in CompetitionMember.query.all():
-            value = member.cash_balance
-            for h in CompetitionHolding.query.filter_by(competition_member_id=member.id).all():
-                try:
-                    price = get_current_price(h.symbol)
-                except Exception:
-                    price = h.buy_price
-                value += price * h.quantity
-            member.start_of_day_value = value
-            db.session.add(member)
-
-        # ----- COMPETITION TEAM -----
-        for ct in CompetitionTeam.query.all():
-            value = ct.cash_balance
-            for h in CompetitionTeamHolding.query.filter_by(competition_team_id=ct.id).all():
-                try:
-                    price = get_current_price(h.symbol)
-                except Exception:
-                    price = h.buy_price
-                value += price * h.quantity
-            ct.start_of_day_value = value
-            db.session.add(ct)
-
-        db.session.commit()
+        capture_daily_baselines()
         app.logger.info("Daily P&L reset at market open (6:35 AM PST)")
         
 @app.route('/quick_pics', methods=['GET'])
@@ -7146,79 +9388,457 @@ def quick_pics():
 # --------------------
 # Unified Competition Leaderboard (Individuals and Teams)
 # --------------------
-@app.route('/competition/<code>/leaderboard', methods=['GET'])
-def competition_leaderboard(code):
-    comp = Competition.query.filter_by(code=code).first()
-    if not comp:
-        return jsonify({'message': 'Competition not found'}), 404
+# Boards live per worker. Trades in this worker update their entry; changes made by other
+# workers are picked up when the board is rebuilt after LEADERBOARD_REBUILD_SECONDS.
+LEADERBOARD_REBUILD_SECONDS = float(os.getenv("LEADERBOARD_REBUILD_SECONDS", "60"))
 
-    leaderboard = []
-    members = CompetitionMember.query.filter_by(competition_id=comp.id).all()
 
-    for m in members:
-        total_holdings = 0.0
-        unrealized = 0.0
+class SortedLeaderboard:
+    """Accounts of one competition kept ordered by total value.
 
-        choldings = CompetitionHolding.query.filter_by(competition_member_id=m.id).all()
-        for h in choldings:
-            try:
-                price = get_current_price(h.symbol)
-            except Exception:
-                price = 0
-            total_holdings += price * h.quantity
-            unrealized += (price - h.buy_price) * h.quantity
-
-        total = m.cash_balance + total_holdings
-        total_pnl = (m.realized_pnl or 0.0) + unrealized
-        return_pct = ((total - 100000.0) / 100000.0) * 100.0
-
-        user = db.session.get(User, m.user_id)
-        leaderboard.append({
-            'name': user.username,
+    Entries are re-valued only when something they hold changes: ``upsert`` after a trade,
+    ``remark`` for the holders of symbols whose price moved. Reading a page is O(page size) and
+    ``rank_of`` finds a participant by their lookup key (username or team id) in O(log n).
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.built_at = clock()
+        self._order = []  # sorted (-total_value, account_id)
+        self._entries = {}
+        self._keys = {}  # lookup key -> account_id
+        self._holders = {}
+        self._marks = {}
+        self._stale = set()
+        self._lock = threading.Lock()
+
+    def symbols(self):
+        with self._lock:
+            return list(self._holders)
+
+    def age(self):
+        return self._clock() - self.built_at
+
+    def upsert(self, account_id, key, name, cash, realized_pnl, holdings):
+        with self._lock:
+            self._detach(account_id)
+            self._attach(account_id, key, name, cash, realized_pnl, holdings)
+            self._revalue([account_id])
+
+    def upsert_many(self, accounts, quotes):
+        """Load ``(account_id, key, name, cash, realized_pnl, holdings)`` rows and mark them in one pass."""
+        with self._lock:
+            self._marks = {symbol: quote[0] for symbol, quote in quotes.items()}
+            self._stale = set(stale_quote_symbols(quotes))
+            for account in accounts:
+                self._attach(*account)
+            self._revalue(list(self._entries))
+
+    def remove(self, account_id):
+        with self._lock:
+            self._detach(account_id)
+
+    def remark(self, quotes):
+        """Apply new prices; only holders of symbols whose price changed are re-valued."""
+        with self._lock:
+            self._stale = set(stale_quote_symbols(quotes))
+            changed = [
+                symbol for symbol in self._holders
+                if (quotes[symbol][0] if symbol in quotes else None) != self._marks.get(symbol)
+            ]
+            for symbol in changed:
+                if symbol in quotes:
+                    self._marks[symbol] = quotes[symbol][0]
+                else:
+                    self._marks.pop(symbol, None)
+            affected = set().union(*(self._holders[symbol] for symbol in changed)) if changed else set()
+            self._revalue(affected)
+            return len(affected)
+
+    def top(self, limit=None, offset=0):
+        with self._lock:
+            stop = len(self._order) if limit is None else min(len(self._order), offset + limit)
+            return [self._row(index) for index in range(offset, stop)]
+
+    def rank_of(self, key, neighbours=2):
+        """``{rank, percentile, entry, above, below}`` for one participant, or ``None`` if absent."""
+        with self._lock:
+            account_id = self._keys.get(key)
+            if account_id is None:
+                return None
+            total = self._entries[account_id]["total_value"]
+            index = bisect.bisect_left(self._order, (-total, account_id))
+            return _rank_payload(self._row, index, len(self._order), neighbours)
+
+    def standings(self):
+        """``(account_id, key, row)`` for every entry, in rank order."""
+        with self._lock:
+            return [
+                (account_id, self._entries[account_id]["key"], self._row(index))
+                for index, (_, account_id) in enumerate(self._order)
+            ]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _row(self, index):
+        entry = self._entries[self._order[index][1]]
+        total = entry["total_value"]
+        return {
+            'rank': index + 1,
+            'name': entry["name"],
             'total_value': total,
-            'pnl': total_pnl,
-            'return_pct': return_pct
-        })
+            'pnl': entry["realized_pnl"] + entry["unrealized_pnl"],
+            'return_pct': ((total - 100000.0) / 100000.0) * 100.0,
+            'prices_stale': any(h.symbol in self._stale for h in entry["holdings"]),
+        }
 
-    leaderboard_sorted = sorted(leaderboard, key=lambda x: x['total_value'], reverse=True)
-    return jsonify(leaderboard_sorted)
+    def _attach(self, account_id, key, name, cash, realized_pnl, holdings):
+        self._entries[account_id] = {
+            "key": key, "name": name, "cash": cash or 0.0, "realized_pnl": realized_pnl or 0.0,
+            "holdings": list(holdings), "total_value": 0.0, "unrealized_pnl": 0.0,
+        }
+        self._keys[key] = account_id
+        for h in holdings:
+            self._holders.setdefault(h.symbol, set()).add(account_id)
 
-@app.route('/competition/<code>/team_leaderboard', methods=['GET'])
-def competition_team_leaderboard(code):
+    def _detach(self, account_id):
+        entry = self._entries.pop(account_id, None)
+        if entry is None:
+            return
+        self._remove_order(entry["total_value"], account_id)
+        if self._keys.get(entry["key"]) == account_id:
+            del self._keys[entry["key"]]
+        for h in entry["holdings"]:
+            holders = self._holders.get(h.symbol)
+            if holders is not None:
+                holders.discard(account_id)
+                if not holders:
+                    del self._holders[h.symbol]
+
+    def _remove_order(self, total_value, account_id):
+        index = bisect.bisect_left(self._order, (-total_value, account_id))
+        if index < len(self._order) and self._order[index] == (-total_value, account_id):
+            del self._order[index]
+
+    def _revalue(self, account_ids):
+        if not account_ids:
+            return
+        frame = HoldingsFrame()
+        for account_id in account_ids:
+            frame.add(account_id, self._entries[account_id]["holdings"])
+        quotes = {symbol: (price, price) for symbol, price in self._marks.items()}
+        valuation = value_portfolios(
+            frame, quotes, cash={account_id: self._entries[account_id]["cash"] for account_id in account_ids}
+        )
+        for account_id in account_ids:
+            entry = self._entries[account_id]
+            if entry.get("ranked"):
+                self._remove_order(entry["total_value"], account_id)
+            values = valuation.account(account_id)
+            entry["total_value"] = values["total_value"]
+            entry["unrealized_pnl"] = values["unrealized_pnl"]
+            entry["ranked"] = True
+            bisect.insort(self._order, (-entry["total_value"], account_id))
+
+
+def _rank_payload(row_at, index, count, neighbours):
+    return {
+        'rank': index + 1,
+        'participants': count,
+        'percentile': round(100.0 * (count - index) / count, 2),
+        'entry': row_at(index),
+        'above': [row_at(i) for i in range(max(0, index - neighbours), index)],
+        'below': [row_at(i) for i in range(index + 1, min(count, index + 1 + neighbours))],
+    }
+
+
+class FinalStandings:
+    """Read-only board for an ended competition, loaded from ``competition_result`` rows."""
+
+    def __init__(self, results, finalized_at):
+        self.finalized_at = finalized_at
+        self._rows = [
+            {
+                'rank': result.rank,
+                'name': result.name,
+                'total_value': result.total_value,
+                'pnl': result.pnl,
+                'return_pct': result.return_pct,
+                'prices_stale': bool(result.prices_stale),
+            }
+            for result in results
+        ]
+        self._index = {result.lookup_key: index for index, result in enumerate(results)}
+
+    def top(self, limit=None, offset=0):
+        return self._rows[offset:] if limit is None else self._rows[offset:offset + limit]
+
+    def rank_of(self, key, neighbours=2):
+        index = self._index.get(key)
+        if index is None:
+            return None
+        return _rank_payload(self._rows.__getitem__, index, len(self._rows), neighbours)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+competition_leaderboards = {}
+_competition_leaderboards_lock = threading.Lock()
+
+
+def _leaderboard_key(kind, account):
+    """Lookup key for ``?rank_of=``: the username for members, the team id for teams."""
+    if kind == "competition":
+        return db.session.get(User, account.user_id).username
+    return str(account.team_id)
+
+
+def _leaderboard_positions(kind, competition_id):
+    """``{account_id: [AccountPosition]}`` for a whole competition from one grouped holdings query."""
+    account_model, holding_model, account_column = ACCOUNT_STATE_SOURCES[kind]
+    account_id = getattr(holding_model, account_column)
+    quantity = func.sum(holding_model.quantity)
+    cost = func.sum(holding_model.quantity * holding_model.buy_price)
+    rows = (
+        db.session.query(account_id, holding_model.symbol, quantity, cost)
+        .join(account_model, account_model.id == account_id)
+        .filter(account_model.competition_id == competition_id)
+        .group_by(account_id, holding_model.symbol)
+        .order_by(account_id, func.min(holding_model.id))
+        .all()
+    )
+    positions = {}
+    for owner_id, symbol, total_quantity, total_cost in rows:
+        buy_price = (total_cost or 0.0) / total_quantity if total_quantity else 0.0
+        positions.setdefault(owner_id, []).append(AccountPosition(symbol, total_quantity, buy_price))
+    return positions
+
+
+def _leaderboard_accounts(kind, competition_id):
+    """``(account_id, key, name, cash, realized_pnl, holdings)`` for every account on a board.
+
+    Two queries whatever the competition size: accounts joined to their names, and holdings
+    grouped per (account, symbol).
+    """
+    if kind == "competition":
+        # Members are looked up by username, which is also their display name.
+        rows = [
+            (member, username, username)
+            for member, username in db.session.query(CompetitionMember, User.username)
+            .join(User, User.id == CompetitionMember.user_id)
+            .filter(CompetitionMember.competition_id == competition_id)
+            .order_by(CompetitionMember.id)
+            .all()
+        ]
+    else:
+        rows = [
+            (comp_team, comp_team.team_id, name)
+            for comp_team, name in db.session.query(CompetitionTeam, Team.name)
+            .join(Team, Team.id == CompetitionTeam.team_id)
+            .filter(CompetitionTeam.competition_id == competition_id)
+            .order_by(CompetitionTeam.id)
+            .all()
+        ]
+    positions = _leaderboard_positions(kind, competition_id)
+    return [
+        (account.id, str(key), name, account.cash_balance, account.realized_pnl, positions.get(account.id, []))
+        for account, key, name in rows
+    ]
+
+
+def get_competition_leaderboard(kind, comp):
+    """Return the board for ``kind`` (competition | team_competition).
+
+    Settled competitions are served from their stored final standings. Others, including ended
+    ones still waiting for the settlement job, are re-marked to current prices.
+    """
+    key = (kind, comp.id)
+    if comp.finalized_at is not None and _competition_ended(comp):
+        # Read per request rather than cached per worker, so removals show up everywhere.
+        results = (
+            CompetitionResult.query.filter_by(competition_id=comp.id, kind=kind)
+            .order_by(CompetitionResult.rank)
+            .all()
+        )
+        return FinalStandings(results, comp.finalized_at)
+    with _competition_leaderboards_lock:
+        board = competition_leaderboards.get(key)
+    if board is None or board.age() >= LEADERBOARD_REBUILD_SECONDS:
+        accounts = _leaderboard_accounts(kind, comp.id)
+        board = SortedLeaderboard()
+        board.upsert_many(accounts, get_quotes({h.symbol for *_, holdings in accounts for h in holdings}))
+        with _competition_leaderboards_lock:
+            competition_leaderboards[key] = board
+        return board
+    board.remark(get_quotes(board.symbols()))
+    return board
+
+
+def refresh_leaderboard_entry(kind, competition_id, account):
+    """Re-read one account into its competition's board after a committed trade."""
+    with _competition_leaderboards_lock:
+        board = competition_leaderboards.get((kind, competition_id))
+    if board is None:
+        return
+    try:
+        state = load_account_states({kind: [account]})[(kind, account.id)]
+        key = _leaderboard_key(kind, account)
+        name = key if kind == "competition" else db.session.get(Team, account.team_id).name
+        board.upsert(account.id, key, name, account.cash_balance, account.realized_pnl, state.holdings())
+    except Exception as exc:
+        # The trade is already committed; fall back to a rebuild on the next read.
+        drop_competition_leaderboards(competition_id)
+        app.logger.warning("leaderboard_refresh_failed kind=%s competition_id=%s error=%s", kind, competition_id, exc)
+
+
+def drop_competition_leaderboards(competition_id):
+    """Forget boards after membership changes so the next read rebuilds them."""
+    with _competition_leaderboards_lock:
+        competition_leaderboards.pop(("competition", competition_id), None)
+        competition_leaderboards.pop(("team_competition", competition_id), None)
+
+
+# Ended competitions are settled once: every position is priced in one batch and the ranked
+# standings are stored in competition_result, so their leaderboards stop following live prices.
+COMPETITION_FINALIZE_INTERVAL_SECONDS = int(os.getenv("COMPETITION_FINALIZE_INTERVAL_SECONDS", "300"))
+
+
+def _competition_ended(comp, now=None):
+    return comp.end_date is not None and (now or datetime.utcnow()) > comp.end_date
+
+
+def finalize_ended_competitions():
+    """Store final standings for ended, unsettled competitions. Returns how many were settled.
+
+    Standings are permanent, so a competition is only settled when every symbol held in it has
+    a fresh quote; otherwise it is left for the next run. Competitions are locked while they
+    settle (``SKIP LOCKED`` on Postgres), so workers running the job at the same time settle
+    each competition once.
+    """
+    try:
+        comps = Competition.query.filter(
+            Competition.end_date.isnot(None),
+            Competition.end_date < datetime.utcnow(),
+            Competition.finalized_at.is_(None),
+        ).with_for_update(skip_locked=True).all()
+        if not comps:
+            db.session.rollback()
+            return 0
+        boards = {
+            comp.id: [(kind, _leaderboard_accounts(kind, comp.id)) for kind in ("competition", "team_competition")]
+            for comp in comps
+        }
+        held = {
+            comp_id: {h.symbol for _, accounts in comp_boards for *_, holdings in accounts for h in holdings}
+            for comp_id, comp_boards in boards.items()
+        }
+        quotes = get_quotes(set().union(*held.values()))
+        stale = set(stale_quote_symbols(quotes))
+        now = datetime.utcnow()
+        settled = []
+        for comp in comps:
+            unpriced = sorted(symbol for symbol in held[comp.id] if symbol not in quotes or symbol in stale)
+            if unpriced:
+                app.logger.warning(
+                    "competition_finalize_deferred competition_id=%s unpriced=%s", comp.id, ",".join(unpriced)
+                )
+                continue
+            for kind, accounts in boards[comp.id]:
+                board = SortedLeaderboard()
+                board.upsert_many(accounts, quotes)
+                db.session.add_all([
+                    CompetitionResult(
+                        competition_id=comp.id,
+                        kind=kind,
+                        account_id=account_id,
+                        lookup_key=key,
+                        name=row['name'],
+                        rank=row['rank'],
+                        total_value=row['total_value'],
+                        pnl=row['pnl'],
+                        return_pct=row['return_pct'],
+                        prices_stale=row['prices_stale'],
+                    )
+                    for account_id, key, row in board.standings()
+                ])
+            comp.finalized_at = now
+            settled.append(comp)
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        app.logger.warning("competition_finalize_failed error=%s", exc)
+        return 0
+    for comp in settled:
+        drop_competition_leaderboards(comp.id)
+    app.logger.info(
+        "competitions_finalized count=%s deferred=%s symbols=%s",
+        len(settled), len(comps) - len(settled), len(quotes),
+    )
+    return len(settled)
+
+
+def run_competition_finalization_job():
+    with app.app_context():
+        return finalize_ended_competitions()
+
+
+def remove_final_standings(kind, account_ids):
+    """Drop settled rows for removed accounts and close the rank gaps they leave. Caller commits."""
+    results = CompetitionResult.query.filter(
+        CompetitionResult.kind == kind,
+        CompetitionResult.account_id.in_(account_ids),
+    ).all()
+    competition_ids = {result.competition_id for result in results}
+    for result in results:
+        db.session.delete(result)
+    db.session.flush()
+    for competition_id in competition_ids:
+        remaining = (
+            CompetitionResult.query.filter_by(competition_id=competition_id, kind=kind)
+            .order_by(CompetitionResult.rank)
+            .all()
+        )
+        for rank, result in enumerate(remaining, start=1):
+            result.rank = rank
+
+
+LEADERBOARD_MAX_NEIGHBOURS = 25
+
+
+def _leaderboard_response(kind, code):
+    """Serve one page of a board (``limit``/``offset``) or, with ``rank_of``, one participant."""
     comp = Competition.query.filter_by(code=code).first()
     if not comp:
         return jsonify({'message': 'Competition not found'}), 404
+    board = get_competition_leaderboard(kind, comp)
+
+    rank_of = (request.args.get('rank_of') or '').strip()
+    if rank_of:
+        neighbours = request.args.get('neighbours', 2, type=int)
+        neighbours = min(max(neighbours, 0), LEADERBOARD_MAX_NEIGHBOURS)
+        result = board.rank_of(rank_of, neighbours)
+        if result is None:
+            return jsonify({'message': 'Participant not found on this leaderboard'}), 404
+        return jsonify(result)
+
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    response = jsonify(board.top(limit if limit and limit > 0 else None, max(offset, 0)))
+    response.headers['X-Total-Count'] = str(len(board))
+    if isinstance(board, FinalStandings):
+        response.headers['X-Leaderboard-Finalized-At'] = board.finalized_at.isoformat() + "Z"
+    return response
 
-    leaderboard = []
-    comp_teams = CompetitionTeam.query.filter_by(competition_id=comp.id).all()
 
-    for ct in comp_teams:
-        total_holdings = 0.0
-        unrealized = 0.0
-
-        tholdings = CompetitionTeamHolding.query.filter_by(competition_team_id=ct.id).all()
-        for h in tholdings:
-            try:
-                price = get_current_price(h.symbol)
-            except Exception:
-                price = 0
-            total_holdings += price * h.quantity
-            unrealized += (price - h.buy_price) * h.quantity
-
-        total = ct.cash_balance + total_holdings
-        total_pnl = (ct.realized_pnl or 0.0) + unrealized
-        return_pct = ((total - 100000.0) / 100000.0) * 100.0
-
-        team = db.session.get(Team, ct.team_id)
-        leaderboard.append({
-            'name': team.name,
-            'total_value': total,
-            'pnl': total_pnl,
-            'return_pct': return_pct
-        })
+@app.route('/competition/<code>/leaderboard', methods=['GET'])
+def competition_leaderboard(code):
+    return _leaderboard_response("competition", code)
 
-    leaderboard_sorted = sorted(leaderboard, key=lambda x: x['total_value'], reverse=True)
-    return jsonify(leaderboard_sorted)
+@app.route('/competition/<code>/team_leaderboard', methods=['GET'])
+def competition_team_leaderboard(code):
+    return _leaderboard_response("team_competition", code)
 
 
 VALID_ORDER_STATUSES = {"open", "partially_filled", "filled", "cancelled", "expired", "rejected"}
@@ -7420,6 +10040,7 @@ def process_open_limit_orders():
                     order_type='limit',
                     account_context=order.account_context,
                 )
+                sync_account_state("global", user, order.symbol)
                 order.filled_qty = order.quantity
                 order.avg_fill_price = current_price
                 order.status = "filled"
@@ -7554,6 +10175,7 @@ def set_admin():
         return jsonify({'message': 'User not found'}), 404
 
     user.is_admin = True
+    bump_portfolio_versions([user.id])
     db.session.commit()
     return jsonify({'message': f"{username} is now an admin."})
 
@@ -7576,6 +10198,17 @@ scheduler.add_job(
     timezone="America/New_York"
 )
 scheduler.add_job(func=process_open_limit_orders, trigger="interval", seconds=30)
+scheduler.add_job(func=persist_last_known_prices, trigger="interval", seconds=LAST_KNOWN_PRICE_FLUSH_SECONDS)
+if HOT_SYMBOL_REFRESH_ENABLED:
+    scheduler.add_job(func=refresh_hot_symbols, trigger="interval", seconds=HOT_SYMBOL_REFRESH_INTERVAL_SECONDS)
+if ACCOUNT_STATE_BACKFILL_INTERVAL_SECONDS > 0:
+    scheduler.add_job(
+        func=run_account_state_backfill_job, trigger="interval", seconds=ACCOUNT_STATE_BACKFILL_INTERVAL_SECONDS
+    )
+if COMPETITION_FINALIZE_INTERVAL_SECONDS > 0:
+    scheduler.add_job(
+        func=run_competition_finalization_job, trigger="interval", seconds=COMPETITION_FINALIZE_INTERVAL_SECONDS
+    )
 scheduler.start()
 # --------------------------------
 # --------------------
@@ -0,0 +1,25 @@
+"""Download the Alpha Vantage symbol listing used for symbol validation and /symbols/search.
+
+Usage:
+  python scripts/refresh_symbol_listing.py
+  SYMBOL_LISTING_PATH=/srv/data/listing_status.csv python scripts/refresh_symbol_listing.py
+
+Running workers load the listing at boot, so restart them after a refresh.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("DATABASE_URL", os.getenv("DATABASE_URL", "sqlite:///local.db"))
+
+from app import SYMBOL_LISTING_PATH, refresh_symbol_listing  # noqa: E402
+
+
+if __name__ == "__main__":
+    symbols = refresh_symbol_listing(SYMBOL_LISTING_PATH)
+    print(f"symbol_listing_refreshed path={SYMBOL_LISTING_PATH} symbols={symbols}")
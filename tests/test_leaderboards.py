@@ -0,0 +1,380 @@
+import importlib
+import sys
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture()
+def app_client(tmp_path, monkeypatch):
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    db_path = tmp_path / "test.db"
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+    monkeypatch.setenv("APP_BASE_URL", "https://example.com")
+    if "msal" not in sys.modules:
+        sys.modules["msal"] = types.SimpleNamespace(ConfidentialClientApplication=object)
+    if "app" in sys.modules:
+        del sys.modules["app"]
+    app_module = importlib.import_module("app")
+    app_module.app.config["TESTING"] = True
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+    return app_module.app.test_client(), app_module
+
+
+def _holding(symbol, quantity, buy_price):
+    return types.SimpleNamespace(symbol=symbol, quantity=quantity, buy_price=buy_price)
+
+
+def _seed_competition(app_module, holdings_by_user, end_date=None):
+    with app_module.app.app_context():
+        creator = app_module.User(username="creator", email="creator@example.com")
+        creator.set_password("StrongPass!234")
+        app_module.db.session.add(creator)
+        app_module.db.session.flush()
+        comp = app_module.Competition(code="LB1", name="Leaderboard", created_by=creator.id, end_date=end_date)
+        app_module.db.session.add(comp)
+        app_module.db.session.flush()
+        for username, (cash, holdings) in holdings_by_user.items():
+            user = app_module.User(username=username, email=f"{username}@example.com")
+            user.set_password("StrongPass!234")
+            app_module.db.session.add(user)
+            app_module.db.session.flush()
+            member = app_module.CompetitionMember(competition_id=comp.id, user_id=user.id, cash_balance=cash)
+            app_module.db.session.add(member)
+            app_module.db.session.flush()
+            app_module.db.session.add_all([
+                app_module.CompetitionHolding(
+                    competition_member_id=member.id, symbol=symbol, quantity=quantity, buy_price=buy_price
+                )
+                for symbol, quantity, buy_price in holdings
+            ])
+        app_module.db.session.commit()
+
+
+def test_sorted_leaderboard_remark_revalues_only_holders_of_moved_symbols(app_client):
+    _, app_module = app_client
+    board = app_module.SortedLeaderboard()
+    board.upsert_many(
+        [
+            (1, "alice", "alice", 1000.0, 0.0, [_holding("AAPL", 10, 100.0)]),
+            (2, "bob", "bob", 1000.0, 0.0, [_holding("MSFT", 10, 100.0)]),
+            (3, "carol", "carol", 2500.0, 0.0, []),
+        ],
+        {"AAPL": (100.0, 100.0), "MSFT": (100.0, 100.0)},
+    )
+    assert [row["name"] for row in board.top()] == ["carol", "alice", "bob"]
+
+    assert board.remark({"AAPL": (100.0, 100.0), "MSFT": (200.0, 100.0)}) == 1
+    assert [row["name"] for row in board.top()] == ["bob", "carol", "alice"]
+    assert board.top(1)[0]["total_value"] == 3000.0
+
+    board.upsert(1, "alice", "alice", 0.0, 0.0, [_holding("AAPL", 40, 100.0)])
+    assert [row["name"] for row in board.top(2)] == ["alice", "bob"]
+
+    board.remove(2)
+    assert [row["name"] for row in board.top()] == ["alice", "carol"]
+    assert board.symbols() == ["AAPL"]
+
+
+def test_competition_leaderboard_is_ordered_and_honours_limit(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {
+        "alice": (1000.0, [("AAPL", 10, 100.0)]),
+        "bob": (5000.0, []),
+        "carol": (500.0, [("MSFT", 5, 100.0)]),
+    })
+    prices = {"AAPL": 150.0, "MSFT": 100.0}
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: (prices[s], prices[s]) for s in symbols})
+    )
+
+    response = client.get("/competition/LB1/leaderboard")
+    assert response.status_code == 200
+    assert [(row["name"], row["total_value"]) for row in response.get_json()] == [
+        ("bob", 5000.0), ("alice", 2500.0), ("carol", 1000.0),
+    ]
+    assert response.get_json()[1]["pnl"] == 500.0
+
+    prices["MSFT"] = 1000.0
+    top = client.get("/competition/LB1/leaderboard?limit=1").get_json()
+    assert top == [{
+        "rank": 1, "name": "carol", "total_value": 5500.0, "pnl": 4500.0,
+        "return_pct": ((5500.0 - 100000.0) / 100000.0) * 100.0, "prices_stale": False,
+    }]
+
+
+def test_competition_trade_updates_only_its_own_leaderboard_entry(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {
+        "alice": (1000.0, []),
+        "bob": (2000.0, [("MSFT", 1, 100.0)]),
+    })
+    monkeypatch.setattr(app_module, "get_current_price", lambda symbol: 100.0)
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: (100.0, 100.0) for s in symbols})
+    )
+    assert [row["name"] for row in client.get("/competition/LB1/leaderboard").get_json()] == ["bob", "alice"]
+
+    def fail_rebuild(*args):
+        raise AssertionError("board should not be rebuilt after a trade")
+
+    monkeypatch.setattr(app_module, "_leaderboard_accounts", fail_rebuild)
+    response = client.post(
+        "/competition/buy", json={"username": "alice", "competition_code": "LB1", "symbol": "AAPL", "quantity": 5}
+    )
+    assert response.status_code == 200
+
+    board = app_module.competition_leaderboards[("competition", 1)]
+    assert board.symbols() == ["MSFT", "AAPL"]
+    rows = client.get("/competition/LB1/leaderboard").get_json()
+    assert [(row["name"], row["total_value"]) for row in rows] == [("bob", 2100.0), ("alice", 1000.0)]
+
+
+def test_leaderboard_pages_with_offset_and_reports_total(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {f"user{index}": (1000.0 * index, []) for index in range(1, 6)})
+    monkeypatch.setattr(app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({}))
+
+    response = client.get("/competition/LB1/leaderboard?limit=2&offset=2")
+    assert response.headers["X-Total-Count"] == "5"
+    assert [(row["rank"], row["name"]) for row in response.get_json()] == [(3, "user3"), (4, "user2")]
+    assert client.get("/competition/LB1/leaderboard?offset=10").get_json() == []
+
+
+def test_leaderboard_headers_are_readable_by_the_frontend(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {"alice": (1000.0, [])})
+    monkeypatch.setattr(app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({}))
+
+    response = client.get(
+        "/competition/LB1/leaderboard?limit=1", headers={"Origin": "https://simulator.gostockpro.com"}
+    )
+
+    exposed = {header.strip() for header in response.headers["Access-Control-Expose-Headers"].split(",")}
+    assert {"X-Total-Count", "X-Leaderboard-Finalized-At", "ETag", "X-Request-Degraded"} <= exposed
+
+
+def test_rank_of_returns_rank_percentile_and_neighbours(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {f"user{index}": (1000.0 * index, []) for index in range(1, 6)})
+    monkeypatch.setattr(app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({}))
+    client.get("/competition/LB1/leaderboard")
+
+    def fail_revalue(self, account_ids):
+        if account_ids:
+            raise AssertionError("rank lookup should not re-value accounts")
+
+    monkeypatch.setattr(app_module.SortedLeaderboard, "_revalue", fail_revalue)
+    payload = client.get("/competition/LB1/leaderboard?rank_of=user2&neighbours=1").get_json()
+    assert payload["rank"] == 4
+    assert payload["participants"] == 5
+    assert payload["percentile"] == 40.0
+    assert payload["entry"]["name"] == "user2"
+    assert [row["name"] for row in payload["above"]] == ["user3"]
+    assert [row["name"] for row in payload["below"]] == ["user1"]
+
+    top = client.get("/competition/LB1/leaderboard?rank_of=user5").get_json()
+    assert (top["rank"], top["percentile"], top["above"]) == (1, 100.0, [])
+    missing = client.get("/competition/LB1/leaderboard?rank_of=nobody")
+    assert missing.status_code == 404
+
+
+def test_team_leaderboard_rank_of_uses_team_id(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        creator = app_module.User(username="creator", email="creator@example.com")
+        creator.set_password("StrongPass!234")
+        app_module.db.session.add(creator)
+        app_module.db.session.flush()
+        comp = app_module.Competition(code="LB1", name="Leaderboard", created_by=creator.id)
+        teams = [app_module.Team(name=f"Team {index}", created_by=creator.id) for index in range(3)]
+        app_module.db.session.add_all([comp, *teams])
+        app_module.db.session.flush()
+        app_module.db.session.add_all([
+            app_module.CompetitionTeam(competition_id=comp.id, team_id=team.id, cash_balance=1000.0 * (index + 1))
+            for index, team in enumerate(teams)
+        ])
+        app_module.db.session.commit()
+        middle_team_id = teams[1].id
+    monkeypatch.setattr(app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({}))
+
+    payload = client.get(f"/competition/LB1/team_leaderboard?rank_of={middle_team_id}").get_json()
+    assert (payload["rank"], payload["entry"]["name"]) == (2, "Team 1")
+    assert [row["name"] for row in payload["above"]] == ["Team 2"]
+
+
+def test_leaderboard_rebuild_uses_constant_queries_and_prices_symbols_once(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {
+        "alice": (1000.0, [("AAPL", 2, 100.0), ("AAPL", 2, 200.0)]),
+        "bob": (1000.0, [("AAPL", 1, 100.0), ("MSFT", 1, 100.0)]),
+    })
+    quote_calls = []
+
+    def fake_get_quotes(symbols):
+        quote_calls.append(sorted(symbols))
+        return app_module.QuoteBatch({s: (150.0, 150.0) for s in symbols})
+
+    monkeypatch.setattr(app_module, "get_quotes", fake_get_quotes)
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def rebuild_queries():
+        app_module.competition_leaderboards.clear()
+        with app_module.app.app_context():
+            engine = app_module.db.engine
+        app_module.event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            statements.clear()
+            rows = client.get("/competition/LB1/leaderboard").get_json()
+            return rows, len(statements)
+        finally:
+            app_module.event.remove(engine, "before_cursor_execute", count_statement)
+
+    small_rows, small_queries = rebuild_queries()
+    assert quote_calls == [["AAPL", "MSFT"]]
+    alice = next(row for row in small_rows if row["name"] == "alice")
+    assert alice["total_value"] == 1600.0
+    assert alice["pnl"] == 0.0
+
+    with app_module.app.app_context():
+        comp = app_module.Competition.query.filter_by(code="LB1").first()
+        for index in range(10):
+            user = app_module.User(username=f"extra{index}", email=f"extra{index}@example.com")
+            user.set_password("StrongPass!234")
+            app_module.db.session.add(user)
+            app_module.db.session.flush()
+            member = app_module.CompetitionMember(competition_id=comp.id, user_id=user.id)
+            app_module.db.session.add(member)
+            app_module.db.session.flush()
+            app_module.db.session.add(
+                app_module.CompetitionHolding(competition_member_id=member.id, symbol="NVDA", quantity=1, buy_price=10.0)
+            )
+        app_module.db.session.commit()
+
+    large_rows, large_queries = rebuild_queries()
+    assert len(large_rows) == 12
+    assert large_queries == small_queries
+
+
+def test_ended_competition_is_settled_once_and_served_from_results(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {
+        "alice": (1000.0, [("AAPL", 10, 100.0)]),
+        "bob": (1500.0, [("MSFT", 10, 100.0)]),
+    }, end_date=datetime.utcnow() - timedelta(hours=1))
+    quote_calls = []
+
+    def fake_get_quotes(symbols):
+        quote_calls.append(sorted(symbols))
+        return app_module.QuoteBatch({s: (150.0, 150.0) for s in symbols})
+
+    monkeypatch.setattr(app_module, "get_quotes", fake_get_quotes)
+    assert app_module.run_competition_finalization_job() == 1
+    assert app_module.run_competition_finalization_job() == 0
+    assert quote_calls == [["AAPL", "MSFT"]]
+
+    def fail_get_quotes(symbols):
+        raise AssertionError("final standings should not be re-priced")
+
+    monkeypatch.setattr(app_module, "get_quotes", fail_get_quotes)
+    response = client.get("/competition/LB1/leaderboard")
+    assert "X-Leaderboard-Finalized-At" in response.headers
+    assert [(row["rank"], row["name"], row["total_value"], row["pnl"]) for row in response.get_json()] == [
+        (1, "bob", 3000.0, 500.0), (2, "alice", 2500.0, 500.0),
+    ]
+    payload = client.get("/competition/LB1/leaderboard?rank_of=alice").get_json()
+    assert (payload["rank"], payload["percentile"], payload["above"][0]["name"]) == (2, 50.0, "bob")
+    assert client.get("/competition/LB1/team_leaderboard").get_json() == []
+
+
+def test_reads_never_settle_and_reopening_clears_results(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {
+        "alice": (1000.0, []),
+        "bob": (2000.0, []),
+    }, end_date=datetime.utcnow() - timedelta(hours=1))
+    monkeypatch.setattr(app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({}))
+
+    response = client.get("/competition/LB1/leaderboard")
+    assert "X-Leaderboard-Finalized-At" not in response.headers
+    assert [row["name"] for row in response.get_json()] == ["bob", "alice"]
+    with app_module.app.app_context():
+        assert app_module.CompetitionResult.query.count() == 0
+    assert app_module.run_competition_finalization_job() == 1
+    assert "X-Leaderboard-Finalized-At" in client.get("/competition/LB1/leaderboard").headers
+    with app_module.app.app_context():
+        assert app_module.CompetitionResult.query.count() == 2
+
+    response = client.post("/competition/update_dates", json={
+        "username": "creator",
+        "competition_code": "LB1",
+        "end_date": (datetime.utcnow() + timedelta(days=7)).strftime("%Y-%m-%d"),
+    })
+    assert response.status_code == 200
+    with app_module.app.app_context():
+        assert app_module.CompetitionResult.query.count() == 0
+        assert app_module.db.session.get(app_module.Competition, 1).finalized_at is None
+    response = client.get("/competition/LB1/leaderboard")
+    assert "X-Leaderboard-Finalized-At" not in response.headers
+    assert len(response.get_json()) == 2
+
+
+def test_removing_member_from_settled_competition_closes_rank_gap(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {
+        "alice": (1000.0, []),
+        "bob": (2000.0, []),
+        "carol": (3000.0, []),
+    }, end_date=datetime.utcnow() - timedelta(hours=1))
+    with app_module.app.app_context():
+        app_module.db.session.get(app_module.User, 1).is_admin = True
+        app_module.db.session.commit()
+    monkeypatch.setattr(app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({}))
+    assert app_module.run_competition_finalization_job() == 1
+
+    response = client.post("/admin/remove_user_from_competition", json={
+        "admin_username": "creator", "target_username": "bob", "competition_code": "LB1",
+    })
+    assert response.status_code == 200
+    rows = client.get("/competition/LB1/leaderboard").get_json()
+    assert [(row["rank"], row["name"]) for row in rows] == [(1, "carol"), (2, "alice")]
+
+
+def test_settlement_is_deferred_while_any_held_symbol_is_unpriced(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_competition(app_module, {
+        "alice": (1000.0, [("AAPL", 10, 100.0)]),
+        "bob": (1500.0, [("TSLA", 10, 100.0)]),
+    }, end_date=datetime.utcnow() - timedelta(hours=1))
+    quotes = {"AAPL": (150.0, 150.0)}
+    stale = {}
+
+    def fake_get_quotes(symbols):
+        batch = app_module.QuoteBatch({s: quotes[s] for s in symbols if s in quotes})
+        batch.stale = dict(stale)
+        return batch
+
+    monkeypatch.setattr(app_module, "get_quotes", fake_get_quotes)
+    assert app_module.run_competition_finalization_job() == 0
+
+    # A last-known fallback is not good enough for a permanent result either.
+    quotes["TSLA"] = (90.0, 90.0)
+    stale["TSLA"] = datetime.utcnow()
+    assert app_module.run_competition_finalization_job() == 0
+    with app_module.app.app_context():
+        assert app_module.CompetitionResult.query.count() == 0
+        assert app_module.db.session.get(app_module.Competition, 1).finalized_at is None
+
+    stale.clear()
+    assert app_module.run_competition_finalization_job() == 1
+    rows = client.get("/competition/LB1/leaderboard").get_json()
+    assert [(row["name"], row["total_value"]) for row in rows] == [("alice", 2500.0), ("bob", 2400.0)]
@@ -0,0 +1,1012 @@
+import importlib
+import json
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture()
+def app_client(tmp_path, monkeypatch):
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    db_path = tmp_path / "test.db"
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+    monkeypatch.setenv("APP_BASE_URL", "https://example.com")
+    if "msal" not in sys.modules:
+        sys.modules["msal"] = types.SimpleNamespace(ConfidentialClientApplication=object)
+    if "app" in sys.modules:
+        del sys.modules["app"]
+    app_module = importlib.import_module("app")
+    app_module.app.config["TESTING"] = True
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+    return app_module.app.test_client(), app_module
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail(f"condition not met within {timeout}s")
+        time.sleep(0.005)
+
+
+def test_quote_cache_serves_hits_until_ttl_expires(app_client):
+    _, app_module = app_client
+    clock = FakeClock()
+    cache = app_module.TTLCache(ttl_seconds=10, max_size=8, clock=clock)
+    calls = []
+
+    def fetcher():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_fetch("AAPL", fetcher) == 1
+    assert cache.get_or_fetch("AAPL", fetcher) == 1
+    clock.now += 11
+    assert cache.get_or_fetch("AAPL", fetcher) == 2
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_quote_cache_evicts_least_recently_used(app_client):
+    _, app_module = app_client
+    cache = app_module.TTLCache(ttl_seconds=60, max_size=2, clock=FakeClock())
+
+    cache.get_or_fetch("AAPL", lambda: 1)
+    cache.get_or_fetch("MSFT", lambda: 2)
+    cache.get_or_fetch("AAPL", lambda: 99)
+    cache.get_or_fetch("TSLA", lambda: 3)
+
+    assert cache.get_or_fetch("AAPL", lambda: 99) == 1
+    assert cache.get_or_fetch("MSFT", lambda: 42) == 42
+    assert cache.stats()["evictions"] == 2
+
+
+def test_quote_cache_coalesces_concurrent_misses(app_client):
+    _, app_module = app_client
+    cache = app_module.TTLCache(ttl_seconds=60, max_size=8)
+    release = threading.Event()
+    calls = []
+
+    def slow_fetcher():
+        calls.append(1)
+        release.wait(timeout=5)
+        return 123.0
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch("AAPL", slow_fetcher))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: cache.stats()["coalesced"] >= 4)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert results == [123.0] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_request_waits_on_an_in_flight_batch_refresh_only_for_its_budget(app_client):
+    _, app_module = app_client
+    cache = app_module.TTLCache(ttl_seconds=60, max_size=8)
+    release = threading.Event()
+
+    def slow_batch(keys):
+        release.wait(timeout=5)
+        return {key: 1.0 for key in keys}
+
+    refresher = threading.Thread(target=lambda: cache.refresh_many(["AAPL"], slow_batch))
+    refresher.start()
+    try:
+        wait_until(lambda: cache.stats()["in_flight"])
+        with app_module.app.test_request_context("/user"):
+            app_module.g.request_deadline = time.monotonic() + 0.2
+            started = time.monotonic()
+            assert cache.get_many(["AAPL"], slow_batch) == {}
+            with pytest.raises(app_module.DeadlineExceededError):
+                cache.get_or_fetch("AAPL", lambda: 2.0)
+            assert time.monotonic() - started < 1
+            assert app_module.is_request_degraded()
+    finally:
+        release.set()
+        refresher.join(timeout=5)
+    assert cache.stats()["wait_timeouts"] == 2
+    assert cache.get_or_fetch("AAPL", lambda: 2.0) == 1.0
+
+
+def test_cache_serves_stale_values_while_refreshing_in_background(app_client):
+    _, app_module = app_client
+    clock = FakeClock()
+    cache = app_module.TTLCache(ttl_seconds=10, max_size=8, stale_ttl_seconds=60, clock=clock)
+    refreshed = threading.Event()
+    versions = iter(["v1", "v2", "v3"])
+
+    def fetcher():
+        value = next(versions)
+        if value == "v2":
+            refreshed.set()
+        return value
+
+    assert cache.get_with_age("AAPL", fetcher) == ("v1", 0.0, False)
+
+    clock.now += 20
+    assert cache.get_with_age("AAPL", fetcher) == ("v1", 20.0, True)
+    assert refreshed.wait(timeout=5)
+    wait_until(lambda: not cache.stats()["in_flight"])
+    assert cache.get_with_age("AAPL", fetcher) == ("v2", 0.0, False)
+
+    # Past the stale window the refresh happens inline.
+    clock.now += 61
+    assert cache.get_with_age("AAPL", fetcher) == ("v3", 0.0, False)
+
+    stats = cache.stats()
+    assert stats["stale_hits"] == 1
+    assert stats["background_refreshes"] == 1
+
+
+def test_cache_keeps_stale_value_when_background_refresh_fails(app_client):
+    _, app_module = app_client
+    clock = FakeClock()
+    cache = app_module.TTLCache(ttl_seconds=10, max_size=8, stale_ttl_seconds=60, clock=clock)
+    cache.get_or_fetch("AAPL", lambda: "v1")
+    clock.now += 20
+
+    def failing():
+        raise Exception("provider down")
+
+    assert cache.get_or_fetch("AAPL", failing) == "v1"
+    wait_until(lambda: not cache.stats()["in_flight"])
+    assert cache.stats()["refresh_failures"] == 1
+    assert cache.get_or_fetch("AAPL", failing) == "v1"
+
+
+def test_quote_cache_does_not_cache_failures(app_client):
+    _, app_module = app_client
+    cache = app_module.TTLCache(ttl_seconds=60, max_size=8)
+
+    def failing():
+        raise Exception("provider down")
+
+    with pytest.raises(Exception):
+        cache.get_or_fetch("AAPL", failing)
+    assert cache.get_or_fetch("AAPL", lambda: 5.0) == 5.0
+
+
+def test_session_ttl_follows_market_session(app_client, monkeypatch):
+    _, app_module = app_client
+    eastern = app_module.pytz.timezone("America/New_York")
+    ttl = app_module._session_ttl(15, 120)
+
+    def at(*args):
+        monkeypatch.setattr(app_module, "_market_now", lambda: eastern.localize(app_module.datetime(*args)))
+        return ttl()
+
+    assert at(2024, 3, 5, 11, 0) == 15
+    assert at(2024, 3, 5, 8, 0) == 120
+    assert at(2024, 3, 5, 17, 0) == 120
+    # Tuesday evening stays fresh until Wednesday's open; Friday evening until Monday's.
+    assert at(2024, 3, 5, 21, 0) == 12.5 * 3600
+    assert at(2024, 3, 8, 21, 0) == 60.5 * 3600
+    assert at(2024, 3, 9, 12, 0) == 45.5 * 3600
+
+
+def test_closed_market_quotes_cost_no_provider_calls_until_next_open(app_client, monkeypatch):
+    _, app_module = app_client
+    eastern = app_module.pytz.timezone("America/New_York")
+    clock = FakeClock()
+    now_est = {"value": eastern.localize(app_module.datetime(2024, 3, 9, 12, 0))}
+    monkeypatch.setattr(app_module, "_market_now", lambda: now_est["value"])
+    monkeypatch.setattr(app_module.quote_cache, "_clock", clock)
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append(params.get("symbol"))
+        return FakeResponse({"Global Quote": {"05. price": "110.0", "08. previous close": "100.0"}})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+
+    assert app_module.get_current_price("AAPL") == 110.0
+    clock.now += 6 * 3600
+    assert app_module.get_current_price("AAPL") == 110.0
+    assert calls == ["AAPL"]
+
+    # Past Monday's open the entry expires and is refetched.
+    clock.now += 40 * 3600
+    assert app_module.get_current_price("AAPL") == 110.0
+    assert calls == ["AAPL", "AAPL"]
+
+
+def test_price_helpers_share_one_provider_call_per_symbol(app_client, monkeypatch):
+    client, app_module = app_client
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append(url)
+        return FakeResponse({"Global Quote": {"05. price": "110.0", "08. previous close": "100.0"}})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+
+    assert app_module.get_current_price("aapl") == 110.0
+    assert app_module.get_current_and_prev_close("AAPL") == (110.0, 100.0)
+    assert len(calls) == 1
+
+    stats = client.get("/admin/market_data_stats").get_json()["quote_cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_get_quotes_uses_one_bulk_call_and_falls_back_for_missing_symbols(app_client, monkeypatch):
+    _, app_module = app_client
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        params = params or {}
+        calls.append(params.get("function"))
+        if params.get("function") == "REALTIME_BULK_QUOTES":
+            assert params["symbol"] == "AAPL,MSFT,TSLA"
+            return FakeResponse({
+                "data": [
+                    {"symbol": "AAPL", "close": "110.0", "previous_close": "100.0"},
+                    {"symbol": "MSFT", "close": "300.0", "previous_close": "290.0", "change": "12.0"},
+                ]
+            })
+        if params.get("function") == "GLOBAL_QUOTE" and params.get("symbol") == "TSLA":
+            return FakeResponse({"Global Quote": {"05. price": "200.0", "08. previous close": "210.0"}})
+        raise AssertionError(f"Unexpected request {url} {params}")
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+
+    quotes = app_module.get_quotes(["AAPL", "MSFT", "aapl", "TSLA"])
+
+    assert quotes == {
+        "AAPL": (110.0, 100.0),
+        "MSFT": (300.0, 288.0),
+        "aapl": (110.0, 100.0),
+        "TSLA": (200.0, 210.0),
+    }
+    assert calls.count("REALTIME_BULK_QUOTES") == 1
+    assert len(calls) == 2
+
+    # Everything is cached now, so a repeat costs no provider calls.
+    assert app_module.get_quotes(["TSLA", "MSFT"]) == {"TSLA": (200.0, 210.0), "MSFT": (300.0, 288.0)}
+    assert len(calls) == 2
+
+
+def test_user_endpoint_prices_all_accounts_in_one_batch(app_client, monkeypatch):
+    client, app_module = app_client
+
+    with app_module.app.app_context():
+        user = app_module.User(username="tester", email="tester@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="AAPL", quantity=1, buy_price=90.0))
+        comp = app_module.Competition(code="BATCH1", name="Batch", created_by=user.id)
+        app_module.db.session.add(comp)
+        app_module.db.session.flush()
+        member = app_module.CompetitionMember(competition_id=comp.id, user_id=user.id, cash_balance=500.0)
+        app_module.db.session.add(member)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.CompetitionHolding(competition_member_id=member.id, symbol="MSFT", quantity=2, buy_price=10.0))
+        app_module.db.session.add(app_module.CompetitionHolding(competition_member_id=member.id, symbol="AAPL", quantity=3, buy_price=10.0))
+        app_module.db.session.commit()
+
+    batches = []
+
+    def fake_get_quotes(symbols):
+        batches.append(sorted(set(symbols)))
+        return {symbol: (100.0, 99.0) for symbol in symbols}
+
+    monkeypatch.setattr(app_module, "get_quotes", fake_get_quotes)
+
+    payload = client.get("/user", query_string={"username": "tester"}).get_json()
+
+    assert batches == [["AAPL", "MSFT"]]
+    assert payload["global_account"]["total_value"] == 1100.0
+    assert payload["competition_accounts"][0]["total_value"] == 1000.0
+
+
+def _seed_hot_symbols(app_module):
+    with app_module.app.app_context():
+        user = app_module.User(username="holder", email="holder@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="AAPL", quantity=1, buy_price=90.0))
+        app_module.db.session.add(app_module.CompetitionHolding(competition_member_id=1, symbol="msft", quantity=1, buy_price=10.0))
+        app_module.db.session.add(app_module.CompetitionTeamHolding(competition_team_id=1, symbol="NVDA", quantity=1, buy_price=10.0))
+        for symbol, status in (("TSLA", "open"), ("AMZN", "filled")):
+            app_module.db.session.add(app_module.LimitOrder(
+                user_id=user.id, symbol=symbol, side="buy", quantity=1, limit_price=1.0, status=status, filled_qty=0,
+            ))
+        app_module.db.session.commit()
+
+
+def test_hot_symbols_cover_holdings_open_orders_and_recent_requests(app_client):
+    _, app_module = app_client
+    _seed_hot_symbols(app_module)
+    app_module._note_symbol_requests(["IBM"])
+
+    assert app_module.collect_hot_symbols() == ["AAPL", "IBM", "MSFT", "NVDA", "TSLA"]
+
+
+def test_hot_symbol_refresher_refreshes_due_symbols_in_budgeted_batches(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_hot_symbols(app_module)
+    eastern = app_module.pytz.timezone("America/New_York")
+    monkeypatch.setattr(app_module, "_market_now", lambda: eastern.localize(app_module.datetime(2024, 3, 5, 11, 0)))
+    monkeypatch.setattr(app_module, "BULK_QUOTE_BATCH_SIZE", 2)
+    monkeypatch.setattr(app_module, "HOT_SYMBOL_REFRESH_MAX_CALLS", 1)
+    clock = FakeClock()
+    monkeypatch.setattr(app_module.quote_cache, "_clock", clock)
+    app_module.quote_cache.get_or_fetch("AAPL", lambda: {"05. price": "100.0"})
+    clock.now += 6
+    app_module.quote_cache.get_or_fetch("IBM", lambda: {"05. price": "100.0"})
+    app_module._note_symbol_requests(["IBM"])
+    bulk_requests = []
+
+    def fake_get(url, params=None, timeout=None):
+        bulk_requests.append(params["symbol"])
+        return FakeResponse({"data": [{"symbol": symbol, "close": "50.0"} for symbol in params["symbol"].split(",")]})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+
+    # AAPL is still fresh but expires before the next cycle, so it is due along with the missing symbols.
+    first = app_module.refresh_hot_symbols()
+    assert first["hot_symbols"] == 5
+    assert first["due"] == 4
+    assert first["refreshed"] == 2
+    assert first["deferred"] == 2
+    assert bulk_requests == ["MSFT,NVDA"]
+
+    second = app_module.refresh_hot_symbols()
+    assert second["refreshed"] == 2
+    assert bulk_requests == ["MSFT,NVDA", "TSLA,AAPL"]
+    assert app_module.get_current_price("AAPL") == 50.0
+
+    stats = client.get("/admin/market_data_stats").get_json()["hot_symbol_refresher"]
+    assert stats["cycles"] == 2
+    assert stats["symbols_refreshed"] == 4
+    assert stats["last_cycle"]["duration_ms"] >= 0
+
+
+def test_hot_symbol_refresher_only_runs_during_regular_session(app_client, monkeypatch):
+    _, app_module = app_client
+    _seed_hot_symbols(app_module)
+    eastern = app_module.pytz.timezone("America/New_York")
+    monkeypatch.setattr(app_module, "_market_now", lambda: eastern.localize(app_module.datetime(2024, 3, 9, 11, 0)))
+
+    def fail_get(url, params=None, timeout=None):
+        raise AssertionError("refresher should not call the provider while the market is closed")
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fail_get)
+
+    assert app_module.refresh_hot_symbols() is None
+    assert app_module.hot_symbol_refresh_stats["skipped_cycles"] == 1
+
+
+def test_provider_client_retries_server_errors_and_throttle_notes(app_client):
+    _, app_module = app_client
+    delays = []
+    client = app_module.AlphaVantageClient("demo", max_retries=2, backoff_base=0.5, sleep=delays.append)
+    replies = [
+        FakeResponse({}, status_code=503),
+        FakeResponse({"Note": "Thank you for using Alpha Vantage! Please slow down."}),
+        FakeResponse({"Global Quote": {"05. price": "10"}}),
+    ]
+    seen = []
+
+    def fake_get(url, params=None, timeout=None):
+        seen.append((params, timeout))
+        return replies.pop(0)
+
+    client.session.get = fake_get
+
+    data = client.query({"function": "GLOBAL_QUOTE", "symbol": "AAPL"})
+
+    assert data == {"Global Quote": {"05. price": "10"}}
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0
+    assert all(params["apikey"] == "demo" for params, _ in seen)
+    assert all(timeout == (client.connect_timeout, client.read_timeout) for _, timeout in seen)
+
+    stats = client.stats()
+    assert stats["requests"] == 3
+    assert stats["retries"] == 2
+    assert stats["throttled"] == 1
+    assert stats["latency_ms"]["window"] == 3
+
+
+def test_provider_client_gives_up_after_bounded_retries(app_client):
+    _, app_module = app_client
+    client = app_module.AlphaVantageClient("demo", max_retries=1, sleep=lambda delay: None)
+    attempts = []
+
+    def fake_get(url, params=None, timeout=None):
+        attempts.append(1)
+        raise app_module.requests.ConnectionError("connection reset")
+
+    client.session.get = fake_get
+
+    with pytest.raises(Exception, match="request failed"):
+        client.query({"function": "GLOBAL_QUOTE", "symbol": "AAPL"})
+    assert len(attempts) == 2
+
+
+def test_provider_client_does_not_retry_client_errors(app_client):
+    _, app_module = app_client
+    client = app_module.AlphaVantageClient("demo", max_retries=3, sleep=lambda delay: None)
+    attempts = []
+
+    def fake_get(url, params=None, timeout=None):
+        attempts.append(1)
+        return FakeResponse({}, status_code=403)
+
+    client.session.get = fake_get
+
+    with pytest.raises(Exception, match="403"):
+        client.query({"function": "GLOBAL_QUOTE", "symbol": "AAPL"})
+    assert len(attempts) == 1
+
+
+def test_rate_limiter_serves_trades_before_waiting_batch_work(app_client):
+    _, app_module = app_client
+    clock = FakeClock()
+    limiter = app_module.ProviderRateLimiter(rate_per_minute=60, burst=1, clock=clock)
+    limiter.acquire("batch")
+    order = []
+
+    def worker(priority):
+        limiter.acquire(priority)
+        order.append(priority)
+
+    batch = threading.Thread(target=worker, args=("batch",))
+    batch.start()
+    wait_until(lambda: limiter.stats()["classes"]["batch"]["queue_depth"] >= 1)
+    trade = threading.Thread(target=worker, args=("trade",))
+    trade.start()
+    wait_until(lambda: limiter.stats()["classes"]["trade"]["queue_depth"] >= 1)
+
+    clock.now += 1
+    trade.join(timeout=5)
+    assert order == ["trade"]
+    assert limiter.stats()["classes"]["batch"]["queue_depth"] == 1
+
+    clock.now += 1
+    batch.join(timeout=5)
+    assert order == ["trade", "batch"]
+
+    stats = limiter.stats()["classes"]
+    assert stats["trade"]["delayed"] == 1
+    assert stats["trade"]["wait_ms"]["max"] == 1000.0
+    assert stats["batch"]["acquired"] == 2
+    assert stats["batch"]["wait_ms"]["max"] == 2000.0
+
+
+def test_rate_limiter_keeps_reserve_away_from_batch_work(app_client):
+    _, app_module = app_client
+    limiter = app_module.ProviderRateLimiter(
+        rate_per_minute=60, burst=3, batch_reserve=2,
+        max_wait={"trade": 0, "display": 0, "batch": 0}, clock=FakeClock(),
+    )
+
+    limiter.acquire("batch")
+    with pytest.raises(Exception, match="rate limit"):
+        limiter.acquire("batch")
+    limiter.acquire("display")
+    limiter.acquire("trade")
+    with pytest.raises(Exception, match="rate limit"):
+        limiter.acquire("trade")
+
+    stats = limiter.stats()["classes"]
+    assert stats["batch"]["timeouts"] == 1
+    assert stats["trade"]["timeouts"] == 1
+
+
+def test_market_data_priority_follows_request_endpoint(app_client):
+    _, app_module = app_client
+
+    assert app_module.current_market_data_priority() == "batch"
+    with app_module.app.test_request_context("/buy", method="POST"):
+        assert app_module.current_market_data_priority() == "trade"
+    with app_module.app.test_request_context("/user"):
+        assert app_module.current_market_data_priority() == "display"
+
+
+def _write_replay_fixtures(directory):
+    (directory / "quotes.csv").write_text(
+        "symbol,price,previous_close,change\n"
+        "AAPL,110.0,100.0,\n"
+        "MSFT,300.0,290.0,12.0\n"
+    )
+    (directory / "bars.json").write_text(json.dumps([
+        {"symbol": "AAPL", "interval": "daily", "timestamp": "2024-03-04", "close": "100.0"},
+        {"symbol": "AAPL", "interval": "daily", "timestamp": "2024-03-05", "close": "104.0"},
+        {"symbol": "AAPL", "interval": "daily", "timestamp": "2024-03-06", "close": "108.0"},
+    ]))
+
+
+def test_replay_provider_serves_quotes_and_bars_from_fixtures(app_client, monkeypatch, tmp_path):
+    _, app_module = app_client
+    _write_replay_fixtures(tmp_path)
+    delays = []
+    provider = app_module.ReplayMarketDataProvider(str(tmp_path), latency_ms=40, jitter_ms=10, seed=7, sleep=delays.append)
+    monkeypatch.setattr(app_module, "market_data_provider", provider)
+
+    assert app_module.get_quotes(["AAPL", "MSFT", "ZZZZ"]) == {"AAPL": (110.0, 100.0), "MSFT": (300.0, 288.0)}
+
+    series = provider.time_series("aapl", "daily")
+    today = app_module._market_now().date()
+    assert sorted(series) == [(today - app_module.timedelta(days=offset)).isoformat() for offset in (2, 1, 0)]
+    assert series[today.isoformat()]["4. close"] == "108.0"
+    with pytest.raises(Exception, match="No valid chart data"):
+        provider.time_series("MSFT", "daily")
+
+    assert len(delays) == 4
+    assert all(0.03 <= delay <= 0.05 for delay in delays)
+    assert provider.stats()["provider"] == "replay"
+    assert provider.stats()["requests"] == 4
+
+
+def test_incomplete_market_data_provider_fails_at_construction(app_client):
+    _, app_module = app_client
+
+    class QuotesOnly(app_module.MarketDataProvider):
+        def global_quote(self, symbol):
+            return {}
+
+    with pytest.raises(TypeError, match="bulk_quotes"):
+        QuotesOnly()
+
+
+def test_replay_provider_injects_errors_reproducibly(app_client, tmp_path):
+    _, app_module = app_client
+    _write_replay_fixtures(tmp_path)
+
+    def outcomes():
+        provider = app_module.ReplayMarketDataProvider(str(tmp_path), error_rate=0.5, seed=42)
+        results = []
+        for _ in range(20):
+            try:
+                provider.global_quote("AAPL")
+                results.append(True)
+            except Exception:
+                results.append(False)
+        return results, provider.stats()
+
+    first, stats = outcomes()
+    second, _ = outcomes()
+    assert first == second
+    assert 0 < first.count(False) < 20
+    assert stats["injected_errors"] == first.count(False) == stats["errors"]
+
+
+def test_market_data_provider_is_selected_by_environment(tmp_path, monkeypatch):
+    _write_replay_fixtures(tmp_path)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("MARKET_DATA_PROVIDER", "replay")
+    monkeypatch.setenv("MARKET_DATA_REPLAY_PATH", str(tmp_path))
+    if "msal" not in sys.modules:
+        sys.modules["msal"] = types.SimpleNamespace(ConfidentialClientApplication=object)
+    sys.modules.pop("app", None)
+    app_module = importlib.import_module("app")
+    app_module.app.config["TESTING"] = True
+    with app_module.app.app_context():
+        app_module.db.create_all()
+
+    def fail_get(url, params=None, timeout=None):
+        raise AssertionError("replay runs must not touch the network")
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fail_get)
+
+    response = app_module.app.test_client().get("/stock/AAPL")
+    assert response.get_json() == {"symbol": "AAPL", "price": 110.0}
+    assert app_module.build_stock_overview("AAPL", "1M")["current_price"] == 110.0
+
+
+def test_circuit_breaker_fails_fast_while_open_and_recovers_after_probe(app_client):
+    _, app_module = app_client
+    clock = FakeClock()
+    breaker = app_module.ProviderCircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock)
+    client = app_module.AlphaVantageClient("demo", max_retries=0, sleep=lambda delay: None, circuit_breaker=breaker)
+    replies = [FakeResponse({}, status_code=503), FakeResponse({}, status_code=503)]
+    attempts = []
+
+    def fake_get(url, params=None, timeout=None):
+        attempts.append(1)
+        return replies.pop(0) if replies else FakeResponse({"Global Quote": {"05. price": "10"}})
+
+    client.session.get = fake_get
+
+    for _ in range(2):
+        with pytest.raises(Exception, match="503"):
+            client.global_quote("AAPL")
+    with pytest.raises(app_module.MarketDataUnavailableError):
+        client.global_quote("AAPL")
+    assert len(attempts) == 2
+    assert breaker.stats()["state"] == "open"
+
+    clock.now += 31
+    assert client.global_quote("AAPL") == {"05. price": "10"}
+    stats = breaker.stats()
+    assert stats["state"] == "closed"
+    assert stats["short_circuited"] == 1
+    assert stats["times_opened"] == 1
+
+
+def test_retryable_errors_are_retried_inside_a_request_budget(app_client):
+    _, app_module = app_client
+    breaker = app_module.ProviderCircuitBreaker(failure_threshold=5, reset_seconds=30)
+    client = app_module.AlphaVantageClient("demo", sleep=lambda delay: None, circuit_breaker=breaker)
+    replies = [FakeResponse({}, status_code=503), FakeResponse({"Note": "Thank you for using Alpha Vantage!"})]
+
+    def fake_get(url, params=None, timeout=None):
+        return replies.pop(0) if replies else FakeResponse({"Global Quote": {"05. price": "10"}})
+
+    client.session.get = fake_get
+
+    with app_module.app.test_request_context("/stock/AAPL"):
+        app_module.g.request_deadline = time.monotonic() + 8
+        assert client.global_quote("AAPL") == {"05. price": "10"}
+        assert not app_module.is_request_degraded()
+    assert client.stats()["retries"] == 2
+    assert breaker.stats()["consecutive_failures"] == 0
+
+
+def test_provider_failure_cut_short_by_the_deadline_counts_against_the_breaker(app_client):
+    _, app_module = app_client
+    breaker = app_module.ProviderCircuitBreaker(failure_threshold=5, reset_seconds=30)
+    client = app_module.AlphaVantageClient("demo", sleep=lambda delay: None, circuit_breaker=breaker)
+    client.session.get = lambda url, params=None, timeout=None: FakeResponse({}, status_code=503)
+
+    with app_module.app.test_request_context("/stock/AAPL"):
+        app_module.g.request_deadline = time.monotonic() + 0.2
+        with pytest.raises(app_module.DeadlineExceededError):
+            client.global_quote("AAPL")
+        assert app_module.is_request_degraded()
+    assert breaker.stats()["consecutive_failures"] == 1
+
+
+def test_valuation_falls_back_to_last_known_price_when_provider_fails(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="stale", email="stale@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="AAPL", quantity=2, buy_price=90.0))
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="MSFT", quantity=1, buy_price=90.0))
+        app_module.db.session.commit()
+
+    def healthy_get(url, params=None, timeout=None):
+        return FakeResponse({"Global Quote": {"05. price": "110.0", "08. previous close": "100.0"}})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", healthy_get)
+    app_module.get_quotes(["AAPL"])
+    assert app_module.persist_last_known_prices() == 1
+
+    # Restart: memory and cache are empty, the provider is down, and only the table remains.
+    app_module._last_known_prices.clear()
+    app_module.quote_cache.clear()
+
+    def failing_get(url, params=None, timeout=None):
+        return FakeResponse({}, status_code=500)
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", failing_get)
+    monkeypatch.setattr(app_module.market_data_client, "_sleep", lambda delay: None)
+
+    quotes = app_module.get_quotes(["AAPL", "MSFT"])
+    assert quotes == {"AAPL": (110.0, 100.0)}
+    assert list(app_module.stale_quote_symbols(quotes)) == ["AAPL"]
+
+    payload = client.get("/user", query_string={"username": "stale"}).get_json()
+    global_account = payload["global_account"]
+    assert global_account["prices_stale"] is True
+    assert global_account["total_value"] == 1220.0
+    assert [row["price_is_stale"] for row in global_account["portfolio"]] == [True, False]
+
+
+def test_rejected_symbols_are_refused_without_another_provider_call(app_client, monkeypatch):
+    client, app_module = app_client
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append(params["symbol"])
+        return FakeResponse({"Global Quote": {}})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+
+    first = client.get("/stock/APPLE")
+    second = client.get("/stock/apple")
+
+    assert first.status_code == second.status_code == 400
+    assert "Unknown symbol APPLE" in second.get_json()["error"]
+    assert calls == ["APPLE"]
+    assert app_module.get_quotes(["APPLE"]) == {}
+    assert calls == ["APPLE"]
+
+
+def test_quota_and_error_replies_do_not_mark_symbols_unknown(app_client, monkeypatch):
+    client, app_module = app_client
+    replies = [
+        FakeResponse({"Information": "Thank you for using Alpha Vantage! Our standard API rate limit is 25 requests per day."}),
+        FakeResponse({"Error Message": "Invalid API call."}),
+    ]
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append(params["symbol"])
+        return replies.pop(0) if replies else FakeResponse({"Global Quote": {"05. price": "110.0"}})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+    monkeypatch.setattr(app_module.market_data_client, "max_retries", 0)
+
+    assert client.get("/stock/AAPL").status_code == 400
+    assert client.get("/stock/AAPL").status_code == 400
+    assert app_module.is_known_symbol("AAPL")
+    assert app_module.market_data_client.stats()["throttled"] == 1
+
+    assert client.get("/stock/AAPL").get_json() == {"symbol": "AAPL", "price": 110.0}
+    assert calls == ["AAPL", "AAPL", "AAPL"]
+
+
+def _write_listing(path):
+    path.write_text(
+        "symbol,name,exchange,assetType,ipoDate,delistingDate,status\n"
+        "AAPL,Apple Inc,NASDAQ,Stock,1980-12-12,null,Active\n"
+        "AAL,American Airlines Group Inc,NASDAQ,Stock,2013-12-09,null,Active\n"
+        "AA,Alcoa Corp,NYSE,Stock,2016-10-18,null,Active\n"
+        "MSFT,Microsoft Corporation,NASDAQ,Stock,1986-03-13,null,Active\n"
+        "TWTR,Twitter Inc,NYSE,Stock,2013-11-07,2022-10-27,Delisted\n"
+    )
+
+
+def test_symbol_index_refuses_unlisted_symbols_and_backs_search(app_client, monkeypatch, tmp_path):
+    client, app_module = app_client
+    listing = tmp_path / "listing_status.csv"
+    _write_listing(listing)
+    monkeypatch.setattr(app_module, "symbol_index", app_module.SymbolIndex.load(str(listing)))
+
+    def fail_get(url, params=None, timeout=None):
+        raise AssertionError("unlisted symbols must not reach the provider")
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fail_get)
+
+    response = client.post("/buy", json={"username": "nobody", "symbol": "TWTR", "quantity": 1})
+    assert response.status_code == 400
+    assert "Unknown symbol TWTR" in response.get_json()["message"]
+
+    results = client.get("/symbols/search", query_string={"q": "aa"}).get_json()
+    assert [row["symbol"] for row in results] == ["AA", "AAL", "AAPL"]
+    assert results[2] == {"symbol": "AAPL", "name": "Apple Inc", "exchange": "NASDAQ", "asset_type": "Stock"}
+
+    by_name = client.get("/symbols/search", query_string={"q": "micro", "limit": 5}).get_json()
+    assert [row["symbol"] for row in by_name] == ["MSFT"]
+    assert client.get("/symbols/search", query_string={"q": "a", "limit": 1}).get_json()[0]["symbol"] == "AA"
+
+
+def test_symbol_listing_refresh_writes_the_file_and_enables_the_index(app_client, monkeypatch, tmp_path):
+    client, app_module = app_client
+    source = tmp_path / "source.csv"
+    _write_listing(source)
+    replies = [source.read_text(), '{"Information": "Daily quota reached."}']
+
+    def fake_get(url, params=None, timeout=None):
+        assert params["function"] == "LISTING_STATUS"
+        return types.SimpleNamespace(status_code=200, text=replies.pop(0))
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+    monkeypatch.setattr(app_module, "symbol_index", app_module.SymbolIndex())
+    listing = tmp_path / "data" / "listing_status.csv"
+
+    assert app_module.refresh_symbol_listing(str(listing)) == 4
+    assert app_module.SymbolIndex.load(str(listing)).listings == app_module.symbol_index.listings
+    assert client.get("/symbols/search", query_string={"q": "MSFT"}).status_code == 200
+
+    with pytest.raises(Exception, match="no active symbols"):
+        app_module.refresh_symbol_listing(str(listing))
+    assert len(app_module.SymbolIndex.load(str(listing)).listings) == 4
+
+
+def test_symbol_search_reports_missing_index(app_client):
+    client, _ = app_client
+
+    response = client.get("/symbols/search", query_string={"q": "AA"})
+
+    assert response.status_code == 503
+
+
+def _seed_user_with_holdings(app_module, username, symbols):
+    with app_module.app.app_context():
+        user = app_module.User(username=username, email=f"{username}@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        for symbol in symbols:
+            app_module.db.session.add(app_module.Holding(user_id=user.id, symbol=symbol, quantity=1, buy_price=90.0))
+        app_module.db.session.commit()
+
+
+def test_user_request_returns_degraded_partial_payload_when_budget_runs_out(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_user_with_holdings(app_module, "slow", ["AAPL", "MSFT", "TSLA"])
+    app_module._remember_quotes({"AAPL": {"05. price": "120.0", "08. previous close": "118.0"}})
+    monkeypatch.setattr(app_module, "REQUEST_DEADLINE_SECONDS", 0.3)
+    timeouts = []
+
+    def slow_get(url, params=None, timeout=None):
+        timeouts.append(timeout)
+        time.sleep(timeout[1])
+        raise app_module.requests.Timeout("read timed out")
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", slow_get)
+
+    started = time.monotonic()
+    response = client.get("/user", query_string={"username": "slow"})
+    elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    assert response.headers["X-Request-Degraded"] == "true"
+    payload = response.get_json()
+    assert payload["degraded"] is True
+    assert [row["current_price"] for row in payload["global_account"]["portfolio"]] == [120.0, 0, 0]
+    assert len(timeouts) == 1
+    assert timeouts[0][1] <= 0.3
+    assert elapsed < 1.5
+
+
+def test_price_and_overview_endpoints_report_an_exhausted_budget_as_503(app_client, monkeypatch):
+    client, app_module = app_client
+
+    def out_of_budget(*args):
+        app_module.mark_request_degraded()
+        raise app_module.DeadlineExceededError("Request deadline exceeded before market data request")
+
+    monkeypatch.setattr(app_module, "get_current_price", out_of_budget)
+    monkeypatch.setattr(app_module, "build_stock_overview", out_of_budget)
+
+    responses = [
+        client.get("/stock/AAPL"),
+        client.get("/stock_overview/AAPL"),
+        client.get("/stock_chart/AAPL"),
+        client.post("/buy", json={"username": "nobody", "symbol": "AAPL", "quantity": 1}),
+        client.post("/sell", json={"username": "nobody", "symbol": "AAPL", "quantity": 1}),
+    ]
+    for response in responses:
+        assert response.status_code == 503
+        assert response.get_json()["code"] == "deadline_exceeded"
+        assert response.headers["X-Request-Degraded"] == "true"
+
+
+def test_database_reads_past_the_grace_period_fail_fast(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_user_with_holdings(app_module, "late", [])
+    monkeypatch.setattr(app_module, "REQUEST_DEADLINE_SECONDS", 1e-9)
+    monkeypatch.setattr(app_module, "REQUEST_DEADLINE_DB_GRACE_SECONDS", 0)
+
+    response = client.get("/user", query_string={"username": "late"})
+
+    assert response.status_code == 503
+    assert response.get_json()["code"] == "deadline_exceeded"
+    assert response.get_json()["degraded"] is True
+
+
+def test_deadline_listeners_are_bound_to_this_apps_engine_and_session(app_client):
+    _, app_module = app_client
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.orm import Session
+
+    check_read = app_module._check_request_deadline_before_read
+    bound_timeout = app_module._bound_statement_timeout
+    with app_module.app.app_context():
+        assert event.contains(app_module.db.engine, "before_cursor_execute", check_read)
+    assert event.contains(app_module.db.session, "after_begin", bound_timeout)
+    assert not event.contains(Engine, "before_cursor_execute", check_read)
+    assert not event.contains(Session, "after_begin", bound_timeout)
+
+
+def test_user_quote_misses_are_fetched_concurrently_within_the_cap(app_client, monkeypatch):
+    client, app_module = app_client
+    _seed_user_with_holdings(app_module, "fanout", ["AAPL", "MSFT", "TSLA", "NVDA", "AMZN", "META"])
+    monkeypatch.setattr(app_module, "ALPHA_VANTAGE_BULK_QUOTES_ENABLED", False)
+    monkeypatch.setattr(app_module, "QUOTE_FETCH_CONCURRENCY", 3)
+    monkeypatch.setattr(app_module, "quote_fetch_executor", app_module.ThreadPoolExecutor(max_workers=3))
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+    priorities = []
+
+    def slow_get(url, params=None, timeout=None):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            priorities.append(app_module.current_market_data_priority())
+        time.sleep(0.2)
+        with lock:
+            in_flight[0] -= 1
+        return FakeResponse({"Global Quote": {"05. price": "100.0", "08. previous close": "99.0"}})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", slow_get)
+
+    started = time.monotonic()
+    payload = client.get("/user", query_string={"username": "fanout"}).get_json()
+    elapsed = time.monotonic() - started
+
+    assert payload["global_account"]["total_value"] == 1600.0
+    assert peak[0] == 3
+    assert priorities == ["display"] * 6
+    assert elapsed < 1.0
+
+
+def test_request_fan_out_does_not_queue_behind_batch_work(app_client, monkeypatch):
+    _, app_module = app_client
+    monkeypatch.setattr(app_module, "quote_fetch_executor", app_module.ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(app_module, "batch_quote_fetch_executor", app_module.ThreadPoolExecutor(max_workers=2))
+    release = threading.Event()
+
+    def blocked(item):
+        release.wait(timeout=5)
+        return item
+
+    batch = threading.Thread(target=lambda: app_module._fan_out(blocked, ["A", "B"]))
+    batch.start()
+    try:
+        with app_module.app.test_request_context("/user"):
+            app_module.g.request_deadline = time.monotonic() + 2
+            started = time.monotonic()
+            outcomes = app_module._fan_out(lambda item: item.lower(), ["C", "D"])
+            assert time.monotonic() - started < 1
+        assert outcomes == [("C", "c", None), ("D", "d", None)]
+    finally:
+        release.set()
+        batch.join(timeout=5)
+
+
+def test_request_fan_out_waits_only_for_the_remaining_budget(app_client):
+    _, app_module = app_client
+    release = threading.Event()
+
+    def slow(item):
+        if item == "SLOW":
+            release.wait(timeout=5)
+        return item
+
+    try:
+        with app_module.app.test_request_context("/user"):
+            app_module.g.request_deadline = time.monotonic() + 0.2
+            started = time.monotonic()
+            outcomes = app_module._fan_out(slow, ["FAST", "SLOW"])
+            assert time.monotonic() - started < 1
+            assert app_module.is_request_degraded()
+    finally:
+        release.set()
+    assert outcomes[0] == ("FAST", "FAST", None)
+    assert isinstance(outcomes[1][2], app_module.DeadlineExceededError)
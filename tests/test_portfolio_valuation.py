@@ -0,0 +1,500 @@
+import importlib
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture()
+def app_client(tmp_path, monkeypatch):
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    db_path = tmp_path / "test.db"
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+    monkeypatch.setenv("APP_BASE_URL", "https://example.com")
+    if "msal" not in sys.modules:
+        sys.modules["msal"] = types.SimpleNamespace(ConfidentialClientApplication=object)
+    if "app" in sys.modules:
+        del sys.modules["app"]
+    app_module = importlib.import_module("app")
+    app_module.app.config["TESTING"] = True
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+    return app_module.app.test_client(), app_module
+
+
+def _holding(symbol, quantity, buy_price):
+    return types.SimpleNamespace(symbol=symbol, quantity=quantity, buy_price=buy_price)
+
+
+def test_value_portfolios_aggregates_positions_per_account(app_client):
+    _, app_module = app_client
+    frame = app_module.HoldingsFrame()
+    frame.add(("global", 1), [_holding("AAPL", 10, 90.0), _holding("MSFT", 2, 200.0)])
+    frame.add(("competition", 1), [_holding("AAPL", 5, 110.0)])
+    frame.add(("team_competition", 1), [])
+    quotes = {"AAPL": (100.0, 95.0), "MSFT": (250.0, 240.0)}
+
+    valuation = app_module.value_portfolios(
+        frame,
+        quotes,
+        cash={("global", 1): 500.0, ("competition", 1): 0.0, ("team_competition", 1): 1000.0},
+    )
+
+    assert valuation.account(("global", 1)) == {
+        "market_value": 1500.0,
+        "unrealized_pnl": 200.0,
+        "prev_close_value": 1430.0,
+        "cash": 500.0,
+        "total_value": 2000.0,
+    }
+    assert valuation.account(("competition", 1))["unrealized_pnl"] == -50.0
+    assert valuation.account(("team_competition", 1))["total_value"] == 1000.0
+    assert valuation.positions(("global", 1)) == [(100.0, 1000.0, 100.0, 0.5), (250.0, 500.0, 100.0, 0.25)]
+    assert valuation.positions(("team_competition", 1)) == []
+
+
+def test_value_portfolios_missing_price_is_zero_or_cost(app_client):
+    _, app_module = app_client
+    frame = app_module.HoldingsFrame()
+    frame.add("a", [_holding("GONE", 4, 25.0)])
+
+    assert app_module.value_portfolios(frame, {}).account("a")["market_value"] == 0.0
+    at_cost = app_module.value_portfolios(frame, {}, missing_price_uses_cost=True).account("a")
+    assert at_cost["market_value"] == 100.0
+    assert at_cost["unrealized_pnl"] == 0.0
+
+
+def test_user_endpoint_reports_position_weights(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="weights", email="weights@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="AAPL", quantity=30, buy_price=90.0))
+        app_module.db.session.commit()
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: (100.0, 100.0) for s in symbols})
+    )
+
+    response = client.get("/user", query_string={"username": "weights"})
+
+    assert response.status_code == 200
+    account = response.get_json()["global_account"]
+    assert account["total_value"] == 4000.0
+    assert account["portfolio"][0]["weight"] == 0.75
+
+
+def _add_competition_accounts(app_module, user_id, start, count):
+    for index in range(start, start + count):
+        comp = app_module.Competition(code=f"C{index}", name=f"Comp {index}", created_by=user_id)
+        team = app_module.Team(name=f"Team {index}", created_by=user_id)
+        app_module.db.session.add_all([comp, team])
+        app_module.db.session.flush()
+        member = app_module.CompetitionMember(competition_id=comp.id, user_id=user_id)
+        comp_team = app_module.CompetitionTeam(competition_id=comp.id, team_id=team.id)
+        app_module.db.session.add_all([member, comp_team, app_module.TeamMember(team_id=team.id, user_id=user_id)])
+        app_module.db.session.flush()
+        app_module.db.session.add_all([
+            app_module.CompetitionHolding(competition_member_id=member.id, symbol="AAPL", quantity=1, buy_price=90.0),
+            app_module.CompetitionTeamHolding(competition_team_id=comp_team.id, symbol="MSFT", quantity=2, buy_price=90.0),
+        ])
+    app_module.db.session.commit()
+
+
+def test_account_assembly_query_count_does_not_grow_with_memberships(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="busy", email="busy@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+        user_id = user.id
+        _add_competition_accounts(app_module, user_id, 0, 1)
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: (100.0, 100.0) for s in symbols})
+    )
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def query_counts():
+        with app_module.app.app_context():
+            engine = app_module.db.engine
+        # Memberships are seeded directly, so drop cached payloads and count an uncached rebuild.
+        app_module.user_payload_cache.clear()
+        client.get("/user", query_string={"username": "busy"})
+        app_module.user_payload_cache.clear()
+        app_module.event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            statements.clear()
+            user_response = client.get("/user", query_string={"username": "busy"})
+            user_queries = len(statements)
+            statements.clear()
+            login_response = client.post(
+                "/login", json={"username": "busy", "password": "StrongPass!234", "include_valuation": True}
+            )
+            login_queries = len(statements)
+        finally:
+            app_module.event.remove(engine, "before_cursor_execute", count_statement)
+        return user_response.get_json(), login_response.get_json(), user_queries, login_queries
+
+    small_user, small_login, small_user_queries, small_login_queries = query_counts()
+    with app_module.app.app_context():
+        _add_competition_accounts(app_module, user_id, 1, 7)
+    large_user, large_login, large_user_queries, large_login_queries = query_counts()
+
+    assert len(small_user["competition_accounts"]) == 1
+    assert len(large_user["competition_accounts"]) == 8
+    assert len(large_user["team_competitions"]) == 8
+    assert len(large_login["team_competitions"]) == 8
+    assert large_user["team_competitions"][3]["portfolio"][0]["quantity"] == 2
+    assert large_user_queries == small_user_queries
+    assert large_login_queries == small_login_queries
+
+
+def test_login_returns_account_stubs_without_pricing_by_default(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="quick", email="quick@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+        _add_competition_accounts(app_module, user.id, 0, 2)
+    priced = []
+
+    def fake_get_quotes(symbols):
+        priced.append(list(symbols))
+        return app_module.QuoteBatch({s: (100.0, 100.0) for s in symbols})
+
+    monkeypatch.setattr(app_module, "get_quotes", fake_get_quotes)
+
+    payload = client.post("/login", json={"username": "quick", "password": "StrongPass!234"}).get_json()
+
+    assert priced == []
+    assert payload["accounts_valued"] is False
+    assert [a["competition_code"] for a in payload["competition_accounts"]] == ["C0", "C1"]
+    assert payload["team_competitions"][1]["team_name"] == "Team 1"
+    assert "portfolio" not in payload["competition_accounts"][0]
+
+    valued = client.post(
+        "/login", query_string={"include_valuation": "1"}, json={"username": "quick", "password": "StrongPass!234"}
+    ).get_json()
+
+    assert len(priced) == 1
+    assert valued["accounts_valued"] is True
+    assert valued["competition_accounts"][0]["total_value"] == 100100.0
+    assert valued["team_competitions"][0]["portfolio"][0]["total_value"] == 200.0
+
+
+def _state(app_module, account_type, account_id):
+    with app_module.app.app_context():
+        state = app_module.db.session.get(app_module.AccountState, (account_type, account_id))
+        return None if state is None else state.positions
+
+
+def test_trades_keep_account_state_in_step_with_holdings(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="trader", email="trader@example.com", cash_balance=10000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+        user_id = user.id
+    prices = {"AAPL": 100.0, "MSFT": 50.0}
+    monkeypatch.setattr(app_module, "get_current_price", lambda symbol: prices[symbol])
+
+    client.post("/buy", json={"username": "trader", "symbol": "AAPL", "quantity": 10})
+    client.post("/buy", json={"username": "trader", "symbol": "MSFT", "quantity": 4})
+    assert _state(app_module, "global", user_id) == [["AAPL", 10, 100.0], ["MSFT", 4, 50.0]]
+
+    prices["AAPL"] = 120.0
+    client.post("/sell", json={"username": "trader", "symbol": "AAPL", "quantity": 10})
+    assert _state(app_module, "global", user_id) == [["MSFT", 4, 50.0]]
+
+    client.post("/reset_global", json={"username": "trader"})
+    assert _state(app_module, "global", user_id) is None
+
+
+def test_reads_never_write_missing_account_states_and_the_backfill_stores_them(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        users = []
+        for username in ("lazy", "idle"):
+            user = app_module.User(username=username, email=f"{username}@example.com", cash_balance=1000.0)
+            user.set_password("StrongPass!234")
+            app_module.db.session.add(user)
+            app_module.db.session.flush()
+            app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="AAPL", quantity=3, buy_price=90.0))
+            users.append(user.id)
+        app_module.db.session.commit()
+    lazy_id, idle_id = users
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: (100.0, 100.0) for s in symbols})
+    )
+    writes = []
+
+    def record_write(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("SELECT"):
+            writes.append(statement)
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    app_module.event.listen(engine, "before_cursor_execute", record_write)
+    try:
+        response = client.get("/user", query_string={"username": "lazy"})
+    finally:
+        app_module.event.remove(engine, "before_cursor_execute", record_write)
+    assert response.get_json()["global_account"]["total_value"] == 1300.0
+    assert writes == []
+    assert _state(app_module, "global", lazy_id) is None
+
+    with app_module.app.app_context():
+        # A state a trade already stored is kept; only missing ones are written.
+        app_module.sync_account_state("global", app_module.db.session.get(app_module.User, idle_id), "AAPL")
+        app_module.db.session.commit()
+        assert app_module.backfill_account_states(batch_size=1) == 1
+        assert app_module.backfill_account_states() == 0
+    assert _state(app_module, "global", lazy_id) == [["AAPL", 3, 90.0]]
+    assert _state(app_module, "global", idle_id) == [["AAPL", 3, 90.0]]
+
+
+def test_schema_sync_drops_unread_account_state_columns(app_client):
+    _, app_module = app_client
+    with app_module.app.app_context():
+        app_module.db.session.execute(app_module.text("ALTER TABLE account_state ADD COLUMN cash FLOAT NOT NULL DEFAULT 0"))
+        app_module.db.session.execute(app_module.text("ALTER TABLE account_state ADD COLUMN last_valuation FLOAT"))
+        app_module.db.session.commit()
+
+        app_module.ensure_schema_compatibility()
+
+        columns = {c["name"] for c in app_module.inspect(app_module.db.engine).get_columns("account_state")}
+    assert columns == {"account_type", "account_id", "positions"}
+
+
+def test_position_limit_check_values_account_from_state(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="capped", email="capped@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        comp = app_module.Competition(code="CAP1", name="Capped", created_by=1, max_position_limit="50%")
+        app_module.db.session.add_all([user, comp])
+        app_module.db.session.flush()
+        member = app_module.CompetitionMember(competition_id=comp.id, user_id=user.id, cash_balance=3000.0)
+        app_module.db.session.add(member)
+        app_module.db.session.flush()
+        app_module.db.session.add(
+            app_module.CompetitionHolding(competition_member_id=member.id, symbol="MSFT", quantity=10, buy_price=90.0)
+        )
+        app_module.db.session.commit()
+        member_id = member.id
+    monkeypatch.setattr(app_module, "get_current_price", lambda symbol: 100.0)
+    quoted = []
+
+    def fake_get_quotes(symbols):
+        quoted.append(sorted(symbols))
+        return app_module.QuoteBatch({s: (100.0, 100.0) for s in symbols})
+
+    monkeypatch.setattr(app_module, "get_quotes", fake_get_quotes)
+
+    rejected = client.post("/competition/buy", json={"username": "capped", "competition_code": "CAP1", "symbol": "AAPL", "quantity": 25})
+    accepted = client.post("/competition/buy", json={"username": "capped", "competition_code": "CAP1", "symbol": "AAPL", "quantity": 15})
+
+    assert rejected.status_code == 400
+    assert accepted.status_code == 200
+    assert quoted == [["MSFT"], ["MSFT"]]
+    assert _state(app_module, "competition", member_id) == [["MSFT", 10, 90.0], ["AAPL", 15, 100.0]]
+
+
+def test_user_payload_cache_remarks_prices_and_rebuilds_after_trades(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="poller", email="poller@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+    prices = {"AAPL": 100.0}
+    monkeypatch.setattr(app_module, "get_current_price", lambda symbol: prices[symbol])
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: (prices[s], prices[s]) for s in symbols})
+    )
+    builds = []
+    build = app_module._build_user_payload_structure
+    monkeypatch.setattr(app_module, "_build_user_payload_structure", lambda u, *args: builds.append(u.id) or build(u, *args))
+
+    def total_value():
+        return client.get("/user", query_string={"username": "poller"}).get_json()["global_account"]["total_value"]
+
+    assert total_value() == 1000.0
+    client.post("/buy", json={"username": "poller", "symbol": "AAPL", "quantity": 5})
+    assert total_value() == 1000.0
+    prices["AAPL"] = 120.0
+    assert total_value() == 1100.0
+    assert len(builds) == 2
+
+    stats = client.get("/admin/market_data_stats").get_json()["user_payload_cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["rebuild_ms"]["window"] == 2
+
+
+def test_deleting_a_user_refreshes_cached_payloads_of_their_teams_members(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        users = {}
+        for username in ("admin", "owner", "mate", "rival"):
+            user = app_module.User(username=username, email=f"{username}@example.com", is_admin=username == "admin")
+            user.set_password("StrongPass!234")
+            app_module.db.session.add(user)
+            users[username] = user
+        app_module.db.session.flush()
+        owners_comp = app_module.Competition(code="OWN1", name="Owner's", created_by=users["owner"].id)
+        other_comp = app_module.Competition(code="OTH1", name="Other", created_by=users["admin"].id)
+        owners_team = app_module.Team(name="Owner's team", created_by=users["owner"].id)
+        rivals_team = app_module.Team(name="Rival team", created_by=users["rival"].id)
+        app_module.db.session.add_all([owners_comp, other_comp, owners_team, rivals_team])
+        app_module.db.session.flush()
+        app_module.db.session.add_all([
+            app_module.TeamMember(team_id=owners_team.id, user_id=users["owner"].id),
+            app_module.TeamMember(team_id=owners_team.id, user_id=users["mate"].id),
+            app_module.TeamMember(team_id=rivals_team.id, user_id=users["rival"].id),
+            app_module.CompetitionTeam(competition_id=other_comp.id, team_id=owners_team.id),
+            app_module.CompetitionTeam(competition_id=owners_comp.id, team_id=rivals_team.id),
+        ])
+        app_module.db.session.commit()
+    monkeypatch.setattr(app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({}))
+
+    def team_codes(username):
+        payload = client.get("/user", query_string={"username": username}).get_json()
+        return [account["competition_code"] for account in payload["team_competitions"]]
+
+    assert team_codes("mate") == ["OTH1"]
+    assert team_codes("rival") == ["OWN1"]
+
+    response = client.post("/admin/delete_user", json={"username": "admin", "target_username": "owner"})
+    assert response.status_code == 200
+
+    assert team_codes("mate") == []
+    assert team_codes("rival") == []
+
+
+def test_user_since_token_returns_not_modified_then_value_deltas(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="delta", email="delta@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="AAPL", quantity=2, buy_price=90.0))
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="MSFT", quantity=1, buy_price=50.0))
+        app_module.db.session.commit()
+    prices = {"AAPL": 100.0, "MSFT": 60.0}
+    monkeypatch.setattr(app_module, "get_current_price", lambda symbol: prices[symbol])
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: (prices[s], prices[s]) for s in symbols})
+    )
+
+    full = client.get("/user", query_string={"username": "delta"}).get_json()
+    assert full["delta"] is False
+    assert full["global_account"]["total_value"] == 1260.0
+
+    unchanged = client.get("/user", query_string={"username": "delta", "since": full["version"]})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["ETag"] == f'"{full["version"]}"'
+
+    prices["AAPL"] = 110.0
+    delta = client.get("/user", query_string={"username": "delta", "since": full["version"]}).get_json()
+    assert delta["delta"] is True
+    assert delta["since"] == full["version"]
+    [account] = delta["accounts"]
+    assert account["account_id"] == full["global_account"]["account_id"]
+    assert account["total_value"] == 1280.0
+    assert account["portfolio"][0] == {"symbol": "AAPL", "current_price": 110.0, "total_value": 220.0, "weight": 220.0 / 1280.0}
+    assert set(account["portfolio"][1]) == {"symbol", "weight"}
+    assert "cash_balance" not in account
+
+    client.post("/buy", json={"username": "delta", "symbol": "MSFT", "quantity": 1})
+    after_trade = client.get("/user", query_string={"username": "delta", "since": delta["version"]}).get_json()
+    assert after_trade["delta"] is False
+    assert after_trade["global_account"]["cash_balance"] == 940.0
+
+
+def test_user_today_pnl_uses_baseline_captured_at_open(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        user = app_module.User(username="opener", email="opener@example.com", cash_balance=1000.0)
+        user.set_password("StrongPass!234")
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.Holding(user_id=user.id, symbol="AAPL", quantity=10, buy_price=90.0))
+        app_module.db.session.commit()
+        user_id = user.id
+    quotes = {"AAPL": (100.0, 95.0), "MSFT": (50.0, 48.0)}
+    monkeypatch.setattr(app_module, "get_current_price", lambda symbol: quotes[symbol][0])
+    monkeypatch.setattr(
+        app_module, "get_quotes", lambda symbols: app_module.QuoteBatch({s: quotes[s] for s in symbols})
+    )
+
+    with app_module.app.app_context():
+        assert app_module.capture_daily_baselines() > 0
+        trading_date = app_module._trading_date()
+        assert app_module.db.session.get(app_module.DailyPrevClose, (trading_date, "AAPL")).prev_close == 95.0
+        baseline = app_module.db.session.get(app_module.AccountDailyBaseline, (trading_date, "global", user_id))
+        assert baseline.start_of_day_value == 1950.0
+
+    # An intraday buy moves cash into stock without changing today's P&L at the fill price.
+    client.post("/buy", json={"username": "opener", "symbol": "MSFT", "quantity": 4})
+    quotes["AAPL"] = (101.0, 1.0)  # a quote with a bad previous close must not move the baseline
+    account = client.get("/user", query_string={"username": "opener"}).get_json()["global_account"]
+
+    assert account["start_of_day_value"] == 1950.0
+    assert account["total_value"] == 2010.0
+    assert account["pnl_today"] == 60.0
+
+
+def test_baseline_capture_skips_accounts_with_unquoted_symbols_and_prunes_old_days(app_client, monkeypatch):
+    client, app_module = app_client
+    with app_module.app.app_context():
+        priced = app_module.User(username="priced", email="priced@example.com", cash_balance=1000.0)
+        unpriced = app_module.User(username="unpriced", email="unpriced@example.com", cash_balance=1000.0)
+        for user in (priced, unpriced):
+            user.set_password("StrongPass!234")
+        app_module.db.session.add_all([priced, unpriced])
+        app_module.db.session.flush()
+        app_module.db.session.add_all([
+            app_module.Holding(user_id=priced.id, symbol="AAPL", quantity=10, buy_price=90.0),
+            app_module.Holding(user_id=unpriced.id, symbol="AAPL", quantity=1, buy_price=90.0),
+            app_module.Holding(user_id=unpriced.id, symbol="TSLA", quantity=10, buy_price=50.0),
+            app_module.Holding(user_id=unpriced.id, symbol="NVDA", quantity=1, buy_price=50.0),
+        ])
+        trading_date = app_module._trading_date()
+        old_date = trading_date - app_module.timedelta(days=app_module.DAILY_BASELINE_RETENTION_DAYS + 1)
+        app_module.db.session.add_all([
+            app_module.DailyPrevClose(trading_date=old_date, symbol="AAPL", prev_close=80.0),
+            app_module.AccountDailyBaseline(
+                trading_date=old_date, account_type="global", account_id=priced.id, start_of_day_value=1.0
+            ),
+        ])
+        app_module.db.session.commit()
+        priced_id, unpriced_id = priced.id, unpriced.id
+
+    def fake_get_quotes(symbols):
+        # TSLA has no quote at all; NVDA only a last-known fallback from an earlier day.
+        batch = app_module.QuoteBatch({s: (100.0, 95.0) for s in symbols if s != "TSLA"})
+        batch.stale = {"NVDA": app_module.datetime.utcnow()}
+        return batch
+
+    monkeypatch.setattr(app_module, "get_quotes", fake_get_quotes)
+
+    with app_module.app.app_context():
+        assert app_module.capture_daily_baselines(trading_date) == 1
+        get = app_module.db.session.get
+        assert get(app_module.AccountDailyBaseline, (trading_date, "global", priced_id)).start_of_day_value == 1950.0
+        assert get(app_module.AccountDailyBaseline, (trading_date, "global", unpriced_id)) is None
+        assert [row.symbol for row in app_module.DailyPrevClose.query.all()] == ["AAPL"]
+        assert app_module.AccountDailyBaseline.query.filter_by(trading_date=old_date).count() == 0
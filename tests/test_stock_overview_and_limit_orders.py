@@ -97,7 +97,7 @@ def create_user(app_module, username="tester", email="user@example.com", passwor
 
 def test_today_metrics_invariant_across_ranges(app_client, monkeypatch):
     _, app_module = app_client
-    monkeypatch.setattr(app_module.requests, "get", make_fake_get(current_price=105.0, prev_close=100.0))
+    monkeypatch.setattr(app_module.market_data_client.session, "get", make_fake_get(current_price=105.0, prev_close=100.0))
 
     today_values = []
     for r in ["1D", "1W", "1M", "6M", "1Y"]:
@@ -113,7 +113,7 @@ def test_today_metrics_invariant_across_ranges(app_client, monkeypatch):
 def test_today_metrics_use_global_quote_change_fields(app_client, monkeypatch):
     _, app_module = app_client
     monkeypatch.setattr(
-        app_module.requests,
+        app_module.market_data_client.session,
         "get",
         make_fake_get(current_price=123.0, prev_close=100.0, quote_change=7.5, quote_change_percent="6.10%"),
     )
@@ -132,7 +132,7 @@ def test_today_metrics_use_global_quote_change_fields(app_client, monkeypatch):
 def test_one_day_range_uses_today_change_metrics(app_client, monkeypatch):
     _, app_module = app_client
     monkeypatch.setattr(
-        app_module.requests,
+        app_module.market_data_client.session,
         "get",
         make_fake_get(current_price=123.0, prev_close=100.0, quote_change=7.5, quote_change_percent="6.10%"),
     )
@@ -146,7 +146,7 @@ def test_one_day_range_uses_today_change_metrics(app_client, monkeypatch):
 
 def test_one_day_chart_points_include_only_today(app_client, monkeypatch):
     _, app_module = app_client
-    monkeypatch.setattr(app_module.requests, "get", make_fake_get(current_price=110.0, prev_close=100.0))
+    monkeypatch.setattr(app_module.market_data_client.session, "get", make_fake_get(current_price=110.0, prev_close=100.0))
 
     payload = app_module.build_stock_overview("AAPL", "1D")
 
@@ -155,7 +155,7 @@ def test_one_day_chart_points_include_only_today(app_client, monkeypatch):
 
 def test_range_metrics_correctness_and_sorted_points(app_client, monkeypatch):
     _, app_module = app_client
-    monkeypatch.setattr(app_module.requests, "get", make_fake_get(current_price=110.0, prev_close=100.0))
+    monkeypatch.setattr(app_module.market_data_client.session, "get", make_fake_get(current_price=110.0, prev_close=100.0))
 
     payload = app_module.build_stock_overview("AAPL", "1M")
     assert payload["range_start_price"] == 90.0
@@ -167,7 +167,7 @@ def test_range_metrics_correctness_and_sorted_points(app_client, monkeypatch):
 
 def test_prev_close_fallback_behavior(app_client, monkeypatch):
     _, app_module = app_client
-    monkeypatch.setattr(app_module.requests, "get", make_fake_get(current_price=110.0, prev_close=0.0))
+    monkeypatch.setattr(app_module.market_data_client.session, "get", make_fake_get(current_price=110.0, prev_close=0.0))
 
     payload = app_module.build_stock_overview("AAPL", "1W")
     assert payload["prev_close_price"] == 98.0
@@ -201,7 +201,7 @@ def test_limit_order_persistence_and_status_transitions(app_client, monkeypatch)
 
 def test_integration_metrics_consistency_across_requests(app_client, monkeypatch):
     client, app_module = app_client
-    monkeypatch.setattr(app_module.requests, "get", make_fake_get(current_price=111.0, prev_close=100.0))
+    monkeypatch.setattr(app_module.market_data_client.session, "get", make_fake_get(current_price=111.0, prev_close=100.0))
 
     first = client.get("/stock_overview/AAPL", query_string={"range": "1W"}).get_json()
     second = client.get("/stock_overview/AAPL", query_string={"range": "1W"}).get_json()
@@ -340,7 +340,7 @@ def test_user_endpoint_today_pnl_uses_quote_change_when_prev_close_is_stale(app_
         app_module.db.session.commit()
 
     def fake_get(url, params=None, timeout=None):
-        if "function=GLOBAL_QUOTE" in url and "symbol=BITX" in url:
+        if params and params.get("function") == "GLOBAL_QUOTE" and params.get("symbol") == "BITX":
             return FakeResponse(
                 {
                     "Global Quote": {
@@ -352,7 +352,7 @@ def test_user_endpoint_today_pnl_uses_quote_change_when_prev_close_is_stale(app_
             )
         raise AssertionError(f"Unexpected url {url}")
 
-    monkeypatch.setattr(app_module.requests, "get", fake_get)
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
 
     payload = client.get("/user", query_string={"username": "tester"}).get_json()
     comp = payload["competition_accounts"][0]
@@ -450,3 +450,162 @@ def test_trade_blotter_includes_account_field_and_competition_trades(app_client,
     assert len(rows) == 1
     assert rows[0]["account_context"] == "competition:COMP1234"
     assert rows[0]["account"] == "competition:COMP1234"
+
+
+def test_chart_ranges_are_served_from_stored_price_bars(app_client, monkeypatch):
+    _, app_module = app_client
+    fake_get = make_fake_get(current_price=110.0, prev_close=100.0)
+    functions = []
+
+    def counting_get(url, params=None, timeout=None):
+        functions.append(params.get("function"))
+        return fake_get(url, params=params, timeout=timeout)
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", counting_get)
+
+    first = app_module.build_stock_overview("AAPL", "1M")
+    second = app_module.build_stock_overview("AAPL", "1W")
+
+    assert functions.count("TIME_SERIES_DAILY_ADJUSTED") == 1
+    assert first["chart_points"][-1] == second["chart_points"][-1]
+    with app_module.app.app_context():
+        assert app_module.PriceBar.query.filter_by(symbol="AAPL", interval="daily").count() == 4
+
+
+def test_price_bar_sync_only_tops_up_the_missing_tail(app_client, monkeypatch):
+    _, app_module = app_client
+    today = datetime.utcnow().date()
+    d0, d1, d2 = today.isoformat(), (today - timedelta(days=1)).isoformat(), (today - timedelta(days=2)).isoformat()
+    series = {d1: {"4. close": "98"}, d2: {"4. close": "95"}}
+
+    def fake_get(url, params=None, timeout=None):
+        return FakeResponse({"Time Series (Daily)": dict(series)})
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", fake_get)
+    app_module.sync_price_bars("AAPL", "daily")
+
+    # The provider revises the in-progress bar and publishes a new one.
+    series[d1] = {"4. close": "99"}
+    series[d0] = {"4. close": "101"}
+    parsed_since = []
+    original_parse = app_module._parse_price_bars
+
+    def tracking_parse(time_series, since_key=None):
+        parsed_since.append(since_key)
+        return original_parse(time_series, since_key=since_key)
+
+    monkeypatch.setattr(app_module, "_parse_price_bars", tracking_parse)
+    assert app_module.sync_price_bars("AAPL", "daily") is False
+    assert app_module.sync_price_bars("AAPL", "daily", force=True) is True
+
+    assert parsed_since == [d1]
+    bars = app_module.load_price_bars("AAPL", "daily")
+    assert [bar["price"] for bar in bars] == [95.0, 99.0, 101.0]
+
+
+def test_intraday_sync_prunes_bars_outside_the_retention_window(app_client, monkeypatch):
+    _, app_module = app_client
+    today = datetime.utcnow().date()
+    old = (today - timedelta(days=app_module.PRICE_BAR_INTRADAY_RETENTION_DAYS + 1)).isoformat()
+    recent = (today - timedelta(days=1)).isoformat()
+    series = {
+        f"{old} 15:55:00": {"4. close": "80"},
+        f"{recent} 15:55:00": {"4. close": "89"},
+        f"{today.isoformat()} 09:35:00": {"4. close": "90"},
+    }
+    monkeypatch.setattr(
+        app_module.market_data_client.session, "get",
+        lambda url, params=None, timeout=None: FakeResponse({"Time Series (5min)": series}),
+    )
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.PriceBar(
+            symbol="AAPL", interval="daily", timestamp=datetime(2000, 1, 3), close=1.0,
+        ))
+        app_module.db.session.commit()
+
+    app_module.sync_price_bars("AAPL", "5min")
+
+    assert [bar["price"] for bar in app_module.load_price_bars("AAPL", "5min")] == [89.0, 90.0]
+    assert len(app_module.load_price_bars("AAPL", "daily")) == 1
+
+
+def test_all_ranges_and_prev_close_fallback_share_one_fetch_per_series(app_client, monkeypatch):
+    client, app_module = app_client
+    fake_get = make_fake_get(current_price=110.0, prev_close=0.0)
+    functions = []
+
+    def counting_get(url, params=None, timeout=None):
+        functions.append(params.get("function"))
+        return fake_get(url, params=params, timeout=timeout)
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", counting_get)
+
+    for r in ["1D", "1W", "1M", "6M", "1Y"]:
+        overview = client.get("/stock_overview/AAPL", query_string={"range": r}).get_json()
+        assert overview["prev_close_price"] == 98.0
+    chart = client.get("/stock_chart/AAPL", query_string={"range": "1Y"}).get_json()
+
+    assert chart == [{"date": p["timestamp"], "close": p["price"]} for p in overview["chart_points"]]
+    assert sorted(functions) == sorted([
+        "GLOBAL_QUOTE",
+        "TIME_SERIES_INTRADAY",
+        "TIME_SERIES_DAILY_ADJUSTED",
+        "TIME_SERIES_WEEKLY_ADJUSTED",
+    ])
+
+
+def test_failed_series_only_affects_ranges_built_from_it(app_client, monkeypatch):
+    client, app_module = app_client
+    fake_get = make_fake_get(current_price=110.0, prev_close=100.0)
+    intraday_down = [True]
+    functions = []
+
+    def flaky_get(url, params=None, timeout=None):
+        functions.append(params.get("function"))
+        if params.get("function") == "TIME_SERIES_INTRADAY" and intraday_down[0]:
+            return FakeResponse({"Error Message": "Invalid API call."})
+        return fake_get(url, params=params, timeout=timeout)
+
+    monkeypatch.setattr(app_module.market_data_client.session, "get", flaky_get)
+    weekend = app_module.pytz.timezone("America/New_York").localize(datetime(2024, 3, 9, 11, 0))
+    monkeypatch.setattr(app_module, "_market_now", lambda: weekend)
+
+    assert client.get("/stock_overview/AAPL", query_string={"range": "1D"}).status_code == 400
+    monthly = client.get("/stock_overview/AAPL", query_string={"range": "1M"})
+    assert monthly.status_code == 200
+    assert monthly.get_json()["range_start_price"] == 90.0
+
+    # Once the provider recovers, the next read retries only the failed series.
+    intraday_down[0] = False
+    del functions[:]
+    assert client.get("/stock_overview/AAPL", query_string={"range": "1D"}).status_code == 200
+    assert functions == ["TIME_SERIES_INTRADAY"]
+    assert app_module.stock_range_cache.stats()["size"] == 1
+
+
+def _fresh_overview_wrapper(build):
+    def wrapper(*args, **kwargs):
+        overview = build(*args, **kwargs)
+        overview["metadata"]["is_stale"] = False
+        return overview
+    return wrapper
+
+
+def test_stock_overview_reports_cache_age_in_staleness(app_client, monkeypatch):
+    client, app_module = app_client
+    monkeypatch.setattr(app_module.market_data_client.session, "get", make_fake_get(current_price=110.0, prev_close=100.0))
+    now = [1000.0]
+    monkeypatch.setattr(app_module.stock_range_cache, "_clock", lambda: now[0])
+    regular_session = app_module.pytz.timezone("America/New_York").localize(datetime(2024, 3, 5, 11, 0))
+    monkeypatch.setattr(app_module, "_market_now", lambda: regular_session)
+    monkeypatch.setattr(app_module, "_overview_for_range", _fresh_overview_wrapper(app_module._overview_for_range))
+
+    first = client.get("/stock_overview/AAPL", query_string={"range": "1M"}).get_json()
+    assert first["metadata"]["is_stale"] is False
+    assert first["metadata"]["cache_age_seconds"] == 0.0
+
+    now[0] += app_module.STOCK_RANGE_CACHE_TTL_SECONDS + 1
+    stale = client.get("/stock_overview/AAPL", query_string={"range": "1M"}).get_json()
+    assert stale["metadata"]["is_stale"] is True
+    assert stale["metadata"]["cache_age_seconds"] == app_module.STOCK_RANGE_CACHE_TTL_SECONDS + 1
+    assert stale["current_price"] == first["current_price"]